@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
 import asyncio
+import copy
 import httpx
 import os
 import re
@@ -8,19 +9,33 @@ import logging
 import time
 import html  # For escaping HTML special characters
 from urllib.parse import urlparse, quote
-from requests import post, get, RequestException  # For the synchronous terabox link fetching part
 from collections import deque
 from datetime import datetime  # Added for elapsed time calculation
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram.ext import Application, CallbackContext, ChatMemberHandler, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 from telegram.constants import ParseMode
 from telegram.error import RetryAfter 
-
-try:
-    import aria2p  # For aria2c RPC
-except ImportError:
-    aria2p = None  # Handle missing library gracefully
+from pyrogram import Client as MTProtoClient, enums as mtproto_enums
+
+from aria2_events import Aria2Notifier, aria2_ws_url
+from aria2_rpc import Aria2RPC, Aria2RPCError, Aria2StatusBoard
+from aria2_tuner import Aria2Tuner
+from file_index import FileIndex
+from file_parts import FileRange, build_part_manifest, file_part_name, plan_file_parts
+from job_journal import JobJournal
+from job_scheduler import JobScheduler, OrderedPipeline, QueueFull
+from link_batch import LinkBatch, LinkBatchItem, dedupe_links
+from link_cache import LinkCache, extract_share_id
+from link_refresh import LinkExpiryWatch, is_expiry_error, link_expired, match_refreshed_file
+from membership_cache import MembershipCache
+from metrics import observe_aria2_download, observe_resolver, register_pipeline, stage_duration, start_metrics_server, transfer_bytes
+from status_scheduler import StatusScheduler
+from stream_upload import BIG_FILE_MIN_SIZE, FilePartSource, send_uploaded_file, upload_big_file
+from resolver_client import ResolverClient
+from resolver_health import ResolverHealth
+from storage_manager import StorageFull, StorageManager, preallocate, probe_content_length
+from terabox_share import TeraboxShareError, TeraboxShareResolver
 
 # === Configuration ===
 BOT_TOKEN = os.getenv("BOT_TOKEN", "7893919705:AAE9b6jpHFdxzQQIucrNMEvje2u7N8uL15o")
@@ -44,13 +59,87 @@ ARIA2_GLOBAL_OPTIONS = {
     "max-connection-per-server": "16", 
     "max-concurrent-downloads": "10",  
     "optimize-concurrent-downloads": "true",
+    "file-allocation": "falloc",  # Claim the whole file up front so a full disk fails at the start
 }
+ARIA2_STATUS_REFRESH_INTERVAL = 2.0  # Seconds between progress edits; completion is event driven
+ARIA2_STATUS_POLL_INTERVAL = float(os.getenv("ARIA2_STATUS_POLL_INTERVAL", 1.0))  # One multicall per tick for all jobs
+ARIA2_TUNER_ENABLED = os.getenv("ARIA2_TUNER_ENABLED", "true").lower() == "true"  # Per-host split/connections from observed throughput
+ARIA2_TUNER_EXPLORE = float(os.getenv("ARIA2_TUNER_EXPLORE", 0.1))  # Share of downloads that try a non-best connection count
+ARIA2_MAX_MIRRORS = int(os.getenv("ARIA2_MAX_MIRRORS", 4))  # Alternate links of a file handed to aria2 with the main one; 0 = main link only
+ARIA2_TUNER_FILE = os.getenv("ARIA2_TUNER_FILE", "aria2_tuning.json")  # Learned throughputs kept across restarts; empty = memory only
+LINK_REFRESH_MAX_ATTEMPTS = int(os.getenv("LINK_REFRESH_MAX_ATTEMPTS", 3))  # Re-resolutions of one file whose direct link expired mid-download; 0 = fail as before
+LINK_STALL_SECONDS = float(os.getenv("LINK_STALL_SECONDS", 30))  # Seconds without progress before a download's link is checked for expiry
+
+# === Resolver Configuration ===
+RESOLVER_TIMEOUT = 30
+RESOLVER_ASYNC_ENABLED = os.getenv("RESOLVER_ASYNC_ENABLED", "true").lower() == "true"
+RESOLVER_HEDGE_DELAY = float(os.getenv("RESOLVER_HEDGE_DELAY", 2.0))  # Seconds before the next API joins the race
+RESOLVER_MIRROR_GRACE = float(os.getenv("RESOLVER_MIRROR_GRACE", 1.0))  # Extra seconds for losing APIs to answer with mirror links; 0 = cancel at once
+RESOLVER_HTTP2 = os.getenv("RESOLVER_HTTP2", "true").lower() == "true"  # Needs the h2 package; falls back to HTTP/1.1 without it
+RESOLVER_MAX_CONNECTIONS = int(os.getenv("RESOLVER_MAX_CONNECTIONS", 50))  # Shared by every job's resolver calls
+RESOLVER_KEEPALIVE_SECONDS = float(os.getenv("RESOLVER_KEEPALIVE_SECONDS", 120))  # Idle time before a pooled connection is closed
+RESOLVER_DNS_TTL = float(os.getenv("RESOLVER_DNS_TTL", 300))  # Seconds a resolver host's addresses are cached
+RESOLVER_PREWARM = os.getenv("RESOLVER_PREWARM", "true").lower() == "true"  # Connect to the resolver APIs at startup
+LINK_CACHE_MAX_ENTRIES = int(os.getenv("LINK_CACHE_MAX_ENTRIES", 1024))
+LINK_CACHE_TTL = float(os.getenv("LINK_CACHE_TTL", 7200))  # Terabox direct links stay valid for a few hours
+LINK_CACHE_NEGATIVE_TTL = float(os.getenv("LINK_CACHE_NEGATIVE_TTL", 60))
+LINK_CACHE_FILE = os.getenv("LINK_CACHE_FILE", "")  # Optional on-disk backing, e.g. link_cache.json
+FILE_INDEX_DB = os.getenv("FILE_INDEX_DB", "file_index.db")  # share ID + file -> uploaded Telegram message
+RESOLVER_HEALTH_FILE = os.getenv("RESOLVER_HEALTH_FILE", "resolver_health.json")  # Endpoint scores kept across restarts; empty = memory only
+RESOLVER_BREAKER_FAILURES = int(os.getenv("RESOLVER_BREAKER_FAILURES", 3))  # Failures in a row before an API is skipped
+RESOLVER_BREAKER_SECONDS = float(os.getenv("RESOLVER_BREAKER_SECONDS", 60))  # First skip period; doubles while the API keeps failing
+RESOLVER_PROBE_URL = os.getenv("RESOLVER_PROBE_URL", "")  # A public share used to probe skipped APIs in the background
+RESOLVER_PROBE_INTERVAL = float(os.getenv("RESOLVER_PROBE_INTERVAL", 30))
+TERABOX_COOKIE = os.getenv("TERABOX_COOKIE", "")  # ndus=... of a Terabox web login; resolves links with Terabox's own API first
+TERABOX_API_BASE = os.getenv("TERABOX_API_BASE", "https://www.terabox.com")
+
+# === Job Scheduler Configuration ===
+JOB_RESOLVE_CONCURRENCY = int(os.getenv("JOB_RESOLVE_CONCURRENCY", 8))
+JOB_DOWNLOAD_CONCURRENCY = int(os.getenv("JOB_DOWNLOAD_CONCURRENCY", 5))
+JOB_UPLOAD_CONCURRENCY = int(os.getenv("JOB_UPLOAD_CONCURRENCY", 3))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", 50))  # Links in the pipeline before new ones are refused
+JOB_JOURNAL_DB = os.getenv("JOB_JOURNAL_DB", "job_journal.db")  # Unfinished jobs, resumed after a restart
+FOLDER_LOOKAHEAD = int(os.getenv("FOLDER_LOOKAHEAD", 1))  # Folder items downloading ahead of the one uploading; 0 = one at a time
+FOLDER_MAX_HELD_BYTES = int(os.getenv("FOLDER_MAX_HELD_BYTES", 4 * 1024 * 1024 * 1024))  # Downloaded bytes waiting to upload before look-ahead pauses
+BATCH_MAX_LINKS = int(os.getenv("BATCH_MAX_LINKS", 100))  # Links taken from one message or .txt list; the rest are skipped
+LINK_LIST_MAX_BYTES = int(os.getenv("LINK_LIST_MAX_BYTES", 1024 * 1024))  # Largest .txt link list that is read
+
+# === Storage Configuration ===
+TEMP_DOWNLOADS_DIR = os.getenv("TEMP_DOWNLOADS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp_downloads"))
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", 0))  # 0 = free space at startup minus STORAGE_MIN_FREE_BYTES
+STORAGE_MIN_FREE_BYTES = int(os.getenv("STORAGE_MIN_FREE_BYTES", 512 * 1024 * 1024))
+STORAGE_UNKNOWN_SIZE = int(os.getenv("STORAGE_UNKNOWN_SIZE", 1024 * 1024 * 1024))  # Reserved when neither resolver nor HEAD gives a size
+
+# === Upload Configuration ===
+BOT_UPLOAD_LIMIT = 2 * 1024 * 1024 * 1024  # Per-file limit of the (local) Bot API server
+MTPROTO_API_ID = os.getenv("TELEGRAM_API", "")
+MTPROTO_API_HASH = os.getenv("TELEGRAM_HASH", "")
+MTPROTO_UPLOAD_ENABLED = os.getenv("MTPROTO_UPLOAD_ENABLED", "false").lower() == "true"  # Upload files over 10 MB with saveBigFilePart
+MTPROTO_UPLOAD_WORKERS = int(os.getenv("MTPROTO_UPLOAD_WORKERS", 8))  # saveBigFilePart requests in flight per file
+LARGE_FILE_PART_SIZE = min(int(os.getenv("LARGE_FILE_PART_SIZE", 2000 * 1024 * 1024)), BOT_UPLOAD_LIMIT - 1)  # Byte-range parts for bigger files, streamed over MTProto
+BOT_API_PART_SIZE = min(int(os.getenv("BOT_API_PART_SIZE", 256 * 1024 * 1024)), LARGE_FILE_PART_SIZE)  # Parts sent through the Bot API; PTB holds each one in memory
+
+# === Status Message Configuration ===
+STATUS_EDITS_PER_CHAT_PER_MINUTE = float(os.getenv("STATUS_EDITS_PER_CHAT_PER_MINUTE", 20))  # Telegram's group limit
+STATUS_EDITS_PER_SECOND = float(os.getenv("STATUS_EDITS_PER_SECOND", 25))  # Stays under the ~30/s bot-wide limit
+
+# === Metrics Configuration ===
+METRICS_PORT = int(os.getenv("METRICS_PORT", 8080))  # Prometheus /metrics; 0 disables
+
+# === Force Subscribe Configuration ===
+FSUB_CACHE_TTL = float(os.getenv("FSUB_CACHE_TTL", 600))  # Seconds a confirmed member skips get_chat_member
+FSUB_CACHE_NEGATIVE_TTL = float(os.getenv("FSUB_CACHE_NEGATIVE_TTL", 30))  # Kept short so users who just joined get in
 
 # Runtime configuration variables
 DUMP_CHANNEL_ID = None
 FORCE_SUB_CHANNEL_ID = None 
 aria2_client = None
+aria2_status_board = None
+mtproto_client = None
+resolver_probe_task = None
 ARIA2_VERSION_STR = "N/A" 
+aria2_notifier = Aria2Notifier(aria2_ws_url(ARIA2_RPC_HOST, ARIA2_RPC_PORT))
+aria2_tuner = Aria2Tuner(explore=ARIA2_TUNER_EXPLORE, path=ARIA2_TUNER_FILE or None) if ARIA2_TUNER_ENABLED else None
 
 def _initialize_config():
     global DUMP_CHANNEL_ID, FORCE_SUB_CHANNEL_ID
@@ -76,33 +165,23 @@ def _initialize_config():
         logger.info("Initial FORCE_SUB_CHANNEL_ID_STR not set or is 'none'/'clear'. Force subscription disabled.")
         FORCE_SUB_CHANNEL_ID = None
 
-def initialize_aria2():
-    global aria2_client, ARIA2_VERSION_STR
+async def initialize_aria2(application=None):
+    global aria2_client, aria2_status_board, ARIA2_VERSION_STR
     if not ARIA2_ENABLED:
         logger.info("Aria2 integration is disabled by configuration.")
         aria2_client = None
         return
 
-    if aria2p is None:
-        logger.warning("aria2p library is not installed. Aria2c integration will be disabled. pip install aria2p")
-        aria2_client = None
-        return
-
+    current_aria2_rpc = Aria2RPC(host=ARIA2_RPC_HOST, port=ARIA2_RPC_PORT, secret=ARIA2_RPC_SECRET)
     try:
         logger.info(f"Attempting to connect to Aria2 RPC server at {ARIA2_RPC_HOST}:{ARIA2_RPC_PORT}")
-        low_level_client = aria2p.Client(
-            host=ARIA2_RPC_HOST,
-            port=ARIA2_RPC_PORT,
-            secret=ARIA2_RPC_SECRET
-        )
-        current_aria2_api_wrapper = aria2p.API(low_level_client)
         
         logger.info("Attempting direct RPC call for aria2.getVersion")
-        version_data = low_level_client.call("aria2.getVersion")
+        version_data = await current_aria2_rpc.get_version()
         logger.info(f"aria2.getVersion response: {version_data}")
         
         logger.info("Attempting direct RPC call for aria2.getGlobalStat")
-        stats_data = low_level_client.call("aria2.getGlobalStat")
+        stats_data = await current_aria2_rpc.get_global_stat()
         logger.info(f"aria2.getGlobalStat response: {stats_data}")
 
         ARIA2_VERSION_STR = version_data.get("version", "Unknown")
@@ -117,27 +196,80 @@ def initialize_aria2():
                     f"Stats: {active_downloads} active / {waiting_downloads} waiting / {stopped_downloads} stopped.")
         
         logger.info(f"Setting Aria2c global options: {ARIA2_GLOBAL_OPTIONS}")
-        current_aria2_api_wrapper.set_global_options(ARIA2_GLOBAL_OPTIONS)
+        await current_aria2_rpc.set_global_options(ARIA2_GLOBAL_OPTIONS)
         logger.info("Aria2c global options set successfully.")
-        aria2_client = current_aria2_api_wrapper
-    except aria2p.client.ClientException as ce:
-        logger.error(f"Aria2 ClientException during initialization: {ce}. This often indicates a connection or authentication issue with the Aria2 RPC server.")
+        aria2_client = current_aria2_rpc
+        aria2_status_board = Aria2StatusBoard(current_aria2_rpc, interval=ARIA2_STATUS_POLL_INTERVAL)
+    except Aria2RPCError as ce:
+        logger.error(f"Aria2 RPC error during initialization: {ce}. This often indicates a connection or authentication issue with the Aria2 RPC server.")
+        await current_aria2_rpc.close()
         aria2_client = None
-        ARIA2_VERSION_STR = "Error (ClientEx)"
+        ARIA2_VERSION_STR = "Error (RPC)"
     except Exception as e:
         logger.error(f"Could not connect to Aria2 RPC server or set options at {ARIA2_RPC_HOST}:{ARIA2_RPC_PORT}. "
                      f"Ensure aria2c is running in daemon mode with RPC enabled. Error: {e}", exc_info=True)
+        await current_aria2_rpc.close()
         aria2_client = None
         ARIA2_VERSION_STR = "Error (Conn/Other)"
 
+async def initialize_mtproto(application=None):
+    """Starts the MTProto session used as the upload backend, if it is enabled and configured."""
+    global mtproto_client
+    if not MTPROTO_UPLOAD_ENABLED:
+        return
+    if not (MTPROTO_API_ID and MTPROTO_API_HASH):
+        logger.warning("MTPROTO_UPLOAD_ENABLED is set but TELEGRAM_API / TELEGRAM_HASH are missing. Uploading through the Bot API.")
+        return
+    client = MTProtoClient(
+        "apna_uploader", api_id=int(MTPROTO_API_ID), api_hash=MTPROTO_API_HASH, bot_token=BOT_TOKEN,
+        in_memory=True, no_updates=True, parse_mode=mtproto_enums.ParseMode.HTML
+    )
+    try:
+        await client.start()
+        mtproto_client = client
+        logger.info(f"MTProto upload backend started ({MTPROTO_UPLOAD_WORKERS} parts in flight per file)")
+    except Exception as e:
+        logger.error(f"Could not start the MTProto upload backend, uploading through the Bot API: {e}", exc_info=True)
+
+async def post_init(application: Application):
+    global resolver_probe_task
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    if RESOLVER_PROBE_URL:
+        resolver_probe_task = asyncio.create_task(probe_resolvers())
+    if RESOLVER_PREWARM:
+        # Only the API hosts matter here, so any share URL will do
+        application.create_task(resolver_client.warm([endpoint["api_call_url"] for endpoint in _build_resolver_endpoints(RESOLVER_PROBE_URL or "https://www.terabox.com/s/1")]))
+    await initialize_aria2(application)
+    await initialize_mtproto(application)
+    download_storage.sweep(keep=job_journal.file_paths())
+    await resume_journaled_jobs(application)
+
+async def shutdown_aria2(application=None):
+    await aria2_notifier.stop()
+    if aria2_client:
+        await aria2_client.close()
+
+async def post_shutdown(application: Application):
+    await shutdown_aria2(application)
+    if resolver_probe_task:
+        resolver_probe_task.cancel()
+    resolver_health.save()
+    await resolver_client.close()
+    if aria2_tuner:
+        aria2_tuner.save()
+    if mtproto_client:
+        try:
+            await mtproto_client.stop()
+        except Exception as e:
+            logger.warning(f"Error stopping the MTProto upload backend: {e}")
+
 # === Logging Setup ===
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING) 
-if aria2p:
-    logging.getLogger("aria2p").setLevel(logging.WARNING)
 
 MAX_LOG_ENTRIES = 200 
 log_buffer = deque(maxlen=MAX_LOG_ENTRIES)
@@ -161,12 +293,16 @@ class DirectDownloadLinkException(Exception):
     pass
 
 # === Terabox Link Fetching Logic (Reverted to Multi-API) ===
-def fetch_terabox_links(input_url: str):
-    """
-    Fetches direct download links from a Terabox URL by trying multiple APIs.
-    """
-    logger.info(f"Attempting to fetch links for URL: {input_url}")
+RESOLVER_COMMON_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0",
+    "Accept": "application/json, text/plain, */*", 
+    "Accept-Language": "en-US,en;q=0.5",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "cross-site" 
+}
 
+def _validate_terabox_url(input_url: str):
     terabox_domain_pattern = r"terabox\.com|teraboxapp\.com|1024tera\.com|freeterabox\.com|teraboxlink\.com|mirrobox\.com|nephobox\.com|4funbox\.com|momerybox\.com|terabox\.app|gibibox\.com|goaibox\.com|terasharelink\.com|1024terabox\.com|teraboxshare\.com"
     if not re.search(terabox_domain_pattern, input_url, re.IGNORECASE):
         raise DirectDownloadLinkException("ERROR: Invalid Terabox URL pattern.")
@@ -175,14 +311,15 @@ def fetch_terabox_links(input_url: str):
     if not re.search(shortlink_pattern, input_url, re.IGNORECASE):
         logger.warning(f"URL {input_url} does not match typical /s/ or surl= pattern, but proceeding.")
 
+def _build_resolver_endpoints(input_url: str):
+    """Returns the resolver API endpoints to try for input_url, in preference order."""
     parsed_input_url = urlparse(input_url)
     netloc = parsed_input_url.netloc
 
     url_for_tellycloud_like_apis = input_url.replace(netloc, "1024tera.com") if "terabox.com" in netloc or "teraboxapp.com" in netloc or "freeterabox.com" in netloc else input_url
     quoted_input_url = quote(input_url)
 
-    # List of API endpoints to try
-    api_endpoints = [
+    return [
         {
             "name": "tellycloud",
             "api_call_url": f"https://teraboxdl.tellycloudapi.workers.dev/?url={url_for_tellycloud_like_apis}",
@@ -209,87 +346,234 @@ def fetch_terabox_links(input_url: str):
             "method": "GET"
         },
     ]
-    
-    common_headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0",
-        "Accept": "application/json, text/plain, */*", 
-        "Accept-Language": "en-US,en;q=0.5",
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "cross-site" 
+
+def _is_valid_resolver_json(response_json) -> bool:
+    """Checks a resolver API response against the JSON structures we know how to parse."""
+    if isinstance(response_json, list):
+        return bool(response_json) and isinstance(response_json[0], dict) and ("downloadLink" in response_json[0] or "link" in response_json[0])
+    if not isinstance(response_json, dict):
+        return False
+    return bool(
+        (response_json.get("Success") and "Data" in response_json) or
+        ("response" in response_json and isinstance(response_json["response"], list) and response_json["response"] and "url" in response_json["response"][0]) or
+        (response_json.get("list") and isinstance(response_json.get("list"), list)) or
+        response_json.get("direct_link") or
+        response_json.get("url")
+    )
+
+def _redirect_as_response_json(api_name: str, final_url: str, headers) -> dict:
+    """Builds a Structure 3 style payload for an API that redirected straight to the file."""
+    logger.info(f"API {api_name} seems to have redirected to a non-JSON URL: {final_url}. Assuming direct link.")
+    parsed_final_url = urlparse(final_url)
+    filename_from_path = os.path.basename(parsed_final_url.path) or f"File_from_{api_name}"
+    return { 
+        "direct_link": final_url, 
+        "file_name": filename_from_path,
+        "size": headers.get('content-length', 0)  # Attempt to get size
     }
 
-    response_json = None
-    successful_api_name = None
+resolver_health = ResolverHealth(
+    failure_threshold=RESOLVER_BREAKER_FAILURES,
+    open_seconds=RESOLVER_BREAKER_SECONDS,
+    path=RESOLVER_HEALTH_FILE or None
+)
 
-    for api_config in api_endpoints:
-        api_url_to_call = api_config["api_call_url"]
-        current_headers = common_headers.copy()
-        logger.info(f"Trying API: {api_config['name']} ({api_url_to_call})")
+resolver_client = ResolverClient(
+    headers=RESOLVER_COMMON_HEADERS,
+    timeout=RESOLVER_TIMEOUT,
+    http2=RESOLVER_HTTP2,
+    max_connections=RESOLVER_MAX_CONNECTIONS,
+    keepalive_expiry=RESOLVER_KEEPALIVE_SECONDS,
+    dns_ttl=RESOLVER_DNS_TTL
+)
 
-        try:
-            api_response = None
-            if api_config["method"] == "GET":
-                api_response = get(api_url_to_call, headers=current_headers, timeout=30, allow_redirects=True)
-            else:  # POST (though current list is all GET)
-                payload_dict = {"url": api_config.get("payload_url", input_url)}
-                if api_config.get("needs_json_payload"):
-                    current_headers["Content-Type"] = "application/json"
-                    api_response = post(api_url_to_call, headers=current_headers, json=payload_dict, timeout=30)
-                else:
-                    api_response = post(api_url_to_call, headers=current_headers, data=payload_dict, timeout=30)
+native_resolver = TeraboxShareResolver(TERABOX_COOKIE, TERABOX_API_BASE, timeout=RESOLVER_TIMEOUT) if TERABOX_COOKIE else None
 
-            api_response.raise_for_status()
-            
-            # Handle cases where API might redirect to the direct link itself (non-JSON response)
-            if api_response.url != api_url_to_call and "application/json" not in api_response.headers.get("content-type", "").lower():
-                logger.info(f"API {api_config['name']} seems to have redirected to a non-JSON URL: {api_response.url}. Assuming direct link.")
-                parsed_final_url = urlparse(api_response.url)
-                filename_from_path = os.path.basename(parsed_final_url.path) or f"File_from_{api_config['name']}"
-                response_json = { 
-                    "direct_link": api_response.url, 
-                    "file_name": filename_from_path,
-                    "size": api_response.headers.get('content-length', 0)  # Attempt to get size
-                }
-                successful_api_name = api_config['name'] + " (via redirect)"
-                logger.info(f"Successfully processed redirect as direct link from API: {successful_api_name}")
-                break  # Found a link
+def _record_resolver_result(api_name: str, seconds: float, outcome: str):
+    observe_resolver(api_name, seconds, outcome == "success")
+    resolver_health.record(api_name, seconds, outcome)
 
-            current_response_json = api_response.json()
+async def fetch_terabox_links_native(input_url: str):
+    """
+    Resolves a link with Terabox's own share API. Returns None, so the
+    third-party APIs take over, when it fails or its breaker is open.
+    """
+    if resolver_health.is_open("terabox_native"):
+        return None
+    started = time.monotonic()
+    try:
+        details = await native_resolver.resolve(input_url)
+    except (TeraboxShareError, httpx.HTTPError) as e:
+        logger.warning(f"Native Terabox resolver failed for {input_url}: {e}")
+        _record_resolver_result("terabox_native", time.monotonic() - started, "failure")
+        return None
+    _record_resolver_result("terabox_native", time.monotonic() - started, "success")
+    return details
 
-            # Check for various successful JSON structures
-            if (current_response_json.get("Success") and "Data" in current_response_json) or \
-               ("response" in current_response_json and isinstance(current_response_json["response"], list) and current_response_json["response"] and "url" in current_response_json["response"][0]) or \
-               (isinstance(current_response_json, list) and current_response_json and ("downloadLink" in current_response_json[0] or "link" in current_response_json[0])) or \
-               (current_response_json.get("list") and isinstance(current_response_json.get("list"), list)) or \
-               (current_response_json.get("direct_link")) or \
-               (current_response_json.get("url")): 
-                response_json = current_response_json
-                successful_api_name = api_config['name']
-                logger.info(f"Successfully fetched and parsed JSON from API: {successful_api_name}")
-                break  # Found valid JSON
+async def fetch_terabox_links(input_url: str):
+    """
+    Fetches direct download links from a Terabox URL by trying the resolver
+    APIs one after another, healthiest first.
+    """
+    logger.info(f"Attempting to fetch links for URL: {input_url}")
+    _validate_terabox_url(input_url)
+    for api_config in resolver_health.rank(_build_resolver_endpoints(input_url)):
+        result = await _try_resolver_api_async(resolver_client.client, api_config, input_url)
+        if result:
+            response_json, successful_api_name = result
+            return _parse_resolver_response(response_json, successful_api_name)
+    raise DirectDownloadLinkException("ERROR: Unable to fetch valid JSON data or direct link from any API endpoint.")
+
+async def _try_resolver_api_async(client: httpx.AsyncClient, api_config: dict, input_url: str):
+    """
+    Calls a single resolver API. Returns (response_json, api_name) on a usable
+    response and None on any failure, so hedged attempts never raise.
+    """
+    api_url_to_call = api_config["api_call_url"]
+    logger.info(f"Trying API: {api_config['name']} ({api_url_to_call})")
+    api_started = time.monotonic()
+    api_response = None
+    result = None
+    outcome = "failure"
+    try:
+        if api_config["method"] == "GET":
+            api_response = await client.get(api_url_to_call, timeout=RESOLVER_TIMEOUT, follow_redirects=True)
+        else:
+            payload_dict = {"url": api_config.get("payload_url", input_url)}
+            if api_config.get("needs_json_payload"):
+                api_response = await client.post(api_url_to_call, json=payload_dict, timeout=RESOLVER_TIMEOUT)
+            else:
+                api_response = await client.post(api_url_to_call, data=payload_dict, timeout=RESOLVER_TIMEOUT)
+
+        api_response.raise_for_status()
+
+        if api_response.history and "application/json" not in api_response.headers.get("content-type", "").lower():
+            response_json = _redirect_as_response_json(api_config['name'], str(api_response.url), api_response.headers)
+            result = response_json, api_config['name'] + " (via redirect)"
+            outcome = "success"
+        else:
+            current_response_json = api_response.json()
+            if _is_valid_resolver_json(current_response_json):
+                logger.info(f"Successfully fetched and parsed JSON from API: {api_config['name']}")
+                result = current_response_json, api_config['name']
+                outcome = "success"
             else:
                 logger.warning(f"API {api_config['name']} gave OK status but unexpected JSON structure: {str(current_response_json)[:300]}")
-                response_json = None  # Reset for next try
-
-        except RequestException as e:
-            logger.error(f"RequestException with API {api_config['name']} ({api_url_to_call}): {e}")
-        except ValueError as e:  # JSONDecodeError
-            logger.error(f"JSONDecodeError with API {api_config['name']} ({api_url_to_call}): {e}. Response: {api_response.text[:200] if 'api_response' in locals() and api_response else 'N/A'}")
-        except Exception as e:  # Other errors
-            logger.error(f"Generic error with API {api_config['name']} ({api_url_to_call}): {e}", exc_info=True)
-        
-        if response_json:  # If we got a valid response from this API, no need to try others
-            break
+                outcome = "bad_json"
+    except httpx.HTTPError as e:
+        logger.error(f"HTTPError with API {api_config['name']} ({api_url_to_call}): {e}")
+    except ValueError as e:  # JSONDecodeError
+        logger.error(f"JSONDecodeError with API {api_config['name']} ({api_url_to_call}): {e}. Response: {api_response.text[:200] if api_response is not None else 'N/A'}")
+        outcome = "bad_json"
+    except Exception as e:
+        logger.error(f"Generic error with API {api_config['name']} ({api_url_to_call}): {e}", exc_info=True)
+    _record_resolver_result(api_config['name'], time.monotonic() - api_started, outcome)  # Cancelled hedges are not counted
+    return result
+
+async def fetch_terabox_links_async(input_url: str):
+    """
+    Hedged async variant of fetch_terabox_links.
+
+    The first API starts immediately and the next one joins the race every
+    RESOLVER_HEDGE_DELAY seconds, or as soon as a running attempt fails. The
+    first response with a valid JSON structure wins. Attempts still running
+    get RESOLVER_MIRROR_GRACE more seconds; their links for the same files
+    become mirrors of the winner's. The rest are cancelled.
+    """
+    logger.info(f"Attempting to fetch links (hedged) for URL: {input_url}")
+    _validate_terabox_url(input_url)
+    waiting_endpoints = deque(resolver_health.rank(_build_resolver_endpoints(input_url)))
+    running = set()
+    result = None
+    extra_results = []
+    client = resolver_client.client
 
-    if not response_json:
+    try:
+        while True:
+            if waiting_endpoints:
+                api_config = waiting_endpoints.popleft()
+                running.add(asyncio.create_task(_try_resolver_api_async(client, api_config, input_url)))
+            if not running:
+                break
+            hedge_timeout = RESOLVER_HEDGE_DELAY if waiting_endpoints else None
+            done, running = await asyncio.wait(running, timeout=hedge_timeout, return_when=asyncio.FIRST_COMPLETED)
+            results = [task.result() for task in done if task.result()]
+            if results:
+                result, extra_results = results[0], results[1:]
+                break
+            # Timed out (hedge) or every finished attempt failed: start the next endpoint.
+        if running and RESOLVER_MIRROR_GRACE > 0:
+            done, running = await asyncio.wait(running, timeout=RESOLVER_MIRROR_GRACE)
+            extra_results.extend(task.result() for task in done if task.result())
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    if not result:
         raise DirectDownloadLinkException("ERROR: Unable to fetch valid JSON data or direct link from any API endpoint.")
 
+    response_json, successful_api_name = result
+    details = _parse_resolver_response(response_json, successful_api_name)
+    for extra_json, extra_api_name in extra_results:
+        try:
+            _merge_mirrors(details, _parse_resolver_response(extra_json, extra_api_name))
+        except DirectDownloadLinkException as e:
+            logger.info(f"No mirrors from {extra_api_name}: {e}")
+    return details
+
+async def probe_resolvers():
+    """
+    Background task that retries resolver APIs whose circuit breaker is due
+    against RESOLVER_PROBE_URL, so a recovered API closes its breaker without
+    a user request paying for the attempt.
+    """
+    while True:
+        await asyncio.sleep(RESOLVER_PROBE_INTERVAL)
+        for api_config in resolver_health.due_probes(_build_resolver_endpoints(RESOLVER_PROBE_URL)):
+            try:
+                await _try_resolver_api_async(resolver_client.client, api_config, RESOLVER_PROBE_URL)
+            finally:
+                resolver_health.probe_finished(api_config["name"])
+
+def _unique_links(*candidates) -> list:
+    """The distinct non-empty URLs among `candidates`, in order of preference."""
+    links = []
+    for candidate in candidates:
+        if isinstance(candidate, str) and candidate.startswith("http") and candidate not in links:
+            links.append(candidate)
+    return links
+
+def _content_entry(links: list, filename: str) -> dict:
+    """A contents entry downloading from the preferred link, with the others kept as possible mirrors."""
+    return {"url": links[0], "filename": filename, "mirrors": links[1:]}
+
+def _merge_mirrors(details: dict, other: dict):
+    """
+    Adds the links another resolver API returned for the same files to
+    `details` as mirrors. Files are matched by name, or one to one when both
+    answers hold a single file and their sizes agree.
+    """
+    by_name = {(item.get("filename") or "").lower(): item for item in other["contents"]}
+    single = len(details["contents"]) == 1 and len(other["contents"]) == 1
+    sizes_agree = not details["total_size"] or not other["total_size"] or details["total_size"] == other["total_size"]
+    for item in details["contents"]:
+        match = by_name.get((item.get("filename") or "").lower())
+        if match is None and single and sizes_agree:
+            match = other["contents"][0]
+        if match is None:
+            continue
+        known = [item["url"]] + item.setdefault("mirrors", [])
+        item["mirrors"].extend(link for link in _unique_links(match["url"], *match.get("mirrors", [])) if link not in known)
+
+def _parse_resolver_response(response_json, successful_api_name: str):
+    """Normalizes a resolver API payload into the details dict used by the handlers."""
     logger.info(f"Processing data from successful API: {successful_api_name}")
     details = {"contents": [], "title": "Terabox Content", "total_size": 0, "is_folder": False}
 
     # --- Parsing logic (similar to previous robust version) ---
-    if response_json.get("Success") and "Data" in response_json: 
+    if isinstance(response_json, dict) and response_json.get("Success") and "Data" in response_json: 
         logger.info(f"Parsing as Structure 1 (Success:True, Data:{{...}}) from API: {successful_api_name}")
         item_data = response_json["Data"]
         title = item_data.get("FileName", item_data.get("title", "Untitled_File"))
@@ -305,13 +589,12 @@ def fetch_terabox_links(input_url: str):
                 elif match_gb: details["total_size"] = int(float(match_gb.group(1)) * 1024 * 1024 * 1024)
                 else: details["total_size"] = 0
             else: details["total_size"] = 0
-        direct_link = item_data.get("DirectLink") or item_data.get("DirectLink2") or item_data.get("url") or item_data.get("link")
-        if direct_link: details["contents"].append({"url": direct_link, "filename": title})
-        else: 
-            resolutions = item_data.get("resolutions", {})
-            if resolutions:
-                chosen_link = resolutions.get("HD Video") or resolutions.get("SD Video") or next(iter(resolutions.values()), None)
-                if chosen_link: details["contents"].append({"url": chosen_link, "filename": title})
+        resolutions = item_data.get("resolutions") or {}
+        links = _unique_links(
+            item_data.get("DirectLink"), item_data.get("DirectLink2"), item_data.get("url"), item_data.get("link"),
+            resolutions.get("HD Video"), resolutions.get("SD Video"), *resolutions.values()
+        )
+        if links: details["contents"].append(_content_entry(links, title))
         if not details["contents"]: logger.warning(f"API {successful_api_name} (Struct 1): No direct link or resolution found in Data.")
 
     elif "response" in response_json and isinstance(response_json["response"], list): 
@@ -324,16 +607,17 @@ def fetch_terabox_links(input_url: str):
             for i_idx, item in enumerate(response_list_data):
                 file_title = item.get("title", f"file_{i_idx+1}")
                 if not details["is_folder"] and i_idx==0 : details["title"] = file_title
-                direct_link = None
-                resolutions = item.get("resolutions", {})
-                if resolutions: direct_link = resolutions.get("HD Video") or resolutions.get("Fast Download") or resolutions.get("SD Video") or next(iter(resolutions.values()), None)
-                else: direct_link = item.get("url") or item.get("downloadLink") or item.get("link")
+                resolutions = item.get("resolutions") or {}
+                links = _unique_links(
+                    resolutions.get("HD Video"), resolutions.get("Fast Download"), resolutions.get("SD Video"), *resolutions.values(),
+                    item.get("url"), item.get("downloadLink"), item.get("link")
+                )
                 
-                if direct_link:
-                    details["contents"].append({"url": direct_link, "filename": file_title})
+                if links:
+                    details["contents"].append(_content_entry(links, file_title))
             if not details["contents"]: logger.warning(f"API {successful_api_name} (Struct 2): No usable links found in 'response' list.")
     
-    elif response_json.get("direct_link") and response_json.get("file_name"): 
+    elif isinstance(response_json, dict) and response_json.get("direct_link") and response_json.get("file_name"): 
         logger.info(f"Parsing as Structure 3 (direct_link, file_name) from API: {successful_api_name}")
         details["title"] = response_json.get("file_name")
         details["contents"].append({"url": response_json["direct_link"], "filename": response_json.get("file_name")})
@@ -351,10 +635,10 @@ def fetch_terabox_links(input_url: str):
         details["is_folder"] = len(response_json) > 1
         details["title"] = "Terabox_Folder" if details["is_folder"] else response_json[0].get("name", response_json[0].get("filename", "Terabox_File"))
         for i_idx, item in enumerate(response_json):
-            direct_link = item.get("downloadLink") or item.get("url") or item.get("link")
+            links = _unique_links(item.get("downloadLink"), item.get("url"), item.get("link"))
             filename_val = item.get("name") or item.get("filename", f"file_{i_idx+1}")
-            if direct_link:
-                details["contents"].append({"url": direct_link, "filename": filename_val})
+            if links:
+                details["contents"].append(_content_entry(links, filename_val))
         if not details["contents"]: logger.warning(f"API {successful_api_name} (Struct 4): No usable links found in list.")
     
     elif response_json.get("url") and response_json.get("filename"):  # Simple dict with url and filename
@@ -385,6 +669,72 @@ def fetch_terabox_links(input_url: str):
     logger.info(f"Successfully processed. Found {len(details['contents'])} items. Title: {details['title']}")
     return details
 
+link_cache = LinkCache(
+    max_entries=LINK_CACHE_MAX_ENTRIES,
+    ttl=LINK_CACHE_TTL,
+    negative_ttl=LINK_CACHE_NEGATIVE_TTL,
+    path=LINK_CACHE_FILE or None
+)
+_inflight_resolutions = {}
+file_index = FileIndex(FILE_INDEX_DB)
+job_journal = JobJournal(JOB_JOURNAL_DB)
+download_storage = StorageManager(
+    TEMP_DOWNLOADS_DIR,
+    quota_bytes=STORAGE_QUOTA_BYTES,
+    min_free_bytes=STORAGE_MIN_FREE_BYTES,
+    unknown_size=STORAGE_UNKNOWN_SIZE
+)
+job_scheduler = JobScheduler(
+    {"resolve": JOB_RESOLVE_CONCURRENCY, "download": JOB_DOWNLOAD_CONCURRENCY, "upload": JOB_UPLOAD_CONCURRENCY},
+    max_queued=JOB_MAX_QUEUED
+)
+register_pipeline(job_scheduler, download_storage)
+
+async def resolve_terabox_link(input_url: str):
+    """
+    Cached front for fetch_terabox_links. Entries are keyed on the share ID, so
+    every mirror domain of a share hits the same entry, and concurrent requests
+    for the same share wait on a single resolution. Every caller gets its own
+    copy of the details, so a job may edit its contents without touching the
+    cache entry or other jobs of the same share.
+    """
+    share_id = extract_share_id(input_url)
+    if share_id:
+        cached = link_cache.get(share_id)
+        if cached is not None:
+            details, error = cached
+            logger.info(f"Link cache hit for share {share_id}{' (negative)' if error else ''}")
+            if error:
+                raise DirectDownloadLinkException(error)
+            return copy.deepcopy(details)
+        if share_id in _inflight_resolutions:
+            return copy.deepcopy(await asyncio.shield(_inflight_resolutions[share_id]))
+
+    async def _resolve():
+        if native_resolver:
+            details = await fetch_terabox_links_native(input_url)
+            if details:
+                return details
+        if RESOLVER_ASYNC_ENABLED:
+            return await fetch_terabox_links_async(input_url)
+        return await fetch_terabox_links(input_url)
+
+    if not share_id:
+        return await _resolve()
+
+    resolution = asyncio.ensure_future(_resolve())
+    _inflight_resolutions[share_id] = resolution
+    try:
+        details = await asyncio.shield(resolution)
+    except DirectDownloadLinkException as e:
+        link_cache.put_negative(share_id, str(e))
+        raise
+    finally:
+        if _inflight_resolutions.get(share_id) is resolution:
+            del _inflight_resolutions[share_id]
+    link_cache.put(share_id, details)
+    return copy.deepcopy(details)
+
 # === Helper Functions ===
 def format_size(size_in_bytes: int) -> str: 
     if not isinstance(size_in_bytes, (int, float)) or size_in_bytes < 0: return "N/A"
@@ -399,18 +749,67 @@ def format_size(size_in_bytes: int) -> str:
     else:
         return f"{size_in_bytes / (1024 * 1024 * 1024):.2f} GB"
 
+def _retry_after_seconds(error):
+    """Returns the flood wait carried by a RetryAfter error, or None for other errors."""
+    if not isinstance(error, RetryAfter):
+        return None
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+status_scheduler = StatusScheduler(
+    flood_wait_seconds=_retry_after_seconds,
+    chat_rate=STATUS_EDITS_PER_CHAT_PER_MINUTE / 60,
+    global_rate=STATUS_EDITS_PER_SECOND
+)
+
+async def update_tg_status_message(status_msg, text: str, context: ContextTypes.DEFAULT_TYPE = None, parse_mode_val=None):
+    """
+    Hands a status edit to the shared scheduler. Returns immediately; only the
+    latest text per message is sent, within the per-chat and global budgets.
+    """
+    if status_msg is None:
+        return
+    if parse_mode_val == ParseMode.HTML:
+        text = text.replace("<br>", "\n")  # Telegram HTML has no <br>
+    if isinstance(status_msg, FolderItemStatusMessage):
+        if not status_msg.live:
+            status_msg.deferred = (text, parse_mode_val)
+            return
+        status_msg = status_msg.status_msg
+    if isinstance(status_msg, LinkBatchItem):
+        batch = status_msg.batch
+        batch.update(status_msg.index, text)
+        status_msg, text, parse_mode_val = batch.message, batch.render(), ParseMode.HTML
+
+    async def _edit(latest_text):
+        await status_msg.edit_text(latest_text, parse_mode=parse_mode_val, disable_web_page_preview=True)
+
+    status_scheduler.submit(status_msg.chat_id, status_msg.message_id, text, _edit)
+
 async def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_USER_IDS
 
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+membership_cache = MembershipCache(ttl=FSUB_CACHE_TTL, negative_ttl=FSUB_CACHE_NEGATIVE_TTL)
+
+def _is_fsub_chat(chat) -> bool:
+    if isinstance(FORCE_SUB_CHANNEL_ID, int):
+        return chat.id == FORCE_SUB_CHANNEL_ID
+    return bool(FORCE_SUB_CHANNEL_ID and chat.username) and chat.username.lower() == FORCE_SUB_CHANNEL_ID.lstrip('@').lower()
+
 async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     global FORCE_SUB_CHANNEL_ID
     if not FORCE_SUB_CHANNEL_ID: return True
     if not update.effective_user: return False 
 
     user_id = update.effective_user.id
-    try:
+
+    async def fetch():
         member_status = await context.bot.get_chat_member(chat_id=FORCE_SUB_CHANNEL_ID, user_id=user_id)
-        if member_status.status not in ['member', 'administrator', 'creator']:
+        return member_status.status in MEMBER_STATUSES
+
+    try:
+        if not await membership_cache.check(user_id, fetch):
             fsub_display = f"@{FORCE_SUB_CHANNEL_ID}" if isinstance(FORCE_SUB_CHANNEL_ID, str) and not FORCE_SUB_CHANNEL_ID.startswith('@') else FORCE_SUB_CHANNEL_ID
             await update.message.reply_text(
                 f"Hello {update.effective_user.first_name}!\n"
@@ -430,6 +829,13 @@ async def check_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("Could not verify channel subscription at the moment. Please try again later.")
         return False
 
+async def fsub_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Keeps membership_cache in step with joins and leaves; needs the bot to be an admin of the channel."""
+    chat_member = update.chat_member
+    if not chat_member or not _is_fsub_chat(chat_member.chat):
+        return
+    membership_cache.store(chat_member.new_chat_member.user.id, chat_member.new_chat_member.status in MEMBER_STATUSES)
+
 # === Admin Commands ===
 async def logs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin(update.effective_user.id):
@@ -488,6 +894,7 @@ async def set_fsub_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_fsub_target = context.args[0]
     if new_fsub_target.lower() in ['none', 'clear']:
         FORCE_SUB_CHANNEL_ID = None
+        membership_cache.clear()
         await update.message.reply_text("Force subscription has been disabled.")
         logger.info(f"Admin {update.effective_user.id} disabled FORCE_SUB_CHANNEL_ID.")
     else:
@@ -497,13 +904,14 @@ async def set_fsub_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except ValueError: 
             FORCE_SUB_CHANNEL_ID = new_fsub_target if new_fsub_target.startswith('@') else "@" + new_fsub_target
             logger.info(f"Admin {update.effective_user.id} set FORCE_SUB_CHANNEL_ID to Username: {FORCE_SUB_CHANNEL_ID}.")
+        membership_cache.clear()  # Memberships were of the old channel
         await update.message.reply_text(f"Force subscribe channel set to: {FORCE_SUB_CHANNEL_ID}")
 
 async def view_config_command_logic(update_or_query):
     global ARIA2_VERSION_STR
     dump_display = DUMP_CHANNEL_ID if DUMP_CHANNEL_ID else "Not Set (files sent to user)"
     fsub_display = FORCE_SUB_CHANNEL_ID if FORCE_SUB_CHANNEL_ID else "Disabled"
-    aria2_status_msg = "Enabled" if ARIA2_ENABLED and aria2_client else ("Disabled by config" if not ARIA2_ENABLED else "Not Connected/aria2p missing")
+    aria2_status_msg = "Enabled" if ARIA2_ENABLED and aria2_client else ("Disabled by config" if not ARIA2_ENABLED else "Not Connected")
     
     config_text = (
         f"<b>Current Bot Configuration:</b>\n\n"
@@ -515,6 +923,51 @@ async def view_config_command_logic(update_or_query):
     if ARIA2_ENABLED and aria2_client:
         config_text += f"  - RPC: <code>{ARIA2_RPC_HOST}:{ARIA2_RPC_PORT}</code>\n"
         config_text += f"  - Aria2c Version: <code>{ARIA2_VERSION_STR}</code>\n"
+        if aria2_tuner:
+            tuned_pairs = sorted(aria2_tuner.stats().items(), key=lambda item: -item[1]['throughput'])
+            config_text += f"  - Tuning: <code>{len(tuned_pairs)} host/size pairs learned</code>\n" + "".join(
+                f"    {html.escape(pair)}: <code>{tuned['connections']} connections, {format_size(tuned['throughput'])}/s</code>\n"
+                for pair, tuned in tuned_pairs[:5]
+            )
+    cache_stats = link_cache.stats()
+    config_text += (
+        f"<b>Link Cache:</b> <code>{cache_stats['entries']} entries, {cache_stats['hits']} hits / "
+        f"{cache_stats['negative_hits']} negative / {cache_stats['misses']} misses</code>\n"
+    )
+    if FORCE_SUB_CHANNEL_ID:
+        fsub_stats = membership_cache.stats()
+        config_text += (
+            f"<b>ForceSub Cache:</b> <code>{fsub_stats['entries']} users, {fsub_stats['hits']} hits / "
+            f"{fsub_stats['coalesced']} joined / {fsub_stats['misses']} lookups</code>\n"
+        )
+    pool_stats = resolver_client.stats()
+    config_text += (
+        f"<b>Resolver Pool:</b> <code>{'HTTP/2' if pool_stats['http2'] else 'HTTP/1.1'}, {pool_stats['requests']} requests over "
+        f"{pool_stats['connections_opened']} connections ({pool_stats['reuse_rate']:.0%} reused), {pool_stats['open']} open / "
+        f"{pool_stats['idle']} idle, DNS {pool_stats['dns']['hits']} hits / {pool_stats['dns']['misses']} lookups</code>\n"
+    )
+    resolver_stats = resolver_health.stats()
+    if resolver_stats:
+        config_text += "<b>Resolvers:</b>\n" + "".join(
+            f"  - {html.escape(name)}: <code>{stats['state']}, {stats['success_rate']:.0%} ok, {stats['bad_json_rate']:.0%} bad JSON, ~{stats['latency']:.1f}s</code>\n"
+            for name, stats in sorted(resolver_stats.items(), key=lambda item: item[1]['expected_latency'])
+        )
+    job_stats = job_scheduler.stats()
+    config_text += (
+        f"<b>Jobs:</b> <code>{job_stats['jobs']}/{job_stats['max_queued']} in pipeline, " +
+        ", ".join(f"{name} {job_stats[name]['active']}/{job_stats[name]['limit']} (+{job_stats[name]['waiting']} waiting)" for name in ("resolve", "download", "upload")) +
+        "</code>\n"
+    )
+    edit_stats = status_scheduler.stats()
+    config_text += (
+        f"<b>Status Edits:</b> <code>{edit_stats['sent']} sent, {edit_stats['coalesced']} coalesced, "
+        f"{edit_stats['skipped']} unchanged, {edit_stats['flood_waits']} flood waits</code>\n"
+    )
+    storage_stats = download_storage.stats()
+    config_text += (
+        f"<b>Temp Storage:</b> <code>{format_size(storage_stats['reserved'])} of {format_size(storage_stats['quota'])} reserved "
+        f"(+{storage_stats['waiting']} waiting), {format_size(storage_stats['free'])} free</code>\n"
+    )
 
     if isinstance(update_or_query, Update) and update_or_query.message: 
         await update_or_query.message.reply_text(config_text, parse_mode=ParseMode.HTML)
@@ -565,98 +1018,567 @@ async def settings_callback_handler(update: Update, context: ContextTypes.DEFAUL
         try:
             await query.message.delete()
         except Exception as e:
-            logger.warning(f"ientas
+            logger.warning(f"Failed to delete settings message: {e}")
 
-async def handle_terabox_link(update: Update, context: ContextTypes.DEFAULT_TYPE): 
-    global DUMP_CHANNEL_ID, aria2_client, ARIA2_VERSION_STR
-    
-    # Initialize default values for finally block
-    folder_title = "Unknown Content" 
-    num_files = 0
-    status_msg = None  # Initialize status_msg to None
+class JournaledStatusMessage:
+    """Stand-in for a status Message restored from the job journal after a restart."""
+
+    def __init__(self, bot, chat_id: int, message_id: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+    async def edit_text(self, text: str, **kwargs):
+        return await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id, **kwargs)
+
+class FolderItemStatusMessage:
+    """
+    Status message view for one item of a pipelined folder job. Only the item
+    whose turn it is edits the shared message; a look-ahead item keeps its
+    latest text in `deferred` and shows it once its turn comes.
+    """
+
+    def __init__(self, pipeline: OrderedPipeline, index: int, status_msg):
+        self.pipeline = pipeline
+        self.index = index
+        self.status_msg = status_msg
+        self.chat_id = status_msg.chat_id
+        self.message_id = status_msg.message_id
+        self.deferred = None
+
+    @property
+    def live(self) -> bool:
+        return self.pipeline.next_turn == self.index
+
+    async def flush(self):
+        if self.deferred:
+            text, parse_mode_val = self.deferred
+            self.deferred = None
+            await update_tg_status_message(self.status_msg, text, parse_mode_val=parse_mode_val)
+
+def _advance_job(job: dict, **fields):
+    """Applies a stage change to the in-memory job and its journal entry."""
+    job.update(fields)
+    job_journal.update(job["job_id"], **fields)
+
+def _item_state(job: dict, i_loop: int) -> dict:
+    """Stage, GID and file path of one item, starting from the journal: the job's columns for the current item, lookahead_states for later ones."""
+    states = job.setdefault("item_states", {})
+    if i_loop not in states:
+        if i_loop == job["file_index"]:
+            states[i_loop] = {"stage": job["stage"], "gid": job["gid"], "file_path": job["file_path"]}
+        else:
+            states[i_loop] = dict((job.get("lookahead_states") or {}).get(i_loop) or {"stage": "downloading", "gid": None, "file_path": None})
+    return states[i_loop]
+
+def _lookahead_states(job: dict, current: int) -> dict:
+    """States of the items after `current` that already have an aria2 download or a file on disk."""
+    return {i: state for i, state in job.get("item_states", {}).items() if i > current and (state["gid"] or state["file_path"])}
+
+def _advance_item(job: dict, i_loop: int, **fields):
+    """Records a stage change of one item, in the job's columns for the current item and in lookahead_states for later ones."""
+    _item_state(job, i_loop).update(fields)
+    if i_loop == job["file_index"]:
+        _advance_job(job, **fields)
+    else:
+        _advance_job(job, lookahead_states=_lookahead_states(job, job["file_index"]))
+
+async def _agreeing_mirrors(mirrors: list, expected_size: int) -> list:
+    """
+    The alternate links whose HEAD reports exactly `expected_size` bytes, so
+    aria2 never mixes segments of different encodes. Without a known size no
+    mirror can be checked and none are used.
+    """
+    mirrors = (mirrors or [])[:ARIA2_MAX_MIRRORS]
+    if not mirrors or not expected_size:
+        return []
+    sizes = await asyncio.gather(*(probe_content_length(mirror) for mirror in mirrors))
+    agreeing = [mirror for mirror, size in zip(mirrors, sizes) if size == expected_size]
+    if len(agreeing) < len(mirrors):
+        logger.info(f"Using {len(agreeing)} of {len(mirrors)} mirror link(s); the others differ in size or did not answer")
+    return agreeing
+
+async def _refresh_item_link(job: dict, i_loop: int, expired_url: str):
+    """
+    Resolves the job's share link again after the direct link of item
+    `i_loop` expired. Returns the item's entry with its new links (also
+    journaled), or None when the share no longer resolves or no longer holds
+    the file.
+    """
+    share_id = job["share_id"]
+    if share_id:
+        cached = link_cache.get(share_id)
+        cached_entry = match_refreshed_file(job["contents"], cached[0].get("contents") or [], i_loop) if cached and not cached[1] else None
+        if cached_entry is None or cached_entry["url"] == expired_url:
+            link_cache.invalidate(share_id)  # Otherwise another item of the share already cached fresh links
+    try:
+        details = await resolve_terabox_link(job["url"])
+    except Exception as e:
+        logger.warning(f"Could not resolve {job['url']} again for job {job['job_id']}: {e}")
+        return None
+    entry = match_refreshed_file(job["contents"], details.get("contents") or [], i_loop)
+    if entry is None or entry["url"] == expired_url:
+        logger.warning(f"Resolving {job['url']} again gave no new link for {job['contents'][i_loop]['filename']}")
+        return None
+    job["contents"][i_loop] = {**job["contents"][i_loop], "url": entry["url"], "mirrors": entry.get("mirrors", [])}
+    _advance_job(job, contents=job["contents"])
+    return job["contents"][i_loop]
+
+async def _swap_expired_aria2_link(job: dict, i_loop: int, gid: str, expected_size: int) -> bool:
+    """Moves a running aria2 download whose link expired onto freshly resolved links, keeping its GID and data."""
+    entry = await _refresh_item_link(job, i_loop, job["contents"][i_loop]["url"])
+    if entry is None:
+        return False
+    uris = [entry["url"]] + await _agreeing_mirrors(entry.get("mirrors"), expected_size)
+    try:
+        await aria2_client.replace_uris(gid, uris)
+    except Aria2RPCError as e:
+        logger.warning(f"Could not swap the links of aria2 GID {gid}: {e}")
+        return False
+    logger.info(f"Swapped {len(uris)} fresh link(s) into aria2 GID {gid} for {entry['filename']}")
+    return True
 
+async def _resume_or_add_aria2_download(job: dict, i_loop: int, direct_url: str, temp_dir: str, filename: str, expected_size: int = 0, mirrors: list = None):
+    """
+    Re-attaches to the journaled GID while aria2 still knows it; otherwise adds
+    the URL again, and continue=true resumes from the partial file on disk.
+    `mirrors` are further URIs of the same file; those that agree on size are
+    added too, and aria2 spreads segments over all of them and keeps going
+    when one dies. Returns the GID and the aria2_tuner choice for a fresh download (None when
+    re-attached or resumed, as its throughput would not be comparable).
+    """
+    state = _item_state(job, i_loop)
+    if state["stage"] == "downloading" and state["gid"]:
+        try:
+            aria2_download = await aria2_client.tell_status(state["gid"])
+            if aria2_download.status in ("active", "waiting", "paused", "complete"):
+                if aria2_download.status == "paused":
+                    await aria2_client.call("aria2.unpause", state["gid"])
+                logger.info(f"Re-attached to aria2 GID {state['gid']} ({aria2_download.status}) for journaled job {job['job_id']}")
+                return state["gid"], None
+            await aria2_client.remove(state["gid"])  # Drop the failed result but keep the partial file
+        except Aria2RPCError as e:
+            logger.info(f"Journaled GID {state['gid']} is gone ({e}). Adding {filename} to aria2 again.")
+
+    download_options = {'dir': temp_dir, 'out': filename}
+    tuning = None
+    if aria2_tuner:
+        tuned_options, tuning = aria2_tuner.choose(direct_url, expected_size)
+        download_options.update(tuned_options)
+        if state["gid"] or os.path.exists(os.path.join(temp_dir, filename)):
+            tuning = None  # Continues a partial file
+    uris = [direct_url] + await _agreeing_mirrors(mirrors, expected_size)
+    logger.info(f"Adding download to aria2: {filename} from {direct_url} (+{len(uris) - 1} mirrors). Output dir: {temp_dir}")
+    gid = await aria2_client.add_uris(uris, options=download_options)
+    _advance_item(job, i_loop, stage="downloading", gid=gid, file_path=os.path.join(temp_dir, filename))
+    return gid, tuning
+
+async def resume_journaled_jobs(application: Application):
+    """
+    Restarts every job the journal still holds, editing its original status
+    message. Jobs of one batch share that message, so they are regrouped into
+    a batch again.
+    """
+    pending_jobs = job_journal.pending()
+    if pending_jobs:
+        logger.info(f"Resuming {len(pending_jobs)} journaled job(s)")
+    by_message = {}
+    for job in pending_jobs:
+        by_message.setdefault((job["status_chat_id"], job["status_message_id"]), []).append(job)
+    for (status_chat_id, status_message_id), jobs in by_message.items():
+        status_msg = JournaledStatusMessage(application.bot, status_chat_id, status_message_id)
+        batch = None
+        if len(jobs) > 1:
+            batch = LinkBatch([job["url"] for job in jobs], notes=["♻️ Bot restarted; resuming the unfinished links of this batch."])
+            batch.message = status_msg
+        for i, job in enumerate(jobs):
+            job["status_msg"] = batch.item(i) if batch else status_msg
+            job_scheduler.admit(force=True)
+            application.create_task(_run_resumed_job(application, job))
+
+async def _run_resumed_job(application: Application, job: dict):
+    try:
+        await update_tg_status_message(job["status_msg"], f"♻️ Bot restarted. Resuming <b>{html.escape(job['title'] or job['url'][:50])}</b>...", parse_mode_val=ParseMode.HTML)
+        await run_terabox_job(CallbackContext(application), job)
+    finally:
+        job_scheduler.finish()
+        if isinstance(job["status_msg"], LinkBatchItem):
+            await _finish_batch_item(job["status_msg"])
+
+async def _finish_batch_item(item: LinkBatchItem, text: str = None):
+    item.batch.finish(item.index, text)
+    await update_tg_status_message(item.batch.message, item.batch.render(), parse_mode_val=ParseMode.HTML)
+
+TERABOX_LINK_PATTERN = re.compile(r"https?://(?:www\.)?(?:[a-zA-Z0-9-]+\.)?(?:terabox|freeterabox|teraboxapp|1024tera|nephobox|mirrobox|4funbox|momerybox|terabox\.app|gibibox|goaibox|terasharelink|1024terabox|teraboxshare|terafileshare)\.(?:com|app|link|me|xyz|cloud|fun|online|store|shop|top|pw|org|net|info|mobi|asia|vip|pro|life|live|world|space|tech|site|icu|cyou|buzz|gallery|website|press|services|show|run|gold|plus|guru|center|group|company|directory|today|digital|network|solutions|systems|technology|software|click|store|shop|ninja|money|pics|lol|tube|pictures|cam|vin|art|blog|best|fans|media|game|video|stream|movie|film|music|audio|cloud|drive|share|storage|file|data|download|backup|upload|box|disk)\S+", re.IGNORECASE)
+
+async def handle_terabox_link(update: Update, context: ContextTypes.DEFAULT_TYPE): 
     if not update.message or not update.message.text: return
     if not await check_subscription(update, context): return
 
     message_text = update.message.text
-    terabox_link_pattern = r"https?://(?:www\.)?(?:[a-zA-Z0-9-]+\.)?(?:terabox|freeterabox|teraboxapp|1024tera|nephobox|mirrobox|4funbox|momerybox|terabox\.app|gibibox|goaibox|terasharelink|1024terabox|teraboxshare|terafileshare)\.(?:com|app|link|me|xyz|cloud|fun|online|store|shop|top|pw|org|net|info|mobi|asia|vip|pro|life|live|world|space|tech|site|icu|cyou|buzz|gallery|website|press|services|show|run|gold|plus|guru|center|group|company|directory|today|digital|network|solutions|systems|technology|software|click|store|shop|ninja|money|pics|lol|tube|pictures|cam|vin|art|blog|best|fans|media|game|video|stream|movie|film|music|audio|cloud|drive|share|storage|file|data|download|backup|upload|box|disk)\S+"
-    match = re.search(terabox_link_pattern, message_text, re.IGNORECASE)
+    urls = dedupe_links(TERABOX_LINK_PATTERN.findall(message_text))
     
-    if not match:
+    if not urls:
         if not (message_text.startswith('/') or len(message_text.split()) > 10): 
             await update.message.reply_text("Please send a valid Terabox link. If you need help, type /help.")
         return
+    if len(urls) > 1:
+        await run_link_batch(update, context, urls)
+        return
+
+    url_to_process = urls[0]
+    share_id = extract_share_id(url_to_process)
+    user_id_for_status = update.effective_user.id
+    is_priority_job = user_id_for_status in ADMIN_USER_IDS
+    try:
+        job_scheduler.admit()
+    except QueueFull as e:
+        logger.warning(f"Rejected link from {user_id_for_status}: {e}")
+        await update.message.reply_text("🚦 The bot is busy right now. Please send your link again in a few minutes.")
+        return
+    try:
+        queue_position = job_scheduler.position("download", user_id_for_status, is_priority_job)
+        if queue_position:
+            status_msg = await update.message.reply_text(f"⏳ Queued at position {queue_position}: {html.escape(url_to_process[:50])}...", parse_mode=ParseMode.HTML)
+        else:
+            status_msg = await update.message.reply_text(f"🔄 Processing Terabox link: {html.escape(url_to_process[:50])}...", parse_mode=ParseMode.HTML)
+        target_chat_id_for_files = DUMP_CHANNEL_ID if DUMP_CHANNEL_ID else update.message.chat_id
+        job_id = job_journal.create(
+            update.message.chat_id, user_id_for_status, update.effective_user.first_name, url_to_process, share_id,
+            target_chat_id_for_files, status_msg.chat_id, status_msg.message_id
+        )
+        job = job_journal.get(job_id)
+        job["status_msg"] = status_msg
+        await run_terabox_job(context, job)
+    finally:
+        job_scheduler.finish()
+
+async def handle_link_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Takes every Terabox link out of an uploaded .txt document and runs them as one batch."""
+    if not update.message or not update.message.document: return
+    if not await check_subscription(update, context): return
+
+    document = update.message.document
+    if document.file_size and document.file_size > LINK_LIST_MAX_BYTES:
+        await update.message.reply_text(f"That list is too large. Please send link lists of at most {format_size(LINK_LIST_MAX_BYTES)}.")
+        return
+    try:
+        telegram_file = await document.get_file()
+        list_text = (await telegram_file.download_as_bytearray()).decode("utf-8", errors="ignore")
+    except Exception as e:
+        logger.error(f"Could not read link list {document.file_name} from {update.effective_user.id}: {e}")
+        await update.message.reply_text("Could not read that file. Please try sending it again.")
+        return
+    urls = dedupe_links(TERABOX_LINK_PATTERN.findall(list_text))
+    if not urls:
+        await update.message.reply_text(f"No Terabox links found in {document.file_name or 'that file'}.")
+        return
+    logger.info(f"Link list {document.file_name} from {update.effective_user.id} holds {len(urls)} unique link(s)")
+    await run_link_batch(update, context, urls)
 
-    url_to_process = match.group(0)
-    status_msg = await update.message.reply_text(f"🔄 Processing Terabox link: {html.escape(url_to_process[:50])}...", parse_mode=ParseMode.HTML)
-    target_chat_id_for_files = DUMP_CHANNEL_ID if DUMP_CHANNEL_ID else update.message.chat_id
+async def run_link_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, urls: list):
+    """
+    Runs several links as one batch: every link is its own journaled job, but
+    all of them report into one combined status message. The links are
+    resolved together first, then their jobs run side by side, sharing the
+    user's slots in the download and upload stages.
+    """
     user_id_for_status = update.effective_user.id
-    user_first_name_for_status = html.escape(update.effective_user.first_name) 
-    user_info_for_status = f"<a href='tg://user?id={user_id_for_status}'>{user_first_name_for_status}</a> | ɪᴅ: {user_id_for_status}"
+    notes = []
+    if len(urls) > BATCH_MAX_LINKS:
+        notes.append(f"Only the first {BATCH_MAX_LINKS} links are taken; {len(urls) - BATCH_MAX_LINKS} were skipped.")
+        urls = urls[:BATCH_MAX_LINKS]
 
-    # Define temp_dir as an absolute path
-    base_temp_dir_name = "temp_downloads"  # Name of the temp directory
-    script_dir = os.path.dirname(os.path.abspath(__file__)) if "__file__" in locals() else os.getcwd()
-    temp_dir = os.path.join(script_dir, base_temp_dir_name)
-    temp_dir = os.path.abspath(temp_dir)
+    admitted = 0
+    for _ in urls:
+        try:
+            job_scheduler.admit()
+        except QueueFull as e:
+            logger.warning(f"Batch from {user_id_for_status} admitted {admitted}/{len(urls)} links: {e}")
+            break
+        admitted += 1
+    if not admitted:
+        await update.message.reply_text("🚦 The bot is busy right now. Please send your links again in a few minutes.")
+        return
+
+    batch = LinkBatch(urls, notes)
+    for i in range(admitted, len(urls)):
+        batch.finish(i, "🚦 Not queued: the bot is busy. Send this link again later.")
+    try:
+        batch.message = await update.message.reply_text(batch.render(), parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+        target_chat_id_for_files = DUMP_CHANNEL_ID if DUMP_CHANNEL_ID else update.message.chat_id
+        jobs = []
+        for i, url in enumerate(urls[:admitted]):
+            job_id = job_journal.create(
+                update.message.chat_id, user_id_for_status, update.effective_user.first_name, url, extract_share_id(url),
+                target_chat_id_for_files, batch.message.chat_id, batch.message.message_id
+            )
+            job = job_journal.get(job_id)
+            job["status_msg"] = batch.item(i)
+            jobs.append(job)
+
+        async def _prefetch(job: dict):
+            try:
+                if await _resolve_job(job):
+                    await update_tg_status_message(job["status_msg"], f"🔎 {job['title']}: {len(job['contents'])} file(s) found", parse_mode_val=ParseMode.HTML)
+            except Exception as e:  # Reported by the job itself; failures are in the negative link cache
+                logger.info(f"Batch prefetch of {job['url']} failed: {e}")
+
+        async def _run(job: dict):
+            try:
+                await run_terabox_job(context, job)
+            finally:
+                await _finish_batch_item(job["status_msg"])
+
+        await asyncio.gather(*(_prefetch(job) for job in jobs))
+        await asyncio.gather(*(_run(job) for job in jobs))
+    finally:
+        for _ in range(admitted):
+            job_scheduler.finish()
+
+async def _resolve_job(job: dict) -> bool:
+    """Resolves the job's link in the resolve stage and journals its contents; False if it holds no files."""
+    async with job_scheduler.stage("resolve", job["user_id"], job["user_id"] in ADMIN_USER_IDS):
+        with stage_duration.labels("resolve").time():
+            terabox_data = await resolve_terabox_link(job["url"])
+
+    if not terabox_data or not terabox_data.get("contents"):
+        return False
+    _advance_job(
+        job,
+        title=terabox_data.get('title', 'Terabox Content'),
+        is_folder=bool(terabox_data.get("is_folder")),
+        contents=terabox_data["contents"],
+        file_index=0,
+        stage="downloading"
+    )
+    return True
+
+async def run_terabox_job(context: ContextTypes.DEFAULT_TYPE, job: dict):
+    """
+    Runs a journaled link job from wherever it stopped: resolves the link if
+    its contents are not known yet, then downloads and uploads each remaining
+    item. Up to FOLDER_LOOKAHEAD items download while the current one uploads;
+    uploads still happen in folder order. The journal entry is dropped once
+    the job ends, unless it was interrupted by a shutdown.
+    """
+    status_msg = job["status_msg"]
+    url_to_process = job["url"]
+    interrupted = False
+
+    temp_dir = download_storage.directory
 
     try:
         os.makedirs(temp_dir, exist_ok=True)  # Ensure temp_dir exists
         logger.info(f"Using absolute temporary directory: {temp_dir}")
 
-        loop = asyncio.get_event_loop()
-        terabox_data = await loop.run_in_executor(None, fetch_terabox_links, url_to_process)
+        if job["contents"] is None:
+            if not await _resolve_job(job):
+                await update_tg_status_message(status_msg, f"❌ Could not retrieve download information. The link might be invalid, private, or the API failed.", context)
+                return
+            await update_tg_status_message(status_msg,
+                f"✅ Link processed!<br>"
+                f"<b>Title:</b> {html.escape(job['title'])}<br>"
+                f"<b>Files Found:</b> {len(job['contents'])}<br>"
+                f"Starting downloads...",
+                context,
+                parse_mode_val=ParseMode.HTML
+            )
 
-        if not terabox_data or not terabox_data.get("contents"):
-            await update_tg_status_message(status_msg, f"❌ Could not retrieve download information. The link might be invalid, private, or the API failed.", context)
-            return
+        num_files = len(job["contents"])
+        folder_title = job["title"]
+        pipeline = OrderedPipeline(job["file_index"], FOLDER_LOOKAHEAD, FOLDER_MAX_HELD_BYTES)
+        item_tasks = []
+        try:
+            for i_loop in range(job["file_index"], num_files):
+                await pipeline.window(i_loop)
+                item_tasks.append(asyncio.create_task(process_terabox_file(context, job, i_loop, temp_dir, pipeline)))
+            await asyncio.gather(*item_tasks)
+        finally:
+            for item_task in item_tasks:
+                item_task.cancel()
 
-        num_files = len(terabox_data['contents'])  # num_files is now defined
-        folder_title = terabox_data.get('title', 'Terabox Content')  # folder_title is now defined
-        folder_title_escaped = html.escape(folder_title)
+        final_completion_message = f"🏁 All {num_files} file(s) from '{html.escape(folder_title)}' processed." 
+        if status_msg and status_msg.chat_id == job["chat_id"]: 
+            await update_tg_status_message(status_msg, final_completion_message, context, parse_mode_val=ParseMode.HTML)
+        else: 
+            await context.bot.send_message(job["chat_id"], final_completion_message, parse_mode=ParseMode.HTML)
 
+    except asyncio.CancelledError:
+        interrupted = True
+        raise
+    except DirectDownloadLinkException as e:
+        logger.warning(f"DirectDownloadLinkException for {url_to_process}: {e}")
+        if status_msg: await update_tg_status_message(status_msg, f"❌ Error processing link: {html.escape(str(e))}", context, parse_mode_val=ParseMode.HTML)
+    except Exception as e: 
+        logger.error(f"Unhandled error processing link {url_to_process}: {e}", exc_info=True)
+        if status_msg: await update_tg_status_message(status_msg, f"❌ An unexpected error occurred. Please try again later or check the link.<br>Error: {html.escape(str(e)[:100])}", context, parse_mode_val=ParseMode.HTML)
+    finally:
+        if not interrupted:
+            job_journal.finish(job["job_id"])
+
+class MTProtoSentMessage:
+    """The fields of a sent PTB Message that the upload path reads, filled from a Pyrogram Message."""
+
+    def __init__(self, message):
+        self.chat_id = message.chat.id
+        self.message_id = message.id
+        self.video = message.video
+        self.audio = message.audio
+        self.document = message.document
+
+async def send_file_range(context: ContextTypes.DEFAULT_TYPE, status_msg, file_path: str, offset: int, length: int, filename: str, send_kwargs: dict, send_as: str = "document"):
+    """
+    Sends `length` bytes of `file_path` from `offset` as one file. Over 10 MB,
+    and with the MTProto backend running, the bytes are streamed up as
+    parallel saveBigFilePart requests. Otherwise they go through the Bot
+    API, where PTB reads the whole range into memory before sending it.
+    """
+    if mtproto_client and length > BIG_FILE_MIN_SIZE:
+        upload_start_time = datetime.now()
+
+        async def _mtproto_progress(uploaded, total):
+            percentage = uploaded / total * 100
+            elapsed_seconds = max((datetime.now() - upload_start_time).total_seconds(), 0.001)
+            await update_tg_status_message(status_msg,
+                f"┏ ғɪʟᴇɴᴀᴍᴇ: {html.escape(filename)}<br>"
+                f"┠ [{'★' * int(percentage / 10)}{'☆' * (10 - int(percentage / 10))}] {percentage:.2f}%<br>"
+                f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {format_size(uploaded)} ᴏғ {format_size(total)}<br>"
+                f"┠ sᴛᴀᴛᴜs: 📤 Uploading to Telegram<br>"
+                f"┠ ᴇɴɢɪɴᴇ: <b><u>MTProto x{MTPROTO_UPLOAD_WORKERS}</u></b><br>"
+                f"┖ sᴘᴇᴇᴅ: {format_size(uploaded / elapsed_seconds)}/s<br>",
+                parse_mode_val=ParseMode.HTML
+            )
+
+        parts = FilePartSource(file_path, offset, length).parts()
+        input_file = await upload_big_file(mtproto_client, parts, length, filename, workers=MTPROTO_UPLOAD_WORKERS, progress=_mtproto_progress)
+        sent = await send_uploaded_file(
+            mtproto_client, send_kwargs["chat_id"], input_file, filename,
+            send_kwargs["caption"].replace("<br>", "\n"), as_video=send_as == "video"
+        )
+        return MTProtoSentMessage(sent)
+
+    with FileRange(file_path, offset, length, name=filename) as doc_to_send:
+        if send_as == "video":
+            return await context.bot.send_video(video=doc_to_send, supports_streaming=True, **send_kwargs)
+        if send_as == "audio":
+            return await context.bot.send_audio(audio=doc_to_send, **send_kwargs)
+        return await context.bot.send_document(document=doc_to_send, **send_kwargs)
+
+async def upload_file_in_parts(context: ContextTypes.DEFAULT_TYPE, status_msg, file_path: str, filename: str, file_size: int, send_kwargs: dict):
+    """
+    Sends a file over the Bot API upload limit as fixed-size parts
+    (name.001, name.002, ...) read as byte ranges of the downloaded file, so
+    no part is written to disk again. Parts are LARGE_FILE_PART_SIZE when the
+    MTProto backend streams them, and BOT_API_PART_SIZE otherwise, since the
+    Bot API path holds a whole part in memory. A manifest explaining how to
+    rejoin the parts is sent after them and returned.
+    """
+    parts = plan_file_parts(file_size, LARGE_FILE_PART_SIZE if mtproto_client else BOT_API_PART_SIZE)
+    part_names = [file_part_name(filename, number) for number in range(1, len(parts) + 1)]
+    first_part_message = None
+    for number, ((offset, length), part_name) in enumerate(zip(parts, part_names), start=1):
         await update_tg_status_message(status_msg,
-            f"✅ Link processed!<br>"
-            f"<b>Title:</b> {folder_title_escaped}<br>"
-            f"<b>Files Found:</b> {num_files}<br>"
-            f"Starting downloads...",
+            f"┏ ғɪʟᴇɴᴀᴍᴇ: {html.escape(part_name)}<br>"
+            f"┠ sᴛᴀᴛᴜs: 📤 Uploading part {number}/{len(parts)}...<br>"
+            f"┖ sɪᴢᴇ: {format_size(length)} ᴏғ {format_size(file_size)}<br>",
             context,
             parse_mode_val=ParseMode.HTML
         )
+        part_kwargs = dict(send_kwargs, filename=part_name, caption=f"<b>{html.escape(part_name)}</b> (part {number}/{len(parts)})")
+        sent_part = await send_file_range(context, status_msg, file_path, offset, length, part_name, part_kwargs)
+        first_part_message = first_part_message or sent_part
+        logger.info(f"Uploaded {part_name} ({length} bytes at offset {offset})")
+    return await context.bot.send_message(
+        send_kwargs["chat_id"],
+        build_part_manifest(filename, file_size, part_names),
+        parse_mode=ParseMode.HTML,
+        reply_to_message_id=first_part_message.message_id
+    )
 
-        for i_loop, file_info in enumerate(terabox_data["contents"]): 
-            direct_url = file_info["url"]
-            original_filename = file_info["filename"]
-            filename = re.sub(r'[<>:"/\\|?*]', '_', original_filename)[:200] 
-            if '.' not in filename and '.' in direct_url: 
-                try:
-                    path_part = urlparse(direct_url).path
-                    potential_ext = os.path.splitext(path_part)[1]
-                    if potential_ext and 1 < len(potential_ext) < 7: filename += potential_ext
-                except Exception: pass
-            if not filename: filename = f"file_{i_loop+1}" 
+async def process_terabox_file(context: ContextTypes.DEFAULT_TYPE, job: dict, i_loop: int, temp_dir: str, pipeline: OrderedPipeline):
+    """
+    Downloads item `i_loop` of a job and uploads it once it is the item's turn
+    in `pipeline`, picking up from the journaled stage.
+    """
+    file_info = job["contents"][i_loop]
+    status_msg = FolderItemStatusMessage(pipeline, i_loop, job["status_msg"])
+    share_id = job["share_id"]
+    url_to_process = job["url"]
+    num_files = len(job["contents"])
+    folder_title = job["title"]
+    target_chat_id_for_files = job["target_chat_id"]
+    user_id_for_status = job["user_id"]
+    is_priority_job = user_id_for_status in ADMIN_USER_IDS
+    user_info_for_status = f"<a href='tg://user?id={user_id_for_status}'>{html.escape(job['user_name'] or '')}</a> | ɪᴅ: {user_id_for_status}"
+
+    direct_url = file_info["url"]
+    original_filename = file_info["filename"]
+    filename = re.sub(r'[<>:"/\\|?*]', '_', original_filename)[:200] 
+    if '.' not in filename and '.' in direct_url: 
+        try:
+            path_part = urlparse(direct_url).path
+            potential_ext = os.path.splitext(path_part)[1]
+            if potential_ext and 1 < len(potential_ext) < 7: filename += potential_ext
+        except Exception: pass
+    if not filename: filename = f"file_{i_loop+1}" 
             
-            escaped_filename = html.escape(filename) 
+    escaped_filename = html.escape(filename) 
 
-            temp_file_path = None 
-            downloaded_size_bytes = 0
-            download_method_used = ""
-            download_start_time = datetime.now() 
+    temp_file_path = None 
+    storage_reservation = None
+    aria2_gid = None
+    aria2_download = None
+    downloaded_size_bytes = 0
+    download_method_used = ""
+    download_start_time = datetime.now() 
 
+    interrupted = False
+    try:
+        indexed_file = file_index.lookup(share_id, filename, file_info.get("size")) if share_id else None
+        if indexed_file:
+            await pipeline.turn(i_loop)
             try:
+                await context.bot.copy_message(chat_id=target_chat_id_for_files, from_chat_id=indexed_file["chat_id"], message_id=indexed_file["message_id"])
+                logger.info(f"Sent {filename} of share {share_id} from file index (message {indexed_file['message_id']})")
+                await update_tg_status_message(status_msg, f"✅ Sent <b>{escaped_filename}</b> from cache!", context, parse_mode_val=ParseMode.HTML)
+                return
+            except Exception as e_index:
+                logger.warning(f"Indexed copy of {filename} failed, downloading again: {e_index}")
+                file_index.forget(share_id, filename)
+
+        item_state = _item_state(job, i_loop)
+        resumed_file_path = item_state["file_path"] if item_state["stage"] == "uploading" else None
+        if resumed_file_path and os.path.exists(resumed_file_path):
+            download_method_used = "Journal"
+            temp_file_path = resumed_file_path
+            logger.info(f"Resuming upload of {temp_file_path} for journaled job {job['job_id']}")
+            storage_reservation = await pipeline.reserve(i_loop, download_storage, os.path.getsize(temp_file_path))
+        else:
+            await pipeline.download_slot(i_loop)
+            expected_size = file_info.get("size") or await probe_content_length(direct_url)
+            if not download_storage.fits(expected_size):
+                await update_tg_status_message(status_msg, f"💾 <b>{escaped_filename}</b> ({i_loop+1}/{num_files}) is waiting for disk space ({format_size(expected_size or download_storage.unknown_size)} needed)...", context, parse_mode_val=ParseMode.HTML)
+            storage_reservation = await pipeline.reserve(i_loop, download_storage, expected_size)
+            download_queue_position = job_scheduler.position("download", user_id_for_status, is_priority_job)
+            if download_queue_position:
+                await update_tg_status_message(status_msg, f"⏳ <b>{escaped_filename}</b> ({i_loop+1}/{num_files}) is queued for download at position {download_queue_position}...", context, parse_mode_val=ParseMode.HTML)
+            async with job_scheduler.stage("download", user_id_for_status, is_priority_job):
                 if ARIA2_ENABLED and aria2_client:
                     download_method_used = "Aria2"
                     initial_aria_status_text = f"⏳ Preparing download for <b>{escaped_filename}</b> ({i_loop+1}/{num_files}) via Aria2..."
                     await update_tg_status_message(status_msg, initial_aria_status_text, context, parse_mode_val=ParseMode.HTML)
                     
-                    logger.info(f"Adding download to aria2: {filename} from {direct_url}. Output dir: {temp_dir}")
-                    aria2_download = aria2_client.add_uris([direct_url], options={'dir': temp_dir, 'out': filename})
+                    aria2_gid, aria2_tuning = await _resume_or_add_aria2_download(job, i_loop, direct_url, temp_dir, filename, expected_size, file_info.get("mirrors"))
+                    aria2_queued_at = time.monotonic()
+                    aria2_started_at = None
+                    expiry_watch = LinkExpiryWatch(LINK_STALL_SECONDS, LINK_REFRESH_MAX_ATTEMPTS)
                     
-                    last_status_update_time_loop = time.time() 
-                    while not aria2_download.is_complete and aria2_download.status != 'error': 
-                        aria2_download.update() 
-                        current_time_loop_inner = time.time() 
-                        if current_time_loop_inner - last_status_update_time_loop > 2.0: 
+                    async def _refresh_aria2_status():
+                        while True:
+                            await asyncio.sleep(ARIA2_STATUS_REFRESH_INTERVAL)
+                            aria2_download = aria2_status_board.status(aria2_gid)
+                            if aria2_download is None: continue
                             prog_percent = aria2_download.progress
                             completed_len_bytes = aria2_download.completed_length
                             total_len_bytes = aria2_download.total_length
@@ -680,10 +1602,38 @@ async def handle_terabox_link(update: Update, context: ContextTypes.DEFAULT_TYPE
                                 f"┖ ᴜsᴇʀ: {user_info_for_status}<br>"
                             )
                             await update_tg_status_message(status_msg, status_text_aria, context, parse_mode_val=ParseMode.HTML)
-                            last_status_update_time_loop = current_time_loop_inner
-                        await asyncio.sleep(0.5) 
 
-                    aria2_download.update() 
+                            if not expiry_watch.exhausted and expiry_watch.stalled(aria2_download) and await link_expired(job["contents"][i_loop]["url"]):
+                                logger.warning(f"Direct link of {filename} expired at {format_size(completed_len_bytes)}; resolving {url_to_process} again")
+                                swapped = await _swap_expired_aria2_link(job, i_loop, aria2_gid, expected_size)
+                                expiry_watch.refreshed("swapped" if swapped else "failed")
+
+                    while True:
+                        aria2_status_board.watch(aria2_gid)
+                        refresh_task = asyncio.create_task(_refresh_aria2_status())
+                        try:
+                            await aria2_notifier.wait(aria2_gid, check=aria2_status_board.event_check(aria2_gid))
+                        finally:
+                            refresh_task.cancel()
+                            aria2_started_at = aria2_started_at or aria2_status_board.started_at(aria2_gid)
+                            aria2_status_board.unwatch(aria2_gid)
+                        aria2_finished_at = time.monotonic()
+
+                        aria2_download = await aria2_client.tell_status(aria2_gid) 
+                        if aria2_download.status != 'error' or expiry_watch.exhausted or not is_expiry_error(aria2_download.error_code, aria2_download.error_message):
+                            break
+                        logger.warning(f"Aria2 gave up on {filename} at {format_size(aria2_download.completed_length)}, its link expired ({aria2_download.error_message}); resolving {url_to_process} again")
+                        refreshed_entry = await _refresh_item_link(job, i_loop, job["contents"][i_loop]["url"])
+                        if refreshed_entry is None:
+                            expiry_watch.refreshed("failed")
+                            break
+                        await aria2_client.remove(aria2_gid)  # Keeps the partial file and its .aria2 control file
+                        refreshed_uris = [refreshed_entry["url"]] + await _agreeing_mirrors(refreshed_entry.get("mirrors"), expected_size)
+                        aria2_gid = await aria2_client.add_uris(refreshed_uris, options={'dir': temp_dir, 'out': filename})  # continue=true resumes the partial file
+                        _advance_item(job, i_loop, gid=aria2_gid)
+                        expiry_watch.refreshed("readded")
+                        logger.info(f"Continuing {filename} from {format_size(aria2_download.completed_length)} as aria2 GID {aria2_gid}")
+
                     if aria2_download.is_complete:
                         if aria2_download.files:
                             temp_file_path = aria2_download.files[0].path
@@ -692,42 +1642,48 @@ async def handle_terabox_link(update: Update, context: ContextTypes.DEFAULT_TYPE
                                 temp_file_path = os.path.join(temp_dir, os.path.basename(temp_file_path))
                                 logger.info(f"Adjusted to absolute/known-relative path: {temp_file_path}")
                             downloaded_size_bytes = aria2_download.completed_length
+                            observe_aria2_download(aria2_queued_at, aria2_started_at, aria2_finished_at)
+                            if aria2_tuner and aria2_started_at is not None and not expiry_watch.refreshes:
+                                aria2_tuner.record(aria2_tuning, downloaded_size_bytes, aria2_finished_at - aria2_started_at)
+                            transfer_bytes.labels("in").inc(downloaded_size_bytes)
                         else:
                             logger.error(f"Aria2 download for {aria2_download.name} complete but no file path info. GID: {aria2_download.gid}")
                             await update_tg_status_message(status_msg, f"❌ Aria2 download for <b>{escaped_filename}</b> completed but file path is missing.", context, parse_mode_val=ParseMode.HTML)
-                            try: aria2_download.remove(force=True, files=True)
+                            try: await aria2_client.remove(aria2_gid, force=True, files=True)
                             except Exception as e_rm_aria: logger.error(f"Error removing problematic aria2 download {aria2_download.gid}: {e_rm_aria}")
-                            continue 
+                            return 
                     elif aria2_download.status == 'error' or aria2_download.error_message:
                         error_msg_aria = html.escape(aria2_download.error_message or "Unknown Aria2 error")
                         logger.error(f"Aria2 download error for {aria2_download.name}: {error_msg_aria} (Code: {aria2_download.error_code}) GID: {aria2_download.gid}")
                         await update_tg_status_message(status_msg, f"❌ Aria2 download error for <b>{escaped_filename}</b>: {error_msg_aria}", context, parse_mode_val=ParseMode.HTML)
-                        try: aria2_download.remove(force=True, files=True)
+                        try: await aria2_client.remove(aria2_gid, force=True, files=True)
                         except Exception as e_rm_aria: logger.error(f"Error removing failed aria2 download {aria2_download.gid}: {e_rm_aria}")
-                        continue 
+                        return 
                     else: 
                         logger.warning(f"Aria2 download for {aria2_download.name} exited loop unexpectedly. Status: {aria2_download.status}")
                         await update_tg_status_message(status_msg, f"⚠️ Unknown Aria2 download issue for <b>{escaped_filename}</b>.", context, parse_mode_val=ParseMode.HTML)
-                        try: aria2_download.remove(force=True, files=True)
+                        try: await aria2_client.remove(aria2_gid, force=True, files=True)
                         except Exception as e_rm_aria: logger.error(f"Error removing unknown-state aria2 download {aria2_download.gid}: {e_rm_aria}")
-                        continue
+                        return
                 
                 else: 
                     download_method_used = "HTTPX"
                     if not ARIA2_ENABLED: logger.info(f"Aria2 disabled, using HTTPX for {filename}")
-                    elif aria2_client is None: logger.info(f"Aria2 client not connected or aria2p missing, using HTTPX for {filename}")
+                    elif aria2_client is None: logger.info(f"Aria2 client not connected, using HTTPX for {filename}")
                     
                     initial_httpx_status_text = f"Downloading <b>{escaped_filename}</b> ({i_loop+1}/{num_files}) via HTTPX..."
                     await update_tg_status_message(status_msg, initial_httpx_status_text, context, parse_mode_val=ParseMode.HTML)
                     
                     temp_file_path = os.path.join(temp_dir, filename)
                     last_status_update_time_loop = time.time()
+                    httpx_started = time.monotonic()
                     
                     async with httpx.AsyncClient(timeout=None, follow_redirects=True) as client: 
                         async with client.stream("GET", direct_url, timeout=httpx.Timeout(60.0, connect=30.0)) as response: 
                             response.raise_for_status()
                             total_size_bytes = int(response.headers.get('content-length', 0))
                             with open(temp_file_path, "wb") as f_httpx: 
+                                preallocate(f_httpx, total_size_bytes)
                                 async for chunk in response.aiter_bytes(chunk_size=131072): 
                                     if not chunk: continue
                                     f_httpx.write(chunk)
@@ -754,124 +1710,133 @@ async def handle_terabox_link(update: Update, context: ContextTypes.DEFAULT_TYPE
                                         await update_tg_status_message(status_msg, status_text_httpx, context, parse_mode_val=ParseMode.HTML)
                                         last_status_update_time_loop = current_time_loop_inner
                     logger.info(f"HTTPX download complete for {filename}. Size: {downloaded_size_bytes}")
+                    stage_duration.labels("download").observe(time.monotonic() - httpx_started)
+                    transfer_bytes.labels("in").inc(downloaded_size_bytes)
 
-                logger.info(f"Checking for file at path: {temp_file_path}")
-                if not temp_file_path or not os.path.exists(temp_file_path):
-                    logger.error(f"File {filename} was NOT FOUND at expected path after download ({download_method_used}). Checked path: {temp_file_path}")
-                    await update_tg_status_message(status_msg, f"❌ Error: Downloaded file <b>{escaped_filename}</b> not found on disk.", context, parse_mode_val=ParseMode.HTML)
-                    continue
-
-                final_file_size_on_disk = os.path.getsize(temp_file_path)
-                upload_prep_text = f"✅ Downloaded <b>{escaped_filename}</b> ({format_size(final_file_size_on_disk)} via {download_method_used}).<br>Now preparing to upload..."
-                await update_tg_status_message(status_msg, upload_prep_text, context, parse_mode_val=ParseMode.HTML)
-
-                if final_file_size_on_disk > 2 * 1024 * 1024 * 1024: 
-                    error_large_file = f"❌ File <b>{escaped_filename}</b> is too large ({format_size(final_file_size_on_disk)}) to upload. Max is 2GB for bot uploads."
-                    await update_tg_status_message(status_msg, error_large_file, context, parse_mode_val=ParseMode.HTML)
-                    if DUMP_CHANNEL_ID:
-                         await context.bot.send_message(DUMP_CHANNEL_ID, f"Failed to upload: {escaped_filename} (too large: {format_size(final_file_size_on_disk)}) from user {user_id_for_status}. Link: {url_to_process}")
-                    continue
-
-                # Caption uses HTML instead of MarkdownV2
-                caption_text = f"<b>{html.escape(filename)}</b><br><br><b>Size:</b> {format_size(final_file_size_on_disk)}<br><br>"
-                if terabox_data.get("is_folder") and num_files > 1:
-                    caption_text += f"<b>Folder:</b> {html.escape(folder_title)}<br>"
-                caption_text += f"Processed by @{context.bot.username}"
-
-                file_ext = os.path.splitext(filename)[1].lower()
-                sent_message = None
-                send_kwargs = {
-                    "chat_id": target_chat_id_for_files, 
-                    "caption": caption_text, 
-                    "filename": filename,  # Use original filename for TG
-                    "parse_mode": ParseMode.HTML
-                }
-                
-                upload_status_text = (
-                    f"┏ ғɪʟᴇɴᴀᴍᴇ: {escaped_filename}<br>"
-                    f"┠ sᴛᴀᴛᴜs: 📤 Uploading to Telegram...<br>"
-                    f"┠ sɪᴢᴇ: {format_size(final_file_size_on_disk)}<br>"
-                    f"┖ ᴜsᴇʀ: {user_info_for_status}<br>"
-                )
-                await update_tg_status_message(status_msg, upload_status_text, context, parse_mode_val=ParseMode.HTML)
-
-                with open(temp_file_path, "rb") as doc_to_send:
-                    if file_ext in ['.mp4', '.mkv', '.mov', '.avi', '.webm'] and final_file_size_on_disk < 2 * 1024 * 1024 * 1024: 
-                        sent_message = await context.bot.send_video(video=doc_to_send, supports_streaming=True, **send_kwargs)
-                    elif file_ext in ['.mp3', '.ogg', '.wav', '.flac', '.m4a'] and final_file_size_on_disk < 2 * 1024 * 1024 * 1024: 
-                        sent_message = await context.bot.send_audio(audio=doc_to_send, **send_kwargs)
-                    elif final_file_size_on_disk < 2 * 1024 * 1024 * 1024 : 
-                        sent_message = await context.bot.send_document(document=doc_to_send, **send_kwargs)
-                
-                if sent_message:
-                    success_msg_text = f"✅ Successfully uploaded <b>{escaped_filename}</b>!"
-                    if target_chat_id_for_files == update.message.chat_id: 
-                        await update_tg_status_message(status_msg, success_msg_text, context, parse_mode_val=ParseMode.HTML)
-                    else: 
-                        await update.message.reply_text(success_msg_text, parse_mode=ParseMode.HTML) 
-                        if status_msg.chat_id == update.message.chat_id : 
-                           await update_tg_status_message(status_msg, success_msg_text, context, parse_mode_val=ParseMode.HTML) 
-                else:
-                    await update_tg_status_message(status_msg, f"⚠️ Could not upload <b>{escaped_filename}</b>. The bot might lack permissions or an unknown error occurred during upload.", context, parse_mode_val=ParseMode.HTML)
-
-            except httpx.HTTPStatusError as e: 
-                logger.error(f"HTTP error downloading {filename} from {direct_url} (HTTPX): {e.response.status_code} - {e.response.text[:100]}", exc_info=True)
-                await update_tg_status_message(status_msg, f"❌ HTTP error downloading <b>{escaped_filename}</b> (HTTPX): Status {e.response.status_code}. Link might have expired or is invalid.", context, parse_mode_val=ParseMode.HTML)
-            except httpx.ReadTimeout as e: 
-                logger.error(f"Read timeout downloading {filename} from {direct_url} (HTTPX): {e}", exc_info=True)
-                await update_tg_status_message(status_msg, f"❌ Read timeout downloading <b>{escaped_filename}</b> (HTTPX). The connection was too slow or interrupted.", context, parse_mode_val=ParseMode.HTML)
-            except httpx.RequestError as e: 
-                logger.error(f"Network error downloading {filename} (HTTPX): {e}", exc_info=True)
-                await update_tg_status_message(status_msg, f"❌ Network error downloading <b>{escaped_filename}</b> (HTTPX): {str(e)[:100]}", context, parse_mode_val=ParseMode.HTML)
-            except aria2p.client.ClientException as e_aria_client: 
-                 logger.error(f"Aria2 ClientException for {filename}: {e_aria_client}", exc_info=True)
-                 await update_tg_status_message(status_msg, f"❌ Aria2 Client error for <b>{escaped_filename}</b>: {html.escape(str(e_aria_client)[:150])}. Ensure Aria2c is running and configured.", context, parse_mode_val=ParseMode.HTML)
-            except Exception as e: 
-                logger.error(f"Error with file {filename} (URL: {direct_url}, Method: {download_method_used}): {e}", exc_info=True)
-                await update_tg_status_message(status_msg, f"❌ An error occurred with <b>{escaped_filename}</b>: {html.escape(str(e)[:100])}", context, parse_mode_val=ParseMode.HTML)
-            finally:
-                if temp_file_path and os.path.exists(temp_file_path):
-                    try: 
-                        os.remove(temp_file_path)
-                        logger.info(f"Removed temp file: {temp_file_path}")
-                    except Exception as e_rm: 
-                        logger.error(f"Failed to remove temp file {temp_file_path}: {e_rm}")
-                if download_method_used == "Aria2" and 'aria2_download' in locals() and aria2_download:
-                    try:
-                        if not aria2_download.is_complete or aria2_download.status == 'error' or not temp_file_path: 
-                            logger.info(f"Attempting to remove GID {aria2_download.gid} from Aria2 due to error or incompletion.")
-                            aria2_download.remove(force=True, files=True) 
-                    except Exception as e_aria_clean:
-                        logger.warning(f"Could not clean up GID {aria2_download.gid if 'aria2_download' in locals() and aria2_download else 'N/A'} from Aria2: {e_aria_clean}")
+        logger.info(f"Checking for file at path: {temp_file_path}")
+        if not temp_file_path or not os.path.exists(temp_file_path):
+            logger.error(f"File {filename} was NOT FOUND at expected path after download ({download_method_used}). Checked path: {temp_file_path}")
+            await update_tg_status_message(status_msg, f"❌ Error: Downloaded file <b>{escaped_filename}</b> not found on disk.", context, parse_mode_val=ParseMode.HTML)
+            return
 
-        final_completion_message = f"🏁 All {num_files} file(s) from '{html.escape(folder_title)}' processed." 
-        if status_msg and status_msg.chat_id == update.message.chat_id: 
-            await update_tg_status_message(status_msg, final_completion_message, context, parse_mode_val=ParseMode.HTML)
-        else: 
-            await update.message.reply_text(final_completion_message, parse_mode=ParseMode.HTML)
+        final_file_size_on_disk = os.path.getsize(temp_file_path)
+        storage_reservation.resize(final_file_size_on_disk)
+        pipeline.hold(i_loop, final_file_size_on_disk)
+        _advance_item(job, i_loop, stage="uploading", file_path=temp_file_path)
+        await pipeline.turn(i_loop)
+        await status_msg.flush()
+        upload_prep_text = f"✅ Downloaded <b>{escaped_filename}</b> ({format_size(final_file_size_on_disk)} via {download_method_used}).<br>Now preparing to upload..."
+        await update_tg_status_message(status_msg, upload_prep_text, context, parse_mode_val=ParseMode.HTML)
+
+        # Caption uses HTML instead of MarkdownV2
+        caption_text = f"<b>{html.escape(filename)}</b><br><br><b>Size:</b> {format_size(final_file_size_on_disk)}<br><br>"
+        if job["is_folder"] and num_files > 1:
+            caption_text += f"<b>Folder:</b> {html.escape(folder_title)}<br>"
+        caption_text += f"Processed by @{context.bot.username}"
+
+        file_ext = os.path.splitext(filename)[1].lower()
+        sent_message = None
+        send_kwargs = {
+            "chat_id": target_chat_id_for_files, 
+            "caption": caption_text, 
+            "filename": filename,  # Use original filename for TG
+            "parse_mode": ParseMode.HTML
+        }
+                
+        upload_status_text = (
+            f"┏ ғɪʟᴇɴᴀᴍᴇ: {escaped_filename}<br>"
+            f"┠ sᴛᴀᴛᴜs: 📤 Uploading to Telegram...<br>"
+            f"┠ sɪᴢᴇ: {format_size(final_file_size_on_disk)}<br>"
+            f"┖ ᴜsᴇʀ: {user_info_for_status}<br>"
+        )
+        await update_tg_status_message(status_msg, upload_status_text, context, parse_mode_val=ParseMode.HTML)
 
-    except DirectDownloadLinkException as e:
-        logger.warning(f"DirectDownloadLinkException for {url_to_process}: {e}")
-        if status_msg: await update_tg_status_message(status_msg, f"❌ Error processing link: {html.escape(str(e))}", context, parse_mode_val=ParseMode.HTML)
+        async with job_scheduler.stage("upload", user_id_for_status, is_priority_job):
+            upload_started = time.monotonic()
+            if final_file_size_on_disk >= BOT_UPLOAD_LIMIT:
+                sent_message = await upload_file_in_parts(context, status_msg, temp_file_path, filename, final_file_size_on_disk, send_kwargs)
+            else:
+                if file_ext in ['.mp4', '.mkv', '.mov', '.avi', '.webm']:
+                    send_as = "video"
+                elif file_ext in ['.mp3', '.ogg', '.wav', '.flac', '.m4a']:
+                    send_as = "audio"
+                else:
+                    send_as = "document"
+                sent_message = await send_file_range(context, status_msg, temp_file_path, 0, final_file_size_on_disk, filename, send_kwargs, send_as)
+                
+        if sent_message:
+            stage_duration.labels("upload").observe(time.monotonic() - upload_started)
+            transfer_bytes.labels("out").inc(final_file_size_on_disk)
+            sent_media = sent_message.video or sent_message.audio or sent_message.document
+            if share_id and sent_media:  # Files sent in parts are not indexed
+                file_index.record(share_id, filename, final_file_size_on_disk, sent_message.chat_id, sent_message.message_id, sent_media.file_id if sent_media else None)
+            success_msg_text = f"✅ Successfully uploaded <b>{escaped_filename}</b>!"
+            if target_chat_id_for_files == job["chat_id"]: 
+                await update_tg_status_message(status_msg, success_msg_text, context, parse_mode_val=ParseMode.HTML)
+            else: 
+                await context.bot.send_message(job["chat_id"], success_msg_text, parse_mode=ParseMode.HTML) 
+                if status_msg.chat_id == job["chat_id"] : 
+                   await update_tg_status_message(status_msg, success_msg_text, context, parse_mode_val=ParseMode.HTML) 
+        else:
+            await update_tg_status_message(status_msg, f"⚠️ Could not upload <b>{escaped_filename}</b>. The bot might lack permissions or an unknown error occurred during upload.", context, parse_mode_val=ParseMode.HTML)
+
+    except asyncio.CancelledError:
+        interrupted = True  # Shutting down: keep the partial file and GID so the job can resume
+        raise
+    except httpx.HTTPStatusError as e: 
+        logger.error(f"HTTP error downloading {filename} from {direct_url} (HTTPX): {e.response.status_code} - {e.response.text[:100]}", exc_info=True)
+        await update_tg_status_message(status_msg, f"❌ HTTP error downloading <b>{escaped_filename}</b> (HTTPX): Status {e.response.status_code}. Link might have expired or is invalid.", context, parse_mode_val=ParseMode.HTML)
+    except httpx.ReadTimeout as e: 
+        logger.error(f"Read timeout downloading {filename} from {direct_url} (HTTPX): {e}", exc_info=True)
+        await update_tg_status_message(status_msg, f"❌ Read timeout downloading <b>{escaped_filename}</b> (HTTPX). The connection was too slow or interrupted.", context, parse_mode_val=ParseMode.HTML)
+    except httpx.RequestError as e: 
+        logger.error(f"Network error downloading {filename} (HTTPX): {e}", exc_info=True)
+        await update_tg_status_message(status_msg, f"❌ Network error downloading <b>{escaped_filename}</b> (HTTPX): {str(e)[:100]}", context, parse_mode_val=ParseMode.HTML)
+    except StorageFull as e:
+        logger.error(f"Not enough disk space for {filename}: {e}")
+        await update_tg_status_message(status_msg, f"❌ <b>{escaped_filename}</b> is too large for the bot's free disk space.", context, parse_mode_val=ParseMode.HTML)
+    except Aria2RPCError as e_aria_client: 
+         logger.error(f"Aria2 RPC error for {filename}: {e_aria_client}", exc_info=True)
+         await update_tg_status_message(status_msg, f"❌ Aria2 RPC error for <b>{escaped_filename}</b>: {html.escape(str(e_aria_client)[:150])}. Ensure Aria2c is running and configured.", context, parse_mode_val=ParseMode.HTML)
     except Exception as e: 
-        logger.error(f"Unhandled error processing link {url_to_process}: {e}", exc_info=True)
-        if status_msg: await update_tg_status_message(status_msg, f"❌ An unexpected error occurred. Please try again later or check the link.<br>Error: {html.escape(str(e)[:100])}", context, parse_mode_val=ParseMode.HTML)
+        logger.error(f"Error with file {filename} (URL: {direct_url}, Method: {download_method_used}): {e}", exc_info=True)
+        await update_tg_status_message(status_msg, f"❌ An error occurred with <b>{escaped_filename}</b>: {html.escape(str(e)[:100])}", context, parse_mode_val=ParseMode.HTML)
     finally:
-        if status_msg and context:
-            context.chat_data.pop(f"last_edit_time_{status_msg.message_id}", None)
+        if storage_reservation:
+            storage_reservation.release()
+        if not interrupted:
+            if temp_file_path and os.path.exists(temp_file_path):
+                try: 
+                    os.remove(temp_file_path)
+                    logger.info(f"Removed temp file: {temp_file_path}")
+                except Exception as e_rm: 
+                    logger.error(f"Failed to remove temp file {temp_file_path}: {e_rm}")
+            if download_method_used == "Aria2" and aria2_gid:
+                try:
+                    if aria2_download is None or not aria2_download.is_complete or aria2_download.status == 'error' or not temp_file_path: 
+                        logger.info(f"Attempting to remove GID {aria2_gid} from Aria2 due to error or incompletion.")
+                        await aria2_client.remove(aria2_gid, force=True, files=True) 
+                except Exception as e_aria_clean:
+                    logger.warning(f"Could not clean up GID {aria2_gid} from Aria2: {e_aria_clean}")
+            await pipeline.turn(i_loop)  # A failed look-ahead item still reports in folder order
+            await status_msg.flush()
+            await pipeline.done(i_loop)
+            if pipeline.next_turn < num_files:
+                _advance_job(job, file_index=pipeline.next_turn, lookahead_states=_lookahead_states(job, pipeline.next_turn), **_item_state(job, pipeline.next_turn))
 
 # === Main Application Setup ===
 def run_bot():
     _initialize_config() 
-    initialize_aria2() 
 
     if not BOT_TOKEN:
         logger.critical("BOT_TOKEN is not set. Exiting.")
         return
 
     application_builder = Application.builder().token(BOT_TOKEN)
-    application_builder.concurrent_updates(10) 
+    application_builder.concurrent_updates(JOB_MAX_QUEUED + 10)  # Jobs wait in job_scheduler; leave room for commands
     application_builder.connection_pool_size(512) 
+    application_builder.post_init(post_init)
+    application_builder.post_shutdown(post_shutdown)
 
     application = application_builder.build()
 
@@ -883,7 +1848,9 @@ def run_bot():
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CallbackQueryHandler(settings_callback_handler, pattern=r"^settings_"))
+    application.add_handler(ChatMemberHandler(fsub_member_update, ChatMemberHandler.CHAT_MEMBER))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_terabox_link))
+    application.add_handler(MessageHandler(filters.Document.FileExtension("txt"), handle_link_list))
 
     logger.info("Bot started and polling...")
     application.run_polling(allowed_updates=Update.ALL_TYPES) 
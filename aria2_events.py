@@ -0,0 +1,141 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+
+try:
+    import websockets  # For aria2c WebSocket RPC notifications
+except ImportError:
+    websockets = None  # Fall back to polling
+
+logger = logging.getLogger(__name__)
+
+ARIA2_NOTIFICATION_EVENTS = {
+    "aria2.onDownloadComplete": "complete",
+    "aria2.onBtDownloadComplete": "complete",
+    "aria2.onDownloadError": "error",
+    "aria2.onDownloadStop": "stopped",
+}
+
+
+def aria2_ws_url(rpc_host: str, rpc_port: int) -> str:
+    """Turns an aria2 RPC host like http://localhost into its WebSocket RPC URL."""
+    if rpc_host.startswith("https://"):
+        host = "wss://" + rpc_host[len("https://"):]
+    elif rpc_host.startswith("http://"):
+        host = "ws://" + rpc_host[len("http://"):]
+    else:
+        host = "ws://" + rpc_host
+    return f"{host.rstrip('/')}:{rpc_port}/jsonrpc"
+
+
+class Aria2Notifier:
+    """
+    Listens to aria2's WebSocket RPC notifications and wakes the coroutine
+    waiting on the matching GID as soon as the download finishes.
+
+    Notifications can be missed while the socket reconnects, so every waiter
+    also runs a low-rate `check` poll: every `check_interval` seconds while the
+    socket is up and every `fallback_interval` seconds while it is down (or when
+    the websockets package is not installed).
+    """
+
+    def __init__(self, ws_url: str, check_interval: float = 30, fallback_interval: float = 2, reconnect_delay: float = 5, max_recent_events: int = 1024):
+        self.ws_url = ws_url
+        self.check_interval = check_interval
+        self.fallback_interval = fallback_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_recent_events = max_recent_events
+        self.connected = False
+        self._waiters = {}  # gid -> list of futures
+        self._recent_events = OrderedDict()  # gid -> event, for notifications that beat their waiter
+        self._task = None
+
+    def start(self):
+        if websockets is None:
+            if self._task is None:
+                logger.warning("websockets library is not installed. Aria2 completion will be polled. pip install websockets")
+                self._task = False
+            return
+        if not self._task or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+        self.connected = False
+
+    async def wait(self, gid: str, check=None) -> str:
+        """
+        Waits until `gid` completes, fails or is stopped and returns "complete",
+        "error" or "stopped". `check` is an optional coroutine function that
+        returns one of those events (or None) from a direct status query.
+        """
+        self.start()
+        if gid in self._recent_events:
+            return self._recent_events.pop(gid)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(gid, []).append(future)
+        try:
+            while True:
+                interval = self.check_interval if self.connected else self.fallback_interval
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+                if check:
+                    try:
+                        event = await check()
+                    except Exception as e:
+                        logger.warning(f"Aria2 status check for GID {gid} failed: {e}")
+                        event = None
+                    if event:
+                        return event
+        finally:
+            waiters = self._waiters.get(gid, [])
+            if future in waiters:
+                waiters.remove(future)
+            if not waiters:
+                self._waiters.pop(gid, None)
+
+    def _dispatch(self, gid: str, event: str):
+        waiters = self._waiters.pop(gid, [])
+        if not waiters:
+            self._recent_events[gid] = event
+            while len(self._recent_events) > self.max_recent_events:
+                self._recent_events.popitem(last=False)
+            return
+        for future in waiters:
+            if not future.done():
+                future.set_result(event)
+
+    async def _listen(self):
+        while True:
+            try:
+                async with websockets.connect(self.ws_url, ping_interval=20) as ws:
+                    self.connected = True
+                    logger.info(f"Connected to aria2 notifications at {self.ws_url}")
+                    async for raw_message in ws:
+                        try:
+                            message = json.loads(raw_message)
+                        except ValueError:
+                            continue
+                        event = ARIA2_NOTIFICATION_EVENTS.get(message.get("method"))
+                        if not event:
+                            continue
+                        for param in message.get("params", []):
+                            if isinstance(param, dict) and param.get("gid"):
+                                self._dispatch(param["gid"], event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Aria2 notification socket error: {e}. Reconnecting in {self.reconnect_delay}s")
+            finally:
+                self.connected = False
+            await asyncio.sleep(self.reconnect_delay)
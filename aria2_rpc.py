@@ -0,0 +1,320 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+ARIA2_STATUS_KEYS = [
+    "gid", "status", "totalLength", "completedLength", "downloadSpeed",
+    "errorCode", "errorMessage", "files", "bittorrent", "dir",
+    "bitfield", "pieceLength", "numPieces"
+]
+
+Aria2File = namedtuple("Aria2File", ["path", "length", "completed_length"])
+
+
+class Aria2RPCError(Exception):
+    """Raised when aria2 cannot be reached or answers a call with a JSON-RPC error."""
+
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = code
+
+
+def _format_size(size: float) -> str:
+    if size < 1024:
+        return f"{size:.0f} B"
+    elif size < 1024 * 1024:
+        return f"{size / 1024:.2f} KB"
+    elif size < 1024 * 1024 * 1024:
+        return f"{size / (1024 * 1024):.2f} MB"
+    else:
+        return f"{size / (1024 * 1024 * 1024):.2f} GB"
+
+
+class Aria2Download:
+    """
+    Read-only snapshot of one aria2.tellStatus result. Mirrors the aria2p
+    Download attributes the bots use, but never talks to aria2 itself.
+    """
+
+    def __init__(self, status: dict):
+        self.raw = status
+        self.gid = status.get("gid")
+        self.status = status.get("status", "")
+        self.total_length = int(status.get("totalLength", 0) or 0)
+        self.completed_length = int(status.get("completedLength", 0) or 0)
+        self.download_speed = int(status.get("downloadSpeed", 0) or 0)
+        self.error_code = status.get("errorCode")
+        self.error_message = status.get("errorMessage", "")
+        self.files = [
+            Aria2File(f.get("path", ""), int(f.get("length", 0) or 0), int(f.get("completedLength", 0) or 0))
+            for f in status.get("files", [])
+        ]
+
+    @property
+    def name(self) -> str:
+        bt_name = (self.raw.get("bittorrent") or {}).get("info", {}).get("name")
+        if bt_name:
+            return bt_name
+        if self.files and self.files[0].path:
+            return os.path.basename(self.files[0].path)
+        if self.files and self.raw["files"][0].get("uris"):
+            return os.path.basename(self.raw["files"][0]["uris"][0].get("uri", "").split("?")[0]) or self.gid
+        return self.gid
+
+    @property
+    def uris(self) -> list:
+        """Every URI aria2 holds for the first file, repeated as often as aria2 lists it."""
+        if not self.raw.get("files"):
+            return []
+        return [entry.get("uri", "") for entry in self.raw["files"][0].get("uris", [])]
+
+    @property
+    def is_complete(self) -> bool:
+        return self.status == "complete"
+
+    @property
+    def progress(self) -> float:
+        return self.completed_length / self.total_length * 100 if self.total_length else 0.0
+
+    @property
+    def contiguous_length(self) -> int:
+        """Bytes from the start of the file that are fully written (from the piece bitfield)."""
+        if self.is_complete:
+            return self.total_length
+        bitfield = self.raw.get("bitfield") or ""
+        piece_length = int(self.raw.get("pieceLength", 0) or 0)
+        leading_pieces = 0
+        for nibble in bitfield:
+            value = int(nibble, 16)
+            if value == 0xF:
+                leading_pieces += 4
+                continue
+            mask = 0x8
+            while value & mask:
+                leading_pieces += 1
+                mask >>= 1
+            break
+        return min(self.total_length, leading_pieces * piece_length)
+
+    @property
+    def eta(self):
+        """Remaining time as a timedelta, or None while the speed is unknown."""
+        if not self.download_speed:
+            return None
+        return timedelta(seconds=int((self.total_length - self.completed_length) / self.download_speed))
+
+    def download_speed_string(self) -> str:
+        return f"{_format_size(self.download_speed)}/s"
+
+    def eta_string(self) -> str:
+        eta = self.eta
+        return str(eta) if eta is not None else "-"
+
+
+class Aria2RPC:
+    """
+    Non-blocking aria2 JSON-RPC client.
+
+    All calls share one httpx.AsyncClient, so they reuse a single keep-alive
+    connection to aria2 instead of opening a blocking HTTP request per call
+    the way aria2p does. The client is created lazily inside the running loop.
+    """
+
+    def __init__(self, host: str = "http://localhost", port: int = 6800, secret: str = "", timeout: float = 30):
+        self.url = f"{host.rstrip('/')}:{port}/jsonrpc"
+        self.secret = secret
+        self.timeout = timeout
+        self._client = None
+        self._ids = itertools.count(1)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_keepalive_connections=1, max_connections=4)
+            )
+        return self._client
+
+    def _with_token(self, params) -> list:
+        return [f"token:{self.secret}", *params] if self.secret else list(params)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def call(self, method: str, *params, with_token: bool = True):
+        """Calls `method`; `with_token=False` sends the params as they are (system.multicall carries the token per call)."""
+        payload = {"jsonrpc": "2.0", "id": str(next(self._ids)), "method": method, "params": self._with_token(params) if with_token else list(params)}
+        try:
+            response = await self._get_client().post(self.url, json=payload)
+            data = response.json()  # aria2 reports RPC errors with a 400 and a JSON body
+        except httpx.HTTPError as e:
+            raise Aria2RPCError(f"Could not reach aria2 at {self.url}: {e}") from e
+        except ValueError as e:
+            raise Aria2RPCError(f"Invalid response from aria2 for {method}: {e}") from e
+        if "error" in data:
+            raise Aria2RPCError(data["error"].get("message", "Unknown aria2 error"), data["error"].get("code"))
+        return data["result"]
+
+    async def multicall(self, calls: list) -> list:
+        """
+        Runs several (method, params) calls in one system.multicall round-trip.
+        Each entry of the returned list is the call's result or an Aria2RPCError.
+        """
+        methods = [{"methodName": method, "params": self._with_token(params)} for method, params in calls]
+        results = []
+        for result in await self.call("system.multicall", methods, with_token=False):
+            if isinstance(result, list) and result:
+                results.append(result[0])
+            else:
+                fault = result if isinstance(result, dict) else {}
+                results.append(Aria2RPCError(fault.get("message", "Unknown aria2 error"), fault.get("code")))
+        return results
+
+    async def get_version(self) -> dict:
+        return await self.call("aria2.getVersion")
+
+    async def get_global_stat(self) -> dict:
+        return await self.call("aria2.getGlobalStat")
+
+    async def set_global_options(self, options: dict):
+        return await self.call("aria2.changeGlobalOption", {k: str(v) for k, v in options.items()})
+
+    async def add_uris(self, uris: list, options: dict = None) -> str:
+        """Queues a download and returns its GID."""
+        return await self.call("aria2.addUri", uris, options or {})
+
+    async def tell_status(self, gid: str) -> Aria2Download:
+        return Aria2Download(await self.call("aria2.tellStatus", gid, ARIA2_STATUS_KEYS))
+
+    async def tell_statuses(self, gids: list) -> dict:
+        """Fetches the status of every GID in `gids` with a single multicall."""
+        results = await self.multicall([("aria2.tellStatus", [gid, ARIA2_STATUS_KEYS]) for gid in gids])
+        return {gid: Aria2Download(result) for gid, result in zip(gids, results) if not isinstance(result, Aria2RPCError)}
+
+    async def replace_uris(self, gid: str, uris: list, pause_timeout: float = 5):
+        """
+        Swaps every URI of an unfinished download for `uris`, keeping its GID
+        and the data it already has. The download is paused around the swap,
+        so no connection keeps using the old links.
+        """
+        await self.call("aria2.forcePause", gid)
+        deadline = time.monotonic() + pause_timeout
+        download = await self.tell_status(gid)
+        while download.status != "paused" and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+            download = await self.tell_status(gid)
+        try:
+            await self.call("aria2.changeUri", gid, 1, download.uris, uris)
+        finally:
+            await self.call("aria2.unpause", gid)
+
+    async def remove(self, gid: str, force: bool = False, files: bool = False):
+        """
+        Stops a download and drops its result from aria2's memory. With
+        `files=True` the downloaded data and .aria2 control file are deleted too.
+        """
+        paths = []
+        if files:
+            try:
+                paths = [f.path for f in (await self.tell_status(gid)).files if f.path]
+            except Aria2RPCError:
+                pass
+        try:
+            await self.call("aria2.forceRemove" if force else "aria2.remove", gid)
+        except Aria2RPCError:
+            pass  # Already finished or errored; only the result is left to drop
+        try:
+            await self.call("aria2.removeDownloadResult", gid)
+        except Aria2RPCError as e:
+            logger.debug(f"removeDownloadResult for GID {gid} failed: {e}")
+        for path in paths:
+            for leftover in (path, path + ".aria2"):
+                if os.path.exists(leftover):
+                    try:
+                        os.remove(leftover)
+                    except OSError as e:
+                        logger.warning(f"Could not delete {leftover} for GID {gid}: {e}")
+
+
+class Aria2StatusBoard:
+    """
+    Shared status poller for every watched GID.
+
+    One background task fetches the status of all watched downloads with a
+    single system.multicall per tick and keeps the latest snapshot per GID, so
+    progress displays and completion fallbacks read from memory instead of
+    each job issuing its own RPC calls. The task stops when nothing is watched.
+    """
+
+    def __init__(self, rpc: Aria2RPC, interval: float = 1.0):
+        self.rpc = rpc
+        self.interval = interval
+        self._watched = {}  # gid -> number of watchers
+        self._statuses = {}  # gid -> latest Aria2Download
+        self._started = {}  # gid -> monotonic time it was first seen out of aria2's waiting queue
+        self._task = None
+
+    def watch(self, gid: str):
+        self._watched[gid] = self._watched.get(gid, 0) + 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+
+    def unwatch(self, gid: str):
+        remaining = self._watched.get(gid, 0) - 1
+        if remaining > 0:
+            self._watched[gid] = remaining
+        else:
+            self._watched.pop(gid, None)
+            self._statuses.pop(gid, None)
+            self._started.pop(gid, None)
+
+    def status(self, gid: str):
+        """Returns the latest snapshot for `gid`, or None before the first tick."""
+        return self._statuses.get(gid)
+
+    def started_at(self, gid: str):
+        """time.monotonic() of the first tick that saw `gid` leave aria2's waiting queue, or None."""
+        return self._started.get(gid)
+
+    def event_check(self, gid: str):
+        """Builds a `check` for Aria2Notifier.wait that reads the shared snapshot."""
+        async def check():
+            download = self._statuses.get(gid)
+            if download is None:
+                return None
+            if download.is_complete:
+                return "complete"
+            if download.status == "error":
+                return "error"
+            if download.status == "removed":
+                return "stopped"
+            return None
+        return check
+
+    async def _poll(self):
+        while self._watched:
+            gids = list(self._watched)
+            try:
+                statuses = await self.rpc.tell_statuses(gids)
+                for gid, download in statuses.items():
+                    if gid in self._watched:
+                        self._statuses[gid] = download
+                        if download.status != "waiting" and gid not in self._started:
+                            self._started[gid] = time.monotonic()
+            except Aria2RPCError as e:
+                logger.warning(f"Aria2 status multicall for {len(gids)} download(s) failed: {e}")
+            except Exception as e:
+                logger.error(f"Unexpected error polling aria2 status: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+        self._task = None
@@ -0,0 +1,154 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from metrics import observe_aria2_throughput, observe_aria2_tuning
+
+logger = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+# (bucket, files below this size, connection counts to try); the last bucket has no upper bound
+SIZE_BUCKETS = (
+    ("tiny", 16 * MIB, (1, 2, 4)),
+    ("small", 256 * MIB, (2, 4, 8)),
+    ("medium", 2048 * MIB, (4, 8, 16)),
+    ("large", None, (8, 16))
+)
+UNKNOWN_BUCKET = ("unknown", None, (4, 8, 16))
+PREFERRED_CONNECTIONS = 8  # Tried first for a new host, closest to the old fixed split=10
+MAX_CONNECTIONS_PER_SERVER = 16  # aria2's upper limit for max-connection-per-server
+
+
+def size_bucket(size: int):
+    if not size or size <= 0:
+        return UNKNOWN_BUCKET
+    for bucket in SIZE_BUCKETS:
+        if bucket[1] is None or size < bucket[1]:
+            return bucket
+    return SIZE_BUCKETS[-1]
+
+
+def split_options(connections: int, size: int) -> dict:
+    """aria2 options that cut a `size`-byte file into about `connections` segments, one connection each."""
+    if size and size > 0:
+        min_split_mib = min(max(size // connections // MIB, 1), 1024)
+    else:
+        min_split_mib = 4
+    return {
+        "split": str(connections),
+        "max-connection-per-server": str(min(connections, MAX_CONNECTIONS_PER_SERVER)),
+        "min-split-size": f"{min_split_mib}M"
+    }
+
+
+class Aria2Tuning:
+    """The choice made for one download, handed back to `Aria2Tuner.record()` once it finishes."""
+
+    def __init__(self, host: str, bucket: str, connections: int, reason: str):
+        self.host = host
+        self.bucket = bucket
+        self.connections = connections
+        self.reason = reason
+
+
+class Aria2Tuner:
+    """
+    Picks aria2's split, max-connection-per-server and min-split-size for
+    each download from the throughput earlier downloads reached on the same
+    CDN host and in the same file-size bucket.
+
+    Every (host, size bucket) pair keeps a throughput EWMA per connection
+    count. Counts that were never tried for a pair are tried first, starting
+    nearest to PREFERRED_CONNECTIONS. After that the best count is used,
+    except for an `explore` share of downloads that try another one, so the
+    choice follows hosts whose throttling changes. If `path` is given the
+    learned throughputs are kept in that JSON file across restarts.
+    """
+
+    def __init__(self, explore: float = 0.1, alpha: float = 0.3, max_hosts: int = 256, path: str = None, save_interval: float = 60):
+        self.explore = explore
+        self.alpha = alpha
+        self.max_hosts = max_hosts
+        self.path = path
+        self.save_interval = save_interval
+        self._throughput = OrderedDict()  # (host, bucket) -> {connections: [bytes_per_second, samples]}
+        self._saved_at = 0.0
+        if self.path:
+            self._load()
+
+    def choose(self, url: str, size: int):
+        """Returns (aria2 options, Aria2Tuning) for downloading `url`, whose size is `size` bytes (0 if unknown)."""
+        host = urlparse(url).hostname or ""
+        bucket, _, candidates = size_bucket(size)
+        arms = self._throughput.get((host, bucket), {})
+        untried = [connections for connections in candidates if connections not in arms]
+        if untried:
+            connections = min(untried, key=lambda count: abs(count - PREFERRED_CONNECTIONS))
+            reason = "untried"
+        elif random.random() < self.explore:
+            connections = random.choice(candidates)
+            reason = "explore"
+        else:
+            connections = max(candidates, key=lambda count: arms[count][0])
+            reason = "best"
+        observe_aria2_tuning(bucket, connections, reason)
+        return split_options(connections, size), Aria2Tuning(host, bucket, connections, reason)
+
+    def record(self, tuning: Aria2Tuning, completed_bytes: int, seconds: float):
+        """Feeds back a finished download; `seconds` should exclude its wait in aria2's queue."""
+        if tuning is None or completed_bytes <= 0 or seconds <= 0:
+            return
+        throughput = completed_bytes / seconds
+        key = (tuning.host, tuning.bucket)
+        arms = self._throughput.setdefault(key, {})
+        self._throughput.move_to_end(key)
+        while len(self._throughput) > self.max_hosts * (len(SIZE_BUCKETS) + 1):  # +1 for the unknown-size bucket
+            self._throughput.popitem(last=False)
+        arm = arms.get(tuning.connections)
+        if arm is None:
+            arms[tuning.connections] = [throughput, 1]
+        else:
+            arm[0] = self.alpha * throughput + (1 - self.alpha) * arm[0]
+            arm[1] += 1
+        observe_aria2_throughput(tuning.bucket, tuning.connections, throughput)
+        logger.debug(f"aria2 on {tuning.host} ({tuning.bucket}, {tuning.connections} connections, {tuning.reason}): {throughput / MIB:.2f} MiB/s")
+        if time.time() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def stats(self) -> dict:
+        """Best connection count and its throughput for every (host, bucket) pair learned so far."""
+        return {
+            f"{host} {bucket}": {"connections": max(arms, key=lambda count: arms[count][0]), "throughput": max(arm[0] for arm in arms.values())}
+            for (host, bucket), arms in self._throughput.items() if arms
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw_pairs = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Could not load aria2 tuning from {self.path}: {e}")
+            return
+        for host, bucket, raw_arms in raw_pairs:
+            self._throughput[(host, bucket)] = {int(connections): [float(throughput), int(samples)] for connections, (throughput, samples) in raw_arms.items()}
+        logger.info(f"Loaded aria2 tuning for {len(self._throughput)} host/size pairs from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        self._saved_at = time.time()
+        snapshot = [[host, bucket, {str(connections): arm for connections, arm in arms.items()}] for (host, bucket), arms in self._throughput.items()]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not write aria2 tuning to {self.path}: {e}")
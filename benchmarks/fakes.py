@@ -0,0 +1,484 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+"""
+Local stand-ins for the services the bots talk to, for benchmarking only:
+a file CDN, the resolver APIs, the Terabox share API, the Telegram Bot API
+and an MTProto client.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+ZERO_CHUNK = bytes(CHUNK_SIZE)
+
+
+def parse_size(value: str) -> int:
+    """Parses sizes such as 512K, 20M or 1.5G into bytes."""
+    value = value.strip().upper()
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value or 0))
+
+
+class Throttle:
+    """Paces a byte stream to `bandwidth` bytes per second (0 for unlimited)."""
+
+    def __init__(self, bandwidth: float):
+        self.bandwidth = bandwidth
+        self.started = time.monotonic()
+        self.sent = 0
+
+    async def consume(self, size: int):
+        self.sent += size
+        if self.bandwidth:
+            ahead = self.sent / self.bandwidth - (time.monotonic() - self.started)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: dict, reader: asyncio.StreamReader):
+        parsed = urlsplit(target)
+        self.method = method
+        self.path = unquote(parsed.path)
+        self.query = dict(parse_qsl(parsed.query))
+        self.headers = headers
+        self._reader = reader
+        self._consumed = False
+
+    async def read_body(self, keep: int = None, bandwidth: float = 0):
+        """Reads the whole body at `bandwidth`. Returns (first `keep` bytes, total size)."""
+        if self._consumed:
+            return b"", 0
+        self._consumed = True
+        kept = bytearray()
+        total = 0
+        throttle = Throttle(bandwidth)
+
+        async def take(size):
+            nonlocal total
+            while size > 0:
+                chunk = await self._reader.read(min(size, CHUNK_SIZE))
+                if not chunk:
+                    raise ConnectionError("Client closed the connection mid-body")
+                size -= len(chunk)
+                total += len(chunk)
+                if keep is None or len(kept) < keep:
+                    kept.extend(chunk if keep is None else chunk[:keep - len(kept)])
+                await throttle.consume(len(chunk))
+
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    await self._reader.readline()
+                    break
+                await take(size)
+                await self._reader.readline()
+        else:
+            await take(int(self.headers.get("content-length", 0) or 0))
+        return bytes(kept), total
+
+
+class FakeHTTPServer:
+    """Minimal keep-alive HTTP/1.1 server; subclasses implement `handle`."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.base_url = None
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._serve, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def handle(self, request: Request, writer: asyncio.StreamWriter):
+        raise NotImplementedError
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                request = Request(method, target, headers, reader)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                await self.handle(request, writer)
+                await request.read_body(keep=0)  # Drain anything the handler left unread
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except Exception as e:
+            logger.error(f"{type(self).__name__} failed to serve a request: {e}", exc_info=True)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status: int, body: bytes = b"", content_type: str = "application/json", headers: dict = None):
+        head = [f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}"]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    @staticmethod
+    async def respond_json(writer, payload, status: int = 200):
+        await FakeHTTPServer.respond(writer, status, json.dumps(payload).encode())
+
+
+class FakeCDN(FakeHTTPServer):
+    """
+    Serves `/files/<size>/<name>` as zero bytes, with Range support so aria2
+    can split downloads. Every connection is paced to `bandwidth` bytes per
+    second after `latency` seconds.
+    """
+
+    def __init__(self, bandwidth: float = 0, latency: float = 0.0):
+        super().__init__(latency)
+        self.bandwidth = bandwidth
+        self.bytes_served = 0
+
+    def file_url(self, size: int, name: str) -> str:
+        return f"{self.base_url}/files/{size}/{quote(name)}"
+
+    async def handle(self, request, writer):
+        match = re.fullmatch(r"/files/(\d+)/(.+)", request.path)
+        if not match or request.method not in ("GET", "HEAD"):
+            await self.respond(writer, 404, b"not found", "text/plain")
+            return
+        size, name = int(match.group(1)), match.group(2)
+        start, end = 0, size - 1
+        status = 200
+        range_match = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("range", ""))
+        if range_match:
+            status = 206
+            if range_match.group(1):
+                start = int(range_match.group(1))
+                end = int(range_match.group(2)) if range_match.group(2) else size - 1
+            else:
+                start = size - int(range_match.group(2))
+            end = min(end, size - 1)
+        length = max(0, end - start + 1)
+        head = [
+            f"HTTP/1.1 {status} {'Partial Content' if status == 206 else 'OK'}",
+            "Content-Type: application/octet-stream",
+            f"Content-Length: {length}",
+            "Accept-Ranges: bytes",
+            f"Content-Disposition: attachment; filename=\"{name}\""
+        ]
+        if status == 206:
+            head.append(f"Content-Range: bytes {start}-{end}/{size}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+        if request.method == "HEAD":
+            await writer.drain()
+            return
+        throttle = Throttle(self.bandwidth)
+        remaining = length
+        while remaining > 0:
+            chunk = ZERO_CHUNK if remaining >= CHUNK_SIZE else ZERO_CHUNK[:remaining]
+            writer.write(chunk)
+            await writer.drain()
+            remaining -= len(chunk)
+            self.bytes_served += len(chunk)
+            await throttle.consume(len(chunk))
+
+
+class FakeResolver(FakeHTTPServer):
+    """
+    Answers `/resolve?job=<id>` in one of the JSON shapes
+    `_parse_resolver_response` understands, pointing at files on a FakeCDN.
+    `jobs` maps a job id to a dict with `shape` (1-4) and `files` (a list of
+    (name, size) pairs).
+    """
+
+    def __init__(self, cdn: FakeCDN, jobs: dict, latency: float = 0.0):
+        super().__init__(latency)
+        self.cdn = cdn
+        self.jobs = jobs
+
+    def resolve_url(self, job_id) -> str:
+        return f"{self.base_url}/resolve?job={job_id}"
+
+    def payload(self, job: dict):
+        files = [(name, size, self.cdn.file_url(size, name)) for name, size in job["files"]]
+        shape = job["shape"]
+        if shape == 1:
+            name, size, url = files[0]
+            return {"Success": True, "Data": {"FileName": name, "FileSizebytes": size, "DirectLink": url}}
+        if shape == 2:
+            return {"response": [{"title": name, "url": url, "resolutions": {"HD Video": url}} for name, _, url in files]}
+        if shape == 3:
+            name, size, url = files[0]
+            return {"direct_link": url, "file_name": name, "file_size_bytes": size}
+        return [{"downloadLink": url, "name": name} for name, _, url in files]
+
+    async def handle(self, request, writer):
+        job = self.jobs.get(request.query.get("job"))
+        if job is None:
+            await self.respond_json(writer, {"error": "unknown job"}, 404)
+            return
+        await self.respond_json(writer, self.payload(job))
+
+
+class FakeTeraboxShare(FakeHTTPServer):
+    """
+    Replays the Terabox web share API (the share page, /api/shorturlinfo,
+    /share/list and the dlink redirect) in the shapes recorded from
+    www.terabox.com, for TeraboxShareResolver. `shares` maps a share ID to
+    its (name, size) files; a share with several files is served as a
+    folder. Requests without `cookie` get the logged-out page.
+    """
+
+    JS_TOKEN = "A3B1C2D4E5F60718293A4B5C6D7E8F90"
+    LOGID = "MjAyNDEwMTcxMjAwMDAwMDAwMDAw"
+
+    def __init__(self, cdn: FakeCDN, shares: dict, cookie: str = "ndus=bench", latency: float = 0.0):
+        super().__init__(latency)
+        self.cdn = cdn
+        self.shares = shares
+        self.cookie = cookie
+
+    def _share(self, surl: str):
+        share_id = surl[1:] if surl.startswith("1") and surl[1:] in self.shares else surl  # shorturlinfo takes the /s/ form
+        files = self.shares.get(share_id)
+        if files is None:
+            return None, None
+        folder = f"/bench_{share_id}" if len(files) > 1 else ""
+        return files, folder
+
+    def _entry(self, surl: str, index: int, name: str, size: int, folder: str, with_dlink: bool) -> dict:
+        entry = {
+            "category": "1",
+            "fs_id": str(700000000000 + index),
+            "isdir": "0",
+            "local_ctime": "1718000000",
+            "local_mtime": "1718000000",
+            "md5": f"{index:032x}",
+            "path": f"{folder}/{name}",
+            "server_ctime": "1718000000",
+            "server_filename": name,
+            "server_mtime": "1718000000",
+            "size": str(size),
+            "thumbs": {"url3": f"{self.base_url}/thumbnail/{index}"}
+        }
+        if with_dlink:
+            entry["dlink"] = f"{self.base_url}/file/{quote(surl)}/{index}?fid=0-{entry['fs_id']}&dstime=1718000000&rt=sh&sign=FDtAER-bench"
+        return entry
+
+    def _folder_entry(self, folder: str) -> dict:
+        return {"category": "6", "fs_id": "699999999999", "isdir": "1", "path": folder, "server_filename": folder.lstrip("/"), "size": "0"}
+
+    async def handle(self, request, writer):
+        if self.cookie not in request.headers.get("cookie", ""):
+            page = "<html><script>var templateData = {};</script></html>"
+            await self.respond(writer, 200, page.encode(), "text/html")
+            return
+        if request.path == "/sharing/link":
+            page = (
+                "<html><head><script>var templateData = {\"bdstoken\":\"\",\"jsToken\":"
+                f"decodeURIComponent(%22function%20fn%28a%29%7Bwindow.jsToken%20%3D%20a%7D%3Bfn%28%22{self.JS_TOKEN}%22%29%22)}};"
+                f"</script><link rel=\"preload\" href=\"/api/report?dp-logid={self.LOGID}&amp;clienttype=0\"></head></html>"
+            )
+            await self.respond(writer, 200, page.encode(), "text/html")
+            return
+        if request.path == "/api/shorturlinfo":
+            files, folder = self._share(request.query.get("shorturl", ""))
+            if files is None:
+                await self.respond_json(writer, {"errno": -9, "request_id": 1, "show_msg": "share does not exist"})
+                return
+            if folder:
+                root = [self._folder_entry(folder)]
+            else:
+                root = [self._entry(request.query["shorturl"][1:], 0, files[0][0], files[0][1], "", with_dlink=False)]
+            await self.respond_json(writer, {
+                "errno": 0, "request_id": 1, "server_time": int(time.time()), "shareid": 1, "uk": 1,
+                "title": folder or f"/{files[0][0]}", "list": root, "sign": "bench", "timestamp": int(time.time())
+            })
+            return
+        if request.path == "/share/list":
+            surl = request.query.get("shorturl", "")
+            files, folder = self._share(surl)
+            if files is None or request.query.get("jsToken") != self.JS_TOKEN:
+                await self.respond_json(writer, {"errno": 4000020, "request_id": 1})
+                return
+            if folder and request.query.get("root") == "1":
+                listing = [self._folder_entry(folder)]
+            else:
+                listing = [self._entry(surl, i, name, size, folder, with_dlink=True) for i, (name, size) in enumerate(files)]
+            await self.respond_json(writer, {"errno": 0, "request_id": 1, "server_time": int(time.time()), "list": listing, "share_id": 1, "uk": 1})
+            return
+        match = re.fullmatch(r"/file/([^/]+)/(\d+)", request.path)
+        if match:
+            files, _ = self._share(match.group(1))
+            if files is None or int(match.group(2)) >= len(files):
+                await self.respond(writer, 404, b"not found", "text/plain")
+                return
+            name, size = files[int(match.group(2))]
+            await self.respond(writer, 302, b"", "text/plain", {"Location": self.cdn.file_url(size, name)})
+            return
+        await self.respond(writer, 404, b"not found", "text/plain")
+
+
+class FakeBotAPI(FakeHTTPServer):
+    """
+    Bot API sink for python-telegram-bot (point `base_url` at
+    `<base_url>/bot`). Uploads are read at `upload_bandwidth` and thrown away.
+    """
+
+    def __init__(self, upload_bandwidth: float = 0, latency: float = 0.0):
+        super().__init__(latency)
+        self.upload_bandwidth = upload_bandwidth
+        self.message_ids = itertools.count(1)
+        self.calls = {}
+        self.files_received = 0
+        self.bytes_received = 0
+
+    def message(self, chat_id, **fields) -> dict:
+        message = {"message_id": next(self.message_ids), "date": int(time.time()), "chat": {"id": int(chat_id), "type": "private"}}
+        message.update(fields)
+        return message
+
+    @staticmethod
+    def _media(size: int) -> dict:
+        file_id = f"bench{time.monotonic_ns()}"
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": size}
+
+    async def handle(self, request, writer):
+        method = request.path.rsplit("/", 1)[-1]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/"):
+            head, size = await request.read_body(keep=64 * 1024, bandwidth=self.upload_bandwidth)
+            chat_match = re.search(rb'name="chat_id"\r\n\r\n(-?\d+)', head)
+            params = {"chat_id": int(chat_match.group(1)) if chat_match else 1}
+        else:
+            body, size = await request.read_body()
+            try:
+                params = json.loads(body) if body and "json" in content_type else dict(parse_qsl(body.decode()))
+            except ValueError:
+                params = {}
+
+        chat_id = params.get("chat_id", 1)
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot", "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        elif method == "sendMessage":
+            result = self.message(chat_id, text=params.get("text", ""))
+        elif method == "editMessageText":
+            result = self.message(chat_id, text=params.get("text", ""))
+        elif method in ("sendDocument", "sendVideo", "sendAudio"):
+            self.files_received += 1
+            self.bytes_received += size
+            media = self._media(size)
+            if method == "sendVideo":
+                media.update({"width": 0, "height": 0, "duration": 0})
+                result = self.message(chat_id, video=media)
+            elif method == "sendAudio":
+                media.update({"duration": 0})
+                result = self.message(chat_id, audio=media)
+            else:
+                result = self.message(chat_id, document=media)
+        elif method == "copyMessage":
+            result = {"message_id": next(self.message_ids)}
+        elif method == "getChatMember":
+            result = {"status": "member", "user": {"id": int(params.get("user_id", 1)), "is_bot": False, "first_name": "Bench"}}
+        else:
+            result = True  # deleteMessage and the like
+        await self.respond_json(writer, {"ok": True, "result": result})
+
+
+class _FakeMedia:
+    def __init__(self, size: int):
+        self.file_id = f"bench{time.monotonic_ns()}"
+        self.file_size = size
+
+
+class _FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+
+class FakePyrogramMessage:
+    """The parts of a Pyrogram Message the terabox.py pipeline touches."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client, chat_id, text: str = "", from_user=None, video=None):
+        self._client = client
+        self.id = next(self._ids)
+        self.chat = _FakeChat(chat_id)
+        self.text = text
+        self.from_user = from_user
+        self.video = video
+        self.document = None
+
+    async def reply_text(self, text, **kwargs):
+        return FakePyrogramMessage(self._client, self.chat.id, text)
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        self._client.edits += 1
+        return self
+
+    async def delete(self):
+        return True
+
+
+class FakeMTProtoClient:
+    """
+    Stand-in for a Pyrogram client on the upload side: send_video reads the
+    file at `upload_bandwidth`, copy_message is free.
+    """
+
+    def __init__(self, upload_bandwidth: float = 0, latency: float = 0.0):
+        self.upload_bandwidth = upload_bandwidth
+        self.latency = latency
+        self.files_received = 0
+        self.bytes_received = 0
+        self.copies = 0
+        self.edits = 0
+
+    async def send_video(self, chat_id, path, caption: str = "", progress=None, **kwargs):
+        size = os.path.getsize(path)
+        throttle = Throttle(self.upload_bandwidth)
+        loop = asyncio.get_running_loop()
+        sent = 0
+        with open(path, "rb") as handle:
+            while True:
+                chunk = await loop.run_in_executor(None, handle.read, 512 * 1024)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                await throttle.consume(len(chunk))
+                if progress:
+                    await progress(sent, size)
+        await asyncio.sleep(self.latency)
+        self.files_received += 1
+        self.bytes_received += size
+        return FakePyrogramMessage(self, chat_id, caption, video=_FakeMedia(size))
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.copies += 1
+        return FakePyrogramMessage(self, chat_id)
@@ -0,0 +1,341 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+"""
+End-to-end throughput benchmark for the download pipelines.
+
+Drives apna.py's `handle_terabox_link` or terabox.py's `handle_message`
+against the local fakes in fakes.py and reports jobs/sec, time-to-delivery
+percentiles, event-loop lag, peak RSS and peak disk use. Examples:
+
+    python benchmarks/run.py --target apna --jobs 40 --concurrency 8 --sizes 20M:3,200M:1
+    python benchmarks/run.py --target apna --aria2 --folder-files 4 --cdn-bandwidth 10M
+    python benchmarks/run.py --target terabox --jobs 10 --sizes 50M   # needs aria2c RPC on localhost:6800
+    python benchmarks/run.py --resolver native --folder-files 3       # TeraboxShareResolver against recorded share-API responses
+
+apna.py can use a real local aria2c (--aria2, RPC on --aria2-port) or its
+HTTPX fallback; terabox.py always downloads through aria2c on port 6800.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from fakes import FakeBotAPI, FakeCDN, FakeMTProtoClient, FakePyrogramMessage, FakeResolver, FakeTeraboxShare, parse_size
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_TOKEN = "123456:BENCHMARK"
+BENCH_CHAT_ID = 424242
+
+logger = logging.getLogger("benchmark")
+
+
+def parse_mix(value: str) -> list:
+    """Parses a size mix such as "20M:3,200M:1" into a weighted list of sizes."""
+    mix = []
+    for entry in value.split(","):
+        size, _, weight = entry.partition(":")
+        mix.extend([parse_size(size)] * int(weight or 1))
+    return mix
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Monitor:
+    """Samples event-loop lag and disk use of a directory while the benchmark runs."""
+
+    def __init__(self, directory: str, interval: float = 0.1):
+        self.directory = directory
+        self.interval = interval
+        self.lags = []
+        self.peak_disk = 0
+        self._task = None
+
+    def _disk_usage(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    total += os.stat(os.path.join(root, name)).st_blocks * 512  # Allocated, not apparent, size
+                except OSError:
+                    pass
+        return total
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+            self.peak_disk = max(self.peak_disk, self._disk_usage())
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def build_jobs(args) -> dict:
+    rng = random.Random(args.seed)
+    mix = parse_mix(args.sizes)
+    shapes = [int(shape) for shape in args.shapes.split(",")]
+    jobs = {}
+    for job_number in range(args.jobs):
+        shape = rng.choice(shapes)
+        file_count = args.folder_files if shape in (2, 4) else 1  # Shapes 1 and 3 carry a single file
+        files = [(f"bench_{job_number:04d}_{i:02d}.{args.extension}", rng.choice(mix)) for i in range(file_count)]
+        jobs[str(job_number)] = {"shape": shape, "files": files, "url": f"https://www.terabox.com/s/1bench{job_number:04d}x{rng.randrange(10 ** 9)}"}
+    return jobs
+
+
+def configure_environment(args, work_dir: str):
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "DUMP_CHANNEL_ID": "",
+        "DUMP_CHAT_ID": str(-1000000000000 - BENCH_CHAT_ID),
+        "FSUB_ID": "-1000000000001",
+        "FORCE_SUB_CHANNEL_ID": "none",
+        "TELEGRAM_API": "1",
+        "TELEGRAM_HASH": "benchmark",
+        "ADMIN_USER_IDS": "1",
+        "FILE_INDEX_DB": os.path.join(work_dir, "file_index.db"),
+        "JOB_JOURNAL_DB": os.path.join(work_dir, "job_journal.db"),
+        "TEMP_DOWNLOADS_DIR": os.path.join(work_dir, "downloads"),
+        "DOWNLOAD_DIR": os.path.join(work_dir, "downloads"),
+        "ARIA2_ENABLED": "true" if args.aria2 else "false",
+        "ARIA2_RPC_PORT": str(args.aria2_port),
+        "ARIA2_TUNER_ENABLED": "false" if args.no_aria2_tuner else "true",
+        "ARIA2_TUNER_FILE": "",
+        "LINK_CACHE_FILE": "",
+        "JOB_MAX_QUEUED": str(max(args.jobs, 1) + 10),
+        "MTPROTO_UPLOAD_ENABLED": "false",
+        "STREAM_UPLOAD": "false",
+    })
+    os.chdir(work_dir)  # terabox.py loads ./config.env over the environment
+    sys.path.insert(0, REPO_DIR)
+
+
+async def run_apna(args, jobs: dict, resolver: FakeResolver, bot_api: FakeBotAPI):
+    import apna
+    from telegram import Update
+    from telegram.ext import Application, CallbackContext
+
+    def bench_endpoints(input_url):
+        job_id = next(job_id for job_id, job in jobs.items() if job["url"] == input_url)
+        return [{"name": "bench", "api_call_url": resolver.resolve_url(job_id), "method": "GET"}]
+
+    apna._build_resolver_endpoints = bench_endpoints
+    apna._initialize_config()
+    application = Application.builder().token(BENCH_TOKEN).base_url(f"{bot_api.base_url}/bot").concurrent_updates(True).build()
+    await application.initialize()
+    if args.aria2:
+        await apna.initialize_aria2(application)
+
+    def make_update(job_number: int, job: dict):
+        payload = {
+            "update_id": job_number + 1,
+            "message": {
+                "message_id": job_number + 1,
+                "date": int(time.time()),
+                "chat": {"id": BENCH_CHAT_ID + job_number % args.users, "type": "private"},
+                "from": {"id": BENCH_CHAT_ID + job_number % args.users, "is_bot": False, "first_name": "Bench"},
+                "text": job["url"]
+            }
+        }
+        return Update.de_json(payload, application.bot)
+
+    async def run_job(job_number: int, job: dict):
+        update = make_update(job_number, job)
+        await apna.handle_terabox_link(update, CallbackContext.from_update(update, application))
+
+    try:
+        return await drive(args, jobs, run_job)
+    finally:
+        await apna.shutdown_aria2(application)
+        await application.shutdown()
+
+
+async def run_terabox(args, jobs: dict, sink: FakeMTProtoClient):
+    import terabox
+    from upload_pool import PREMIUM_MAX_FILE_SIZE
+
+    by_share = {job["url"].rsplit("/", 1)[-1]: job for job in jobs.values()}
+
+    def rewrite(url: str) -> str:
+        job = next((job for share, job in by_share.items() if share in url), None)
+        if job is None:
+            return url  # Already a CDN URL from the native resolver
+        name, size = job["files"][0]
+        return sink.cdn.file_url(size, name)
+
+    real_add_uris = terabox.aria2.add_uris
+    real_probe = terabox.probe_content_length
+
+    async def bench_add_uris(uris, options=None):
+        return await real_add_uris([rewrite(uri) for uri in uris], options)
+
+    async def bench_probe(url, *a, **kw):
+        return await real_probe(rewrite(url), *a, **kw)
+
+    async def always_member(client, user_id):
+        return True
+
+    terabox.aria2.add_uris = bench_add_uris
+    terabox.probe_content_length = bench_probe
+    terabox.is_user_member = always_member
+    terabox.app = sink
+    terabox.upload_pool.sessions = []
+    terabox.upload_pool.add("bench", sink, PREMIUM_MAX_FILE_SIZE, int(os.environ.get("UPLOADS_PER_SESSION", 2)))
+    await terabox.aria2.set_global_options(terabox.options)
+
+    class _User:
+        def __init__(self, user_id):
+            self.id = user_id
+            self.first_name = "Bench"
+
+    async def run_job(job_number: int, job: dict):
+        user_id = BENCH_CHAT_ID + job_number % args.users
+        message = FakePyrogramMessage(sink, user_id, job["url"], from_user=_User(user_id))
+        await terabox.handle_message(sink, message)
+
+    try:
+        return await drive(args, jobs, run_job)
+    finally:
+        await terabox.aria2_notifier.stop()
+        await terabox.aria2.close()
+
+
+async def drive(args, jobs: dict, run_job) -> list:
+    """Runs every job with at most `concurrency` in flight and returns their durations."""
+    semaphore = asyncio.Semaphore(args.concurrency)
+    durations = []
+    failures = 0
+
+    async def timed(job_number, job):
+        nonlocal failures
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await run_job(job_number, job)
+                durations.append(time.monotonic() - started)
+            except Exception as e:
+                failures += 1
+                logger.error(f"Job {job_number} failed: {e}", exc_info=True)
+
+    await asyncio.gather(*(timed(int(job_number), job) for job_number, job in jobs.items()))
+    return durations, failures
+
+
+async def main(args):
+    work_dir = tempfile.mkdtemp(prefix="terabox-bench-")
+    configure_environment(args, work_dir)
+    jobs = build_jobs(args)
+
+    cdn = FakeCDN(parse_size(args.cdn_bandwidth), args.cdn_latency / 1000)
+    resolver = FakeResolver(cdn, jobs, args.resolver_latency / 1000)
+    bot_api = FakeBotAPI(parse_size(args.upload_bandwidth), args.telegram_latency / 1000)
+    sink = FakeMTProtoClient(parse_size(args.upload_bandwidth), args.telegram_latency / 1000)
+    sink.cdn = cdn
+    await cdn.start()
+    await resolver.start()
+    await bot_api.start()
+    share_api = None
+    if args.resolver == "native":
+        from link_cache import extract_share_id
+        share_api = FakeTeraboxShare(cdn, {extract_share_id(job["url"]): job["files"] for job in jobs.values()}, latency=args.resolver_latency / 4000)
+        await share_api.start()
+        os.environ.update({"TERABOX_COOKIE": share_api.cookie, "TERABOX_API_BASE": share_api.base_url})
+
+    monitor = Monitor(os.environ["TEMP_DOWNLOADS_DIR"])
+    os.makedirs(monitor.directory, exist_ok=True)
+    monitor.start()
+    started = time.monotonic()
+    try:
+        if args.target == "apna":
+            durations, failures = await run_apna(args, jobs, resolver, bot_api)
+        else:
+            durations, failures = await run_terabox(args, jobs, sink)
+    finally:
+        elapsed = time.monotonic() - started
+        await monitor.stop()
+        await cdn.stop()
+        await resolver.stop()
+        await bot_api.stop()
+        if share_api:
+            await share_api.stop()
+
+    delivered_files = bot_api.files_received if args.target == "apna" else sink.files_received
+    delivered_bytes = bot_api.bytes_received if args.target == "apna" else sink.bytes_received
+    report = {
+        "target": args.target,
+        "jobs": args.jobs,
+        "concurrency": args.concurrency,
+        "completed": len(durations),
+        "failed": failures,
+        "elapsed_s": round(elapsed, 3),
+        "jobs_per_s": round(len(durations) / elapsed, 3) if elapsed else 0,
+        "files_delivered": delivered_files,
+        "mb_delivered_per_s": round(delivered_bytes / elapsed / 1024 / 1024, 2) if elapsed else 0,
+        "delivery_s": {
+            "p50": round(percentile(durations, 0.50), 3),
+            "p95": round(percentile(durations, 0.95), 3),
+            "p99": round(percentile(durations, 0.99), 3),
+            "mean": round(statistics.mean(durations), 3) if durations else 0
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(monitor.lags, 0.50) * 1000, 2),
+            "p99": round(percentile(monitor.lags, 0.99) * 1000, 2),
+            "max": round(max(monitor.lags, default=0) * 1000, 2)
+        },
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_disk_mb": round(monitor.peak_disk / 1024 / 1024, 1),
+        "cdn_mb_served": round(cdn.bytes_served / 1024 / 1024, 1),
+        "bot_api_calls": bot_api.calls if args.target == "apna" else {"edits": sink.edits, "copies": sink.copies},
+        "work_dir": work_dir
+    }
+    print(json.dumps(report, indent=2))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("apna", "terabox"), default="apna")
+    parser.add_argument("--jobs", type=int, default=20, help="Links to send")
+    parser.add_argument("--concurrency", type=int, default=5, help="Links in flight at once")
+    parser.add_argument("--users", type=int, default=5, help="Distinct users sending the links")
+    parser.add_argument("--sizes", default="20M:3,100M:1", help="File size mix, size:weight,...")
+    parser.add_argument("--shapes", default="1,2,3,4", help="Resolver JSON shapes to use")
+    parser.add_argument("--folder-files", type=int, default=1, help="Files per link for folder shapes (2 and 4)")
+    parser.add_argument("--extension", default="mp4")
+    parser.add_argument("--cdn-bandwidth", default="0", help="Per-connection CDN bandwidth, e.g. 20M (0 = unlimited)")
+    parser.add_argument("--cdn-latency", type=float, default=20, help="CDN time to first byte in ms")
+    parser.add_argument("--resolver", choices=("api", "native"), default="api", help="Third-party resolver APIs or the native share-API resolver")
+    parser.add_argument("--resolver-latency", type=float, default=300, help="Resolver API latency in ms (a quarter of it per share-API call)")
+    parser.add_argument("--upload-bandwidth", default="0", help="Telegram upload bandwidth per request, e.g. 50M")
+    parser.add_argument("--telegram-latency", type=float, default=50, help="Telegram API latency in ms")
+    parser.add_argument("--aria2", action="store_true", help="apna.py: download through a local aria2c instead of HTTPX")
+    parser.add_argument("--aria2-port", type=int, default=6800)
+    parser.add_argument("--no-aria2-tuner", action="store_true", help="Use the fixed global split options instead of the per-host tuner")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.basicConfig(level=arguments.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(main(arguments))
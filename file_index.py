@@ -0,0 +1,104 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FileIndex:
+    """
+    Durable map from a share ID and file key to an already uploaded Telegram
+    message, so repeat links can be served with copy_message instead of a new
+    download and upload.
+
+    The file key is the file name (plus a part suffix for split uploads); the
+    size is stored so callers can reject stale entries when a share changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " share_id TEXT NOT NULL,"
+            " file_key TEXT NOT NULL,"
+            " file_size INTEGER,"
+            " chat_id INTEGER NOT NULL,"
+            " message_id INTEGER NOT NULL,"
+            " file_id TEXT,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (share_id, file_key))"
+        )
+        self._conn.commit()
+        count = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        logger.info(f"File index {path} loaded with {count} entries")
+
+    def lookup(self, share_id: str, file_key: str, file_size: int = None):
+        """Returns the entry for one file, or None if unknown or the size changed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT share_id, file_key, file_size, chat_id, message_id, file_id FROM files"
+                " WHERE share_id = ? AND file_key = ?",
+                (share_id, file_key)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = self._row_to_entry(row)
+        if file_size and entry["file_size"] and entry["file_size"] != file_size:
+            return None
+        return entry
+
+    def lookup_share(self, share_id: str):
+        """Returns every entry recorded for a share, in upload order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT share_id, file_key, file_size, chat_id, message_id, file_id FROM files"
+                " WHERE share_id = ? ORDER BY rowid",
+                (share_id,)
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def record(self, share_id: str, file_key: str, file_size: int, chat_id: int, message_id: int, file_id: str = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (share_id, file_key, file_size, chat_id, message_id, file_id, time.time())
+            )
+            self._conn.commit()
+
+    def record_share(self, share_id: str, entries):
+        """
+        Replaces all entries of a share in one transaction. Used for split
+        uploads so a share is only indexed once every part made it.
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM files WHERE share_id = ?", (share_id,))
+                self._conn.executemany(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(share_id, e["file_key"], e.get("file_size"), e["chat_id"], e["message_id"], e.get("file_id"), now) for e in entries]
+                )
+
+    def forget(self, share_id: str, file_key: str = None):
+        with self._lock:
+            if file_key is None:
+                self._conn.execute("DELETE FROM files WHERE share_id = ?", (share_id,))
+            else:
+                self._conn.execute("DELETE FROM files WHERE share_id = ? AND file_key = ?", (share_id, file_key))
+            self._conn.commit()
+
+    @staticmethod
+    def _row_to_entry(row) -> dict:
+        return {
+            "share_id": row[0],
+            "file_key": row[1],
+            "file_size": row[2],
+            "chat_id": row[3],
+            "message_id": row[4],
+            "file_id": row[5],
+        }
@@ -0,0 +1,78 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import html
+import io
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class FileRange(io.RawIOBase):
+    """
+    Read-only view of `length` bytes of a file starting at `offset`. Reads go
+    straight to the original file with os.pread, so a part never needs its
+    own copy on disk.
+    """
+
+    def __init__(self, path: str, offset: int, length: int, name: str = None):
+        super().__init__()
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.name = name or path
+        self._fd = os.open(path, os.O_RDONLY)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, position: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            position += self._position
+        elif whence == io.SEEK_END:
+            position += self.length
+        self._position = max(0, min(position, self.length))
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self.length - self._position)
+        if size <= 0:
+            return 0
+        data = os.pread(self._fd, size, self.offset + self._position)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
+def plan_file_parts(file_size: int, part_size: int) -> list:
+    """Returns the (offset, length) of each fixed-size part of a file."""
+    return [(offset, min(part_size, file_size - offset)) for offset in range(0, file_size, part_size)]
+
+
+def file_part_name(file_name: str, number: int) -> str:
+    return f"{file_name}.{number:03d}"
+
+
+def build_part_manifest(file_name: str, file_size: int, part_names: list) -> str:
+    """HTML manifest that lists the parts of a split file and how to rejoin them."""
+    quoted_parts = [f'"{part_name}"' for part_name in part_names]
+    quoted_name = f'"{file_name}"'
+    return (
+        f"🧩 <b>{html.escape(file_name)}</b> was sent in {len(part_names)} parts ({file_size} bytes in total).\n\n"
+        + "\n".join(f"{number}. <code>{html.escape(part_name)}</code>" for number, part_name in enumerate(part_names, start=1))
+        + "\n\nDownload every part into one folder, then rejoin them:\n"
+        f"Linux/macOS: <code>cat {html.escape(' '.join(quoted_parts), quote=False)} &gt; {html.escape(quoted_name, quote=False)}</code>\n"
+        f"Windows: <code>copy /b {html.escape('+'.join(quoted_parts), quote=False)} {html.escape(quoted_name, quote=False)}</code>\n"
+        "7-Zip can also open the .001 part directly."
+    )
@@ -0,0 +1,123 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+JOB_FIELDS = [
+    "job_id", "chat_id", "user_id", "user_name", "url", "share_id", "target_chat_id",
+    "status_chat_id", "status_message_id", "title", "is_folder", "contents",
+    "file_index", "stage", "gid", "file_path", "lookahead_states", "created_at", "updated_at"
+]
+
+
+class JobJournal:
+    """
+    Durable record of every link job that has not finished yet, so the bot
+    can pick jobs up again after the process or aria2c restarts.
+
+    A job moves through the stages "resolving", "downloading" and "uploading"
+    for each item of `contents` in turn (`file_index` points at the current
+    one). `gid` and `file_path` describe that item's aria2 download and file on
+    disk. `lookahead_states` maps each later item that already started
+    downloading to its own stage, gid and file_path. Finished or failed jobs
+    are deleted.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " chat_id INTEGER NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " user_name TEXT,"
+            " url TEXT NOT NULL,"
+            " share_id TEXT,"
+            " target_chat_id INTEGER NOT NULL,"
+            " status_chat_id INTEGER,"
+            " status_message_id INTEGER,"
+            " title TEXT,"
+            " is_folder INTEGER NOT NULL DEFAULT 0,"
+            " contents TEXT,"
+            " file_index INTEGER NOT NULL DEFAULT 0,"
+            " stage TEXT NOT NULL,"
+            " gid TEXT,"
+            " file_path TEXT,"
+            " lookahead_states TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "lookahead_states" not in columns:  # Journals written before look-ahead items were recorded
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lookahead_states TEXT")
+        self._conn.commit()
+        count = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        logger.info(f"Job journal {path} loaded with {count} unfinished jobs")
+
+    def create(self, chat_id: int, user_id: int, user_name: str, url: str, share_id: str, target_chat_id: int, status_chat_id: int, status_message_id: int) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (chat_id, user_id, user_name, url, share_id, target_chat_id,"
+                " status_chat_id, status_message_id, stage, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'resolving', ?, ?)",
+                (chat_id, user_id, user_name, url, share_id, target_chat_id, status_chat_id, status_message_id, now, now)
+            )
+            self._conn.commit()
+        return cursor.lastrowid
+
+    def update(self, job_id: int, **fields):
+        """Updates the given columns; `contents` and `lookahead_states` are stored as JSON."""
+        if not fields:
+            return
+        unknown = set(fields) - set(JOB_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown job journal fields: {', '.join(sorted(unknown))}")
+        if "contents" in fields:
+            fields["contents"] = json.dumps(fields["contents"])
+        if "lookahead_states" in fields:
+            fields["lookahead_states"] = json.dumps(fields["lookahead_states"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id))
+            self._conn.commit()
+
+    def finish(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._conn.commit()
+
+    def get(self, job_id: int):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def pending(self) -> list:
+        """Returns every unfinished job, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs ORDER BY job_id").fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def file_paths(self) -> list:
+        """Every file an unfinished job still owns: its current item's and those of its look-ahead items."""
+        paths = []
+        for job in self.pending():
+            paths.append(job["file_path"])
+            paths.extend(state.get("file_path") for state in job["lookahead_states"].values())
+        return [path for path in paths if path]
+
+    @staticmethod
+    def _row_to_job(row) -> dict:
+        job = dict(zip(JOB_FIELDS, row))
+        job["is_folder"] = bool(job["is_folder"])
+        job["contents"] = json.loads(job["contents"]) if job["contents"] else None
+        job["lookahead_states"] = {int(i): state for i, state in json.loads(job["lookahead_states"]).items()} if job["lookahead_states"] else {}
+        return job
@@ -0,0 +1,207 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when a job is refused because the pipeline already holds max_queued jobs."""
+    pass
+
+
+class FairSemaphore:
+    """
+    Concurrency cap whose waiters are served round-robin across users.
+
+    Each user has their own FIFO of waiters, and a freed slot goes to the head
+    of the next user in rotation, so one user with many jobs cannot starve the
+    others. Priority waiters (admins) have a separate lane that is always
+    served first.
+    """
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self._lanes = (OrderedDict(), OrderedDict())  # (priority, normal): user_id -> deque of futures
+
+    def waiting(self) -> int:
+        return sum(len(waiters) for lane in self._lanes for waiters in lane.values())
+
+    def position(self, user_id, priority: bool = False) -> int:
+        """
+        Estimated place in line for a new waiter from `user_id` (0 means it
+        would start immediately), following the round-robin order.
+        """
+        if self.active < self.limit and not self.waiting():
+            return 0
+        priority_lane, normal_lane = self._lanes
+        lane = priority_lane if priority else normal_lane
+        own = len(lane.get(user_id, ()))
+        ahead = own + sum(min(len(waiters), own + 1) for uid, waiters in lane.items() if uid != user_id)
+        if not priority:
+            ahead += sum(len(waiters) for waiters in priority_lane.values())
+        return ahead + 1
+
+    @asynccontextmanager
+    async def slot(self, user_id, priority: bool = False):
+        await self.acquire(user_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id, priority: bool = False):
+        if self.active < self.limit and not self.waiting():
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes[0] if priority else self._lanes[1]
+        lane.setdefault(user_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # Granted just before the cancel landed
+            else:
+                waiters = lane.get(user_id)
+                if waiters and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del lane[user_id]
+            raise
+
+    def release(self):
+        self.active -= 1
+        while self.active < self.limit:
+            future = self._next_waiter()
+            if future is None:
+                return
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def _next_waiter(self):
+        for lane in self._lanes:
+            if lane:
+                user_id, waiters = next(iter(lane.items()))
+                future = waiters.popleft()
+                if waiters:
+                    lane.move_to_end(user_id)
+                else:
+                    del lane[user_id]
+                return future
+        return None
+
+
+class JobScheduler:
+    """
+    Front door of the download pipeline.
+
+    `admit()` lets a link in (raising QueueFull once `max_queued` jobs are in
+    the pipeline) and `stage()` takes a slot in one of the capped stages, e.g.
+    resolve, download and upload, each with its own concurrency limit.
+    """
+
+    def __init__(self, stage_limits: dict, max_queued: int = 50):
+        self.stages = {name: FairSemaphore(name, limit) for name, limit in stage_limits.items()}
+        self.max_queued = max_queued
+        self.jobs = 0
+
+    def admit(self, force: bool = False):
+        """
+        Counts a new job into the pipeline; every admitted job must call
+        finish(). `force` skips the depth check, e.g. for jobs resumed after a
+        restart.
+        """
+        if self.jobs >= self.max_queued and not force:
+            raise QueueFull(f"Job queue is full ({self.jobs}/{self.max_queued})")
+        self.jobs += 1
+
+    def finish(self):
+        self.jobs -= 1
+
+    def stage(self, name: str, user_id, priority: bool = False):
+        return self.stages[name].slot(user_id, priority)
+
+    def position(self, name: str, user_id, priority: bool = False) -> int:
+        return self.stages[name].position(user_id, priority)
+
+    def stats(self) -> dict:
+        stats = {"jobs": self.jobs, "max_queued": self.max_queued}
+        for name, stage in self.stages.items():
+            stats[name] = {"active": stage.active, "limit": stage.limit, "waiting": stage.waiting()}
+        return stats
+
+
+class OrderedPipeline:
+    """
+    Look-ahead state for the items of one folder job.
+
+    Items run concurrently but take their `turn()` strictly in index order, so
+    uploads and chat messages keep the folder order while later items are
+    already downloading. `window()` bounds how far ahead of the current turn
+    an item may start, and bytes that are downloaded but still waiting for
+    their turn are `hold()`-ed: look-ahead downloads only start while fewer
+    than `max_bytes` (0 for no cap) are held.
+
+    Disk space is `reserve()`-d in index order too. An item ahead of the
+    current turn only takes space that is free right now; otherwise it waits
+    for its turn before waiting on the storage, so it never holds space the
+    current item needs to finish.
+    """
+
+    def __init__(self, first: int, lookahead: int = 1, max_bytes: int = 0):
+        self.next_turn = first
+        self.lookahead = lookahead
+        self.max_bytes = max_bytes
+        self.held_bytes = 0
+        self._held = {}  # index -> bytes on disk
+        self._finished = set()
+        self._reserved = set()
+        self._changed = asyncio.Condition()
+
+    async def window(self, index: int):
+        """Waits until `index` is at most `lookahead` items past the current turn."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: index <= self.next_turn + self.lookahead)
+
+    async def download_slot(self, index: int):
+        """Waits until item `index` may start downloading; the current turn never waits."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: index == self.next_turn or not self.max_bytes or self.held_bytes < self.max_bytes)
+
+    async def reserve(self, index: int, storage, size: int):
+        """Reserves `size` bytes of `storage` (a StorageManager) for item `index` once every earlier item has its space."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: all(i in self._reserved or i in self._finished for i in range(self.next_turn, index)))
+        reservation = storage.try_reserve(size) if index != self.next_turn else None
+        if reservation is None:
+            await self.turn(index)
+            reservation = await storage.reserve(size)
+        async with self._changed:
+            self._reserved.add(index)
+            self._changed.notify_all()
+        return reservation
+
+    def hold(self, index: int, size: int):
+        self.held_bytes += size - self._held.get(index, 0)
+        self._held[index] = size
+
+    async def turn(self, index: int):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.next_turn == index)
+
+    async def done(self, index: int):
+        """Marks item `index` delivered (or failed) and releases its held bytes."""
+        async with self._changed:
+            self._finished.add(index)
+            self.held_bytes -= self._held.pop(index, 0)
+            while self.next_turn in self._finished:
+                self._finished.discard(self.next_turn)
+                self._reserved.discard(self.next_turn)
+                self.next_turn += 1
+            self._changed.notify_all()
@@ -0,0 +1,90 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import html
+import logging
+import re
+
+from link_cache import extract_share_id
+
+logger = logging.getLogger(__name__)
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+BOX_CHARS = "┏┠┖"
+MAX_MESSAGE_CHARS = 4000  # Telegram caps messages at 4096 characters
+
+
+def dedupe_links(urls) -> list:
+    """Drops links that point at a share already in `urls` (any mirror domain), keeping the first one's position."""
+    seen = set()
+    unique = []
+    for url in urls:
+        key = extract_share_id(url) or url
+        if key not in seen:
+            seen.add(key)
+            unique.append(url)
+    return unique
+
+
+def summarize_status(text: str, max_chars: int = 160) -> str:
+    """Turns a multi-line status text into one plain line, e.g. 'name.mp4 · [★★☆…] 20.00% · ...'."""
+    plain = html.unescape(TAG_PATTERN.sub("", text.replace("<br>", "\n")))
+    parts = [line.strip(BOX_CHARS + " ") for line in plain.splitlines()]
+    line = " · ".join(part for part in parts if part)
+    return line if len(line) <= max_chars else line[:max_chars - 1] + "…"
+
+
+class LinkBatchItem:
+    """
+    Status message view for one link of a batch. Reads through to the batch's
+    shared message, so code that only needs its chat and message IDs works
+    unchanged; status texts go to `batch.update()` instead of an edit.
+    """
+
+    def __init__(self, batch, index: int):
+        self.batch = batch
+        self.index = index
+
+    def __getattr__(self, name):
+        return getattr(self.batch.message, name)
+
+
+class LinkBatch:
+    """
+    Combined status of the links taken from one message or link list. Each
+    link keeps its latest status text; `render()` folds them into a single
+    message with one line per link under a progress header, so a batch of
+    dozens of links costs one status message and its edits.
+    """
+
+    def __init__(self, urls: list, notes: list = None):
+        self.urls = urls
+        self.notes = list(notes or [])
+        self.message = None  # Shared status message, set once it is sent
+        self._texts = [None] * len(urls)
+        self._finished = set()
+
+    def item(self, index: int) -> LinkBatchItem:
+        return LinkBatchItem(self, index)
+
+    def update(self, index: int, text: str):
+        self._texts[index] = text
+
+    def finish(self, index: int, text: str = None):
+        if text is not None:
+            self._texts[index] = text
+        self._finished.add(index)
+
+    def render(self) -> str:
+        """HTML text of the shared message, trimmed to fit in one Telegram message."""
+        header = f"📦 <b>Batch of {len(self.urls)} link(s)</b>: {len(self._finished)} finished, {len(self.urls) - len(self._finished)} in progress"
+        lines = [header] + [html.escape(note) for note in self.notes] + [""]
+        length = sum(len(line) + 1 for line in lines)
+        for index, url in enumerate(self.urls):
+            text = self._texts[index]
+            mark = "✔️" if index in self._finished else "▫️"
+            line = f"{mark} {index + 1}. {html.escape(summarize_status(text) if text else url[:60])}"
+            if length + len(line) + 40 > MAX_MESSAGE_CHARS:
+                lines.append(f"… and {len(self.urls) - index} more")
+                break
+            lines.append(line)
+            length += len(line) + 1
+        return "\n".join(lines)
@@ -0,0 +1,140 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+SHARE_PATH_PATTERN = re.compile(r"/s/([\w-]+)")
+
+
+def extract_share_id(url: str):
+    """
+    Returns the normalized share token ("surl") for a Terabox link, or None.
+
+    /s/1AbCd and ?surl=AbCd point at the same share: the /s/ form carries an
+    extra leading "1", so it is dropped. The host is ignored, which makes all
+    mirror domains map to the same key.
+    """
+    parsed_url = urlparse(url)
+    surl = parse_qs(parsed_url.query).get("surl")
+    if surl and surl[0]:
+        return surl[0]
+    match = SHARE_PATH_PATTERN.search(parsed_url.path)
+    if match:
+        token = match.group(1)
+        return token[1:] if token.startswith("1") and len(token) > 1 else token
+    return None
+
+
+class LinkCache:
+    """
+    Size-bounded LRU cache of resolved share links with per-entry expiry.
+
+    Positive entries hold the details dict returned by fetch_terabox_links and
+    live for `ttl` seconds. Negative entries remember a resolution error for
+    `negative_ttl` seconds so dead links are not resolved again on every paste.
+    If `path` is given the cache is loaded from and written back to that JSON
+    file, so entries survive a restart.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 7200, negative_ttl: float = 60, path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value, error)
+        self._lock = threading.Lock()
+        if self.path:
+            self._load()
+
+    def get(self, key: str):
+        """
+        Returns (value, error) for a live entry, or None on a miss. For negative
+        entries value is None and error is the cached error message.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry[2] is not None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, key: str, value):
+        self._store(key, (time.time() + self.ttl, value, None))
+
+    def put_negative(self, key: str, error: str):
+        self._store(key, (time.time() + self.negative_ttl, None, error))
+
+    def invalidate(self, key: str):
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+        if removed:
+            self._save()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+    def _store(self, key: str, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        self._save()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw_entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Could not load link cache from {self.path}: {e}")
+            return
+        now = time.time()
+        for key, (expires_at, value, error) in raw_entries:
+            if expires_at > now:
+                self._entries[key] = (expires_at, value, error)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        logger.info(f"Loaded {len(self._entries)} link cache entries from {self.path}")
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = [[key, list(entry)] for key, entry in self._entries.items()]
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not write link cache to {self.path}: {e}")
@@ -0,0 +1,89 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import logging
+import re
+import time
+
+import httpx
+
+from metrics import observe_link_refresh
+
+logger = logging.getLogger(__name__)
+
+EXPIRED_STATUSES = (403, 410)  # What Terabox's CDN answers once a direct link's signature has run out
+ARIA2_STATUS_PATTERN = re.compile(r"status=(\d{3})")
+ARIA2_RESOURCE_NOT_FOUND = "3"
+
+
+def is_expiry_error(error_code, error_message: str) -> bool:
+    """True when aria2 gave up on a download because the CDN stopped accepting its link."""
+    if str(error_code) == ARIA2_RESOURCE_NOT_FOUND:
+        return True
+    match = ARIA2_STATUS_PATTERN.search(error_message or "")
+    return match is not None and int(match.group(1)) in EXPIRED_STATUSES
+
+
+async def link_expired(url: str, timeout: float = 15) -> bool:
+    """Asks for the first byte of `url`; True only when the CDN refuses it with 403 or 410."""
+    try:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=timeout) as client:
+            async with client.stream("GET", url, headers={"Range": "bytes=0-0"}) as response:
+                status_code = response.status_code
+    except httpx.HTTPError as e:
+        logger.debug(f"Expiry probe of {url[:80]} failed: {e}")
+        return False  # Unreachable is not the same as expired; aria2's own retries handle that
+    return status_code in EXPIRED_STATUSES
+
+
+def match_refreshed_file(old_contents: list, new_contents: list, index: int):
+    """
+    Finds item `index` of `old_contents` in a fresh resolution of the same
+    share: by file name, or by position when the share still lists the same
+    number of files. Returns the new entry or None.
+    """
+    filename = (old_contents[index].get("filename") or "").lower()
+    for entry in new_contents:
+        if filename and (entry.get("filename") or "").lower() == filename:
+            return entry
+    if len(new_contents) == len(old_contents):
+        return new_contents[index]
+    return None
+
+
+class LinkExpiryWatch:
+    """
+    Spots an aria2 download that stopped making progress, so the caller can
+    check whether its direct link expired instead of letting aria2 spend its
+    retries on a link that will never work again.
+
+    Feed it every status snapshot of one download; `stalled()` turns True
+    once the completed length has not moved for `stall_seconds` while the
+    download is active, then starts counting again.
+    """
+
+    def __init__(self, stall_seconds: float = 30, max_refreshes: int = 3):
+        self.stall_seconds = stall_seconds
+        self.max_refreshes = max_refreshes
+        self.refreshes = 0
+        self._completed = None
+        self._since = time.monotonic()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.refreshes >= self.max_refreshes
+
+    def stalled(self, download) -> bool:
+        now = time.monotonic()
+        if download.status != "active" or download.completed_length != self._completed:
+            self._completed = download.completed_length
+            self._since = now
+            return False
+        if now - self._since < self.stall_seconds:
+            return False
+        self._since = now
+        return True
+
+    def refreshed(self, outcome: str):
+        """Counts one re-resolution; `outcome` is "swapped", "readded" or "failed"."""
+        self.refreshes += 1
+        self._completed = None
+        observe_link_refresh(outcome)
@@ -0,0 +1,106 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MembershipCache:
+    """
+    Remembers whether users are members of the force-subscribe channel, so
+    the membership check no longer costs a get_chat_member round-trip on
+    every message.
+
+    A "member" answer is kept for `ttl` seconds and a "not a member" answer
+    only for `negative_ttl`, so a user who has just joined is let in on
+    their next try even if no chat_member update reaches the bot. Lookups
+    for a user that is already being fetched wait for that call instead of
+    making their own. Errors raised by `fetch` reach every waiting caller
+    and are never cached. `store()` and `invalidate()` are called from the
+    channel's chat_member updates; a fetch that was running when one of
+    them arrived does not overwrite the newer state.
+    """
+
+    def __init__(self, ttl: float = 600, negative_ttl: float = 30, max_entries: int = 50000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()  # user_id -> (is_member, monotonic expiry)
+        self._inflight = {}  # user_id -> Future of the running fetch
+        self._superseded = set()  # users whose running fetch was overtaken by a store/invalidate/clear
+
+    async def check(self, user_id: int, fetch) -> bool:
+        """Returns the cached membership of `user_id`, or awaits `fetch()` (a coroutine function returning a bool)."""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(user_id)
+                return entry[0]
+            del self._entries[user_id]
+
+        inflight = self._inflight.get(user_id)
+        if inflight is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                return await self.check(user_id, fetch)  # The fetching caller was cancelled, not us
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            is_member = bool(await fetch())
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved here so lone callers do not log "exception never retrieved"
+            raise
+        else:
+            future.set_result(is_member)
+            if user_id not in self._superseded:
+                self._put(user_id, is_member)
+            return is_member
+        finally:
+            self._inflight.pop(user_id, None)
+            self._superseded.discard(user_id)
+
+    def store(self, user_id: int, is_member: bool):
+        """Records membership reported by a chat_member update."""
+        if user_id in self._inflight:
+            self._superseded.add(user_id)
+        self._put(user_id, is_member)
+
+    def invalidate(self, user_id: int):
+        if user_id in self._inflight:
+            self._superseded.add(user_id)
+        self._entries.pop(user_id, None)
+
+    def clear(self):
+        """Forgets everything, e.g. after the force-subscribe channel was changed."""
+        self._superseded.update(self._inflight)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced
+        }
+
+    def _put(self, user_id: int, is_member: bool):
+        self._entries[user_id] = (is_member, time.monotonic() + (self.ttl if is_member else self.negative_ttl))
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
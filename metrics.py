@@ -0,0 +1,116 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import logging
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+STAGE_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+RESOLVER_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30)
+THROUGHPUT_BUCKETS = tuple(mib * 1024 * 1024 for mib in (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+
+stage_duration = Histogram(
+    "terabox_stage_duration_seconds",
+    "Time spent in each pipeline stage (resolve, aria2_queue_wait, download, split, upload)",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+transfer_bytes = Counter("terabox_transfer_bytes_total", "Bytes downloaded (in) and uploaded to Telegram (out)", ["direction"])
+resolver_requests = Counter("terabox_resolver_requests_total", "Resolver API calls by outcome", ["api", "outcome"])
+resolver_latency = Histogram("terabox_resolver_latency_seconds", "Resolver API call latency", ["api"], buckets=RESOLVER_BUCKETS)
+flood_waits = Counter("terabox_flood_waits_total", "Flood waits imposed by Telegram", ["source"])
+flood_wait_seconds = Counter("terabox_flood_wait_seconds_total", "Seconds of flood wait imposed by Telegram", ["source"])
+aria2_tuning_choices = Counter("terabox_aria2_tuning_choices_total", "aria2 connection counts chosen per download", ["size_bucket", "connections", "reason"])
+aria2_throughput = Histogram(
+    "terabox_aria2_throughput_bytes_per_second",
+    "Throughput of finished aria2 downloads by size bucket and connection count",
+    ["size_bucket", "connections"],
+    buckets=THROUGHPUT_BUCKETS
+)
+link_refreshes = Counter("terabox_link_refreshes_total", "Direct links resolved again after they expired mid-download", ["outcome"])
+
+
+def observe_resolver(api: str, seconds: float, ok: bool):
+    resolver_requests.labels(api, "success" if ok else "failure").inc()
+    resolver_latency.labels(api).observe(seconds)
+
+
+def observe_aria2_download(queued_at: float, started_at, finished_at: float):
+    """Splits an aria2 download's time into its wait in aria2's queue and the transfer itself."""
+    if started_at is not None and started_at >= queued_at:
+        stage_duration.labels("aria2_queue_wait").observe(started_at - queued_at)
+        queued_at = started_at
+    stage_duration.labels("download").observe(finished_at - queued_at)
+
+
+def observe_flood_wait(source: str, seconds: float):
+    flood_waits.labels(source).inc()
+    flood_wait_seconds.labels(source).inc(seconds)
+
+
+def observe_aria2_tuning(size_bucket: str, connections: int, reason: str):
+    aria2_tuning_choices.labels(size_bucket, str(connections), reason).inc()
+
+
+def observe_aria2_throughput(size_bucket: str, connections: int, bytes_per_second: float):
+    aria2_throughput.labels(size_bucket, str(connections)).observe(bytes_per_second)
+
+
+def observe_link_refresh(outcome: str):
+    link_refreshes.labels(outcome).inc()
+
+
+class PipelineCollector:
+    """
+    Reports job scheduler and download directory gauges when scraped, so the
+    numbers come straight from the live objects instead of being mirrored
+    into gauges on every change. Scrapes run on the web server's thread;
+    state that changes mid-read is skipped for that scrape.
+    """
+
+    def __init__(self, job_scheduler, storage):
+        self.job_scheduler = job_scheduler
+        self.storage = storage
+
+    def collect(self):
+        jobs = GaugeMetricFamily("terabox_jobs", "Jobs admitted into the pipeline")
+        jobs.add_metric([], self.job_scheduler.jobs)
+        yield jobs
+
+        active = GaugeMetricFamily("terabox_stage_active", "Jobs holding a slot in each stage", labels=["stage"])
+        queued = GaugeMetricFamily("terabox_stage_queued", "Jobs waiting for a slot in each stage", labels=["stage"])
+        for name, stage in list(self.job_scheduler.stages.items()):
+            active.add_metric([name], stage.active)
+            try:
+                queued.add_metric([name], stage.waiting())
+            except RuntimeError as e:  # A lane changed while the scrape was reading it
+                logger.debug(f"Skipped queue depth of stage {name}: {e}")
+        yield active
+        yield queued
+
+        disk = GaugeMetricFamily("terabox_temp_disk_bytes", "Download directory usage", labels=["kind"])
+        try:
+            stats = self.storage.stats()
+            disk.add_metric(["used"], self.storage.used_bytes())
+            disk.add_metric(["reserved"], stats["reserved"])
+            disk.add_metric(["quota"], stats["quota"])
+            disk.add_metric(["free"], stats["free"])
+        except OSError as e:
+            logger.warning(f"Could not read download directory usage: {e}")
+        yield disk
+
+
+def register_pipeline(job_scheduler, storage):
+    REGISTRY.register(PipelineCollector(job_scheduler, storage))
+
+
+def render():
+    """Returns the exposition body and its content type, for serving /metrics from an existing web app."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int, addr: str = "0.0.0.0"):
+    """Serves /metrics from a background thread; for processes without a web server of their own."""
+    start_http_server(port, addr=addr)
+    logger.info(f"Prometheus metrics served on {addr}:{port}/metrics")
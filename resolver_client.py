@@ -0,0 +1,282 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import socket
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+from urllib.request import getproxies
+
+import httpcore
+import httpx
+
+try:
+    import h2  # noqa: F401  # httpx speaks HTTP/2 only when h2 is installed
+except ImportError:
+    h2 = None
+
+logger = logging.getLogger(__name__)
+
+HTTPCORE_EXCEPTIONS = [  # What httpx's own transport raises for each httpcore error; subclasses come first
+    (httpcore.ConnectTimeout, httpx.ConnectTimeout),
+    (httpcore.ReadTimeout, httpx.ReadTimeout),
+    (httpcore.WriteTimeout, httpx.WriteTimeout),
+    (httpcore.PoolTimeout, httpx.PoolTimeout),
+    (httpcore.TimeoutException, httpx.TimeoutException),
+    (httpcore.ConnectError, httpx.ConnectError),
+    (httpcore.ReadError, httpx.ReadError),
+    (httpcore.WriteError, httpx.WriteError),
+    (httpcore.NetworkError, httpx.NetworkError),
+    (httpcore.ProxyError, httpx.ProxyError),
+    (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+    (httpcore.LocalProtocolError, httpx.LocalProtocolError),
+    (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+    (httpcore.ProtocolError, httpx.ProtocolError)
+]
+
+
+class DNSCache:
+    """
+    Bounded cache of getaddrinfo answers. Each host is kept for `ttl`
+    seconds and the least recently used one is dropped beyond
+    `max_entries`. Concurrent lookups of one host share a single query.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (host, port) -> (addresses, monotonic expiry)
+        self._inflight = {}  # (host, port) -> Future of the running lookup
+
+    async def resolve(self, host: str, port: int) -> list:
+        """Returns the addresses of `host`, IPv4 first; raises OSError when it does not resolve."""
+        key = (host, port)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            del self._entries[key]
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        self.misses += 1
+        lookup = asyncio.ensure_future(self._lookup(host, port))
+        self._inflight[key] = lookup
+        try:
+            return await asyncio.shield(lookup)
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _lookup(self, host: str, port: int) -> list:
+        key = (host, port)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = []
+        for *_, sockaddr in sorted(infos, key=lambda info: info[0] != socket.AF_INET):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        self._entries[key] = (addresses, time.monotonic() + self.ttl)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return addresses
+
+    def forget(self, host: str, port: int):
+        self._entries.pop((host, port), None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class CachingNetworkBackend:
+    """
+    Wraps an httpcore network backend so new connections take their address
+    from a DNSCache, trying each address in turn. TLS still verifies and
+    sends SNI for the host name, as httpcore passes that separately.
+    """
+
+    def __init__(self, backend, dns_cache: DNSCache):
+        self.backend = backend
+        self.dns_cache = dns_cache
+        self.connects = 0
+
+    async def connect_tcp(self, host: str, port: int, timeout=None, local_address=None, socket_options=None):
+        self.connects += 1
+        try:
+            addresses = await self.dns_cache.resolve(host, port)
+        except OSError as e:
+            logger.debug(f"DNS lookup of {host} failed ({e}); letting the connection report it")
+            addresses = [host]
+        last_error = None
+        for address in addresses:
+            try:
+                return await self.backend.connect_tcp(address, port, timeout=timeout, local_address=local_address, socket_options=socket_options)
+            except Exception as e:
+                last_error = e
+        self.dns_cache.forget(host, port)  # Every cached address failed; look the host up again next time
+        raise last_error
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+def _as_httpx_error(error: Exception) -> Exception:
+    """The httpx exception for an httpcore one, so callers only deal with httpx.HTTPError."""
+    for httpcore_cls, httpx_cls in HTTPCORE_EXCEPTIONS:
+        if isinstance(error, httpcore_cls):
+            return httpx_cls(str(error))
+    return error
+
+
+class PooledResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        except Exception as e:
+            raise _as_httpx_error(e) from e
+
+    async def aclose(self):
+        if hasattr(self.stream, "aclose"):
+            await self.stream.aclose()
+
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport over an httpcore.AsyncConnectionPool built here, so the
+    pool's network backend is chosen through httpcore's public arguments
+    instead of being swapped into httpx's own transport.
+    """
+
+    def __init__(self, pool: httpcore.AsyncConnectionPool):
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host, port=request.url.port, target=request.url.raw_path),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions
+        )
+        try:
+            response = await self.pool.handle_async_request(core_request)
+        except Exception as e:
+            raise _as_httpx_error(e) from e
+        return httpx.Response(status_code=response.status, headers=response.headers, stream=PooledResponseStream(response.stream), extensions=response.extensions)
+
+    async def aclose(self):
+        await self.pool.aclose()
+
+
+class ResolverClient:
+    """
+    One long-lived httpx.AsyncClient for resolver API traffic, shared by
+    every job.
+
+    Resolutions reuse pooled keep-alive connections, so the TCP and TLS
+    handshakes with the same few API hosts are paid once, not per attempt.
+    HTTP/2 is used when the h2 package is installed and the host offers it.
+    New connections get their addresses from a bounded DNSCache. `warm()`
+    opens connections to the API hosts at startup. `stats()` reports how
+    often a connection was reused. The client is created lazily inside the
+    running loop.
+
+    When HTTP_PROXY, HTTPS_PROXY or ALL_PROXY is set, the proxy resolves the
+    host names, so the client is a plain httpx one that applies the proxy
+    settings (NO_PROXY included) itself, without the DNSCache.
+    """
+
+    def __init__(self, headers: dict = None, timeout: float = 30, http2: bool = True, max_connections: int = 50,
+                 max_keepalive_connections: int = 20, keepalive_expiry: float = 120, dns_ttl: float = 300, dns_max_entries: int = 256):
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.http2 = http2 and h2 is not None
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.dns_cache = DNSCache(dns_ttl, dns_max_entries)
+        self.requests = 0
+        self._client = None
+        self._pool = None
+        self._backend = None
+        self._closing = set()  # aclose() tasks of pools a closed client left behind
+        if http2 and h2 is None:
+            logger.warning("h2 library is not installed. Resolver requests will use HTTP/1.1. pip install h2")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            if self._pool is not None and self._pool.connections:
+                closing = asyncio.get_running_loop().create_task(self._pool.aclose())
+                self._closing.add(closing)
+                closing.add_done_callback(self._closing.discard)
+            self._pool = self._backend = None
+            transport = None
+            if not any(getproxies().get(scheme) for scheme in ("http", "https", "all")):
+                self._backend = CachingNetworkBackend(httpcore.AnyIOBackend(), self.dns_cache)
+                self._pool = httpcore.AsyncConnectionPool(
+                    ssl_context=httpx.create_ssl_context(),
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                    http2=self.http2,
+                    network_backend=self._backend
+                )
+                transport = PooledTransport(self._pool)
+            else:
+                logger.info("A proxy is configured; resolver requests go through it without the DNS cache")
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                http2=self.http2,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_keepalive_connections, keepalive_expiry=self.keepalive_expiry),
+                transport=transport,
+                event_hooks={"request": [self._count_request]}
+            )
+        return self._client
+
+    async def _count_request(self, request: httpx.Request):
+        self.requests += 1
+
+    async def warm(self, urls: list, timeout: float = 10):
+        """Opens a connection to the host of every URL in `urls`: DNS, TCP and TLS before the first user needs them."""
+        origins = list(dict.fromkeys(f"{urlparse(url).scheme}://{urlparse(url).netloc}/" for url in urls))
+
+        async def open_connection(origin):
+            try:
+                await self.client.head(origin, timeout=timeout)
+                return True
+            except httpx.HTTPError as e:
+                logger.debug(f"Could not pre-warm {origin}: {e}")
+                return False
+
+        warmed = await asyncio.gather(*(open_connection(origin) for origin in origins))
+        logger.info(f"Pre-warmed connections to {sum(warmed)} of {len(origins)} resolver host(s)")
+
+    def stats(self) -> dict:
+        """Request count, connections opened for them, and what the pool holds right now."""
+        connections = list(self._pool.connections) if self._client is not None and self._pool is not None else []
+        opened = self._backend.connects if self._backend else 0
+        return {
+            "http2": self.http2,
+            "requests": self.requests,
+            "connections_opened": opened,
+            "reuse_rate": max(1 - opened / self.requests, 0.0) if self._backend and self.requests else 0.0,
+            "open": len(connections),
+            "idle": sum(1 for connection in connections if connection.is_idle()),
+            "open_http2": sum(1 for connection in connections if "HTTP/2" in connection.info()),
+            "dns": self.dns_cache.stats()
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()  # Closes the pool through PooledTransport.aclose()
+            self._client = None
+        if self._closing:
+            await asyncio.gather(*self._closing)
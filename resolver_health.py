@@ -0,0 +1,200 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+OUTCOMES = ("success", "failure", "bad_json")
+
+
+class EndpointHealth:
+    """Sliding window of recent outcomes, latency EWMA and circuit state of one resolver endpoint."""
+
+    def __init__(self, window: int, prior_latency: float):
+        self.results = deque(maxlen=window)  # outcome per call, newest last
+        self.latency = prior_latency
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # Wall-clock time the breaker may be retried; 0 = closed
+        self.open_seconds = 0.0  # Current back-off, doubled by every failed retry
+
+    @property
+    def success_rate(self) -> float:
+        if not self.results:
+            return 1.0
+        return self.results.count("success") / len(self.results)
+
+    @property
+    def bad_json_rate(self) -> float:
+        if not self.results:
+            return 0.0
+        return self.results.count("bad_json") / len(self.results)
+
+    def state(self, now: float) -> str:
+        if not self.open_until:
+            return "closed"
+        return "open" if now < self.open_until else "half_open"
+
+    def expected_latency(self) -> float:
+        """Expected seconds to a usable answer: the latency EWMA spread over the success rate."""
+        return self.latency / max(self.success_rate, 0.05)
+
+
+class ResolverHealth:
+    """
+    Health scores and circuit breakers for the resolver APIs.
+
+    Every call is recorded as "success", "failure" or "bad_json" (a 200 with
+    a JSON structure we cannot parse) with its latency. `rank()` orders the
+    endpoints by expected latency, so a slow or failing API stops sitting in
+    front of the healthy ones. After `failure_threshold` failures in a row an
+    endpoint's breaker opens and it is skipped for `open_seconds` (doubling
+    up to `max_open_seconds` while it keeps failing). Once that time is up
+    it is half-open: `due_probes()` lists it for a background probe, and
+    live requests try it last, until one call succeeds and closes it again.
+    If `path` is given, scores are kept in that JSON file across restarts.
+    """
+
+    def __init__(self, window: int = 20, alpha: float = 0.3, prior_latency: float = 2.0, failure_threshold: int = 3,
+                 open_seconds: float = 60, max_open_seconds: float = 1800, path: str = None, save_interval: float = 30):
+        self.window = window
+        self.alpha = alpha
+        self.prior_latency = prior_latency
+        self.failure_threshold = failure_threshold
+        self.base_open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.path = path
+        self.save_interval = save_interval
+        self._endpoints = {}  # name -> EndpointHealth
+        self._probing = set()
+        self._saved_at = 0.0
+        self._lock = threading.Lock()
+        if self.path:
+            self._load()
+
+    def _health(self, name: str) -> EndpointHealth:
+        health = self._endpoints.get(name)
+        if health is None:
+            health = self._endpoints[name] = EndpointHealth(self.window, self.prior_latency)
+        return health
+
+    def record(self, name: str, latency: float, outcome: str):
+        now = time.time()
+        with self._lock:
+            health = self._health(name)
+            health.results.append(outcome)
+            health.latency = latency if not health.samples else self.alpha * latency + (1 - self.alpha) * health.latency
+            health.samples += 1
+            changed = False
+            if outcome == "success":
+                health.consecutive_failures = 0
+                if health.open_until:
+                    logger.info(f"Resolver {name} answered again; closing its circuit breaker")
+                    health.open_until = 0.0
+                    health.open_seconds = 0.0
+                    changed = True
+            else:
+                health.consecutive_failures += 1
+                half_open = health.state(now) == "half_open"
+                if half_open or (not health.open_until and health.consecutive_failures >= self.failure_threshold):
+                    health.open_seconds = min(health.open_seconds * 2 or self.base_open_seconds, self.max_open_seconds)
+                    health.open_until = now + health.open_seconds
+                    logger.warning(f"Resolver {name} failed {health.consecutive_failures} time(s) in a row; skipping it for {health.open_seconds:.0f}s")
+                    changed = True
+        if changed or now - self._saved_at >= self.save_interval:
+            self.save()
+
+    def rank(self, endpoints: list) -> list:
+        """
+        Returns `endpoints` (dicts with a "name") in the order to try them:
+        closed breakers by expected latency, then half-open ones. Open
+        endpoints are left out, unless every endpoint is open.
+        """
+        now = time.time()
+        with self._lock:
+            keyed = [(endpoint, self._health(endpoint["name"])) for endpoint in endpoints]
+            closed = [(endpoint, health) for endpoint, health in keyed if health.state(now) == "closed"]
+            half_open = [(endpoint, health) for endpoint, health in keyed if health.state(now) == "half_open"]
+            ranked = sorted(closed, key=lambda item: item[1].expected_latency()) + sorted(half_open, key=lambda item: item[1].open_until)
+            if not ranked:
+                ranked = sorted(keyed, key=lambda item: item[1].open_until)
+        return [endpoint for endpoint, _ in ranked]
+
+    def is_open(self, name: str) -> bool:
+        """True while `name`'s breaker is open and its retry time has not come yet."""
+        with self._lock:
+            return self._health(name).state(time.time()) == "open"
+
+    def due_probes(self, endpoints: list) -> list:
+        """Half-open endpoints among `endpoints` that no probe is running for yet; marks them as being probed."""
+        now = time.time()
+        with self._lock:
+            due = [endpoint for endpoint in endpoints if endpoint["name"] not in self._probing and self._health(endpoint["name"]).state(now) == "half_open"]
+            self._probing.update(endpoint["name"] for endpoint in due)
+        return due
+
+    def probe_finished(self, name: str):
+        with self._lock:
+            self._probing.discard(name)
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                name: {
+                    "state": health.state(now),
+                    "success_rate": health.success_rate,
+                    "bad_json_rate": health.bad_json_rate,
+                    "latency": health.latency,
+                    "expected_latency": health.expected_latency(),
+                    "samples": health.samples
+                }
+                for name, health in self._endpoints.items()
+            }
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw_endpoints = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Could not load resolver health from {self.path}: {e}")
+            return
+        for name, raw in raw_endpoints.items():
+            health = self._health(name)
+            health.results.extend(outcome for outcome in raw.get("results", []) if outcome in OUTCOMES)
+            health.latency = float(raw.get("latency", self.prior_latency))
+            health.samples = int(raw.get("samples", 0))
+            health.consecutive_failures = int(raw.get("consecutive_failures", 0))
+            health.open_until = float(raw.get("open_until", 0.0))
+            health.open_seconds = float(raw.get("open_seconds", 0.0))
+        logger.info(f"Loaded resolver health for {len(self._endpoints)} endpoint(s) from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._saved_at = time.time()
+            snapshot = {
+                name: {
+                    "results": list(health.results),
+                    "latency": health.latency,
+                    "samples": health.samples,
+                    "consecutive_failures": health.consecutive_failures,
+                    "open_until": health.open_until,
+                    "open_seconds": health.open_seconds
+                }
+                for name, health in self._endpoints.items()
+            }
+        tmp_path = f"{self.path}.tmp.{threading.get_ident()}"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Could not write resolver health to {self.path}: {e}")
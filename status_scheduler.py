@@ -0,0 +1,181 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from metrics import observe_flood_wait
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` banked."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        """True when the bucket is back at capacity, i.e. no different from a new one."""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class StatusScheduler:
+    """
+    Owns every status-message edit so jobs never talk to Telegram directly.
+
+    Callers `submit` the text they want a message to show together with an
+    `edit` coroutine function; only the latest pending text per message is
+    kept. A single worker sends edits within a per-chat token bucket and a
+    global one, skips text the message already shows, and on a flood wait
+    (`flood_wait_seconds(exc)` returns the wait) pauses that whole chat and
+    keeps the text pending, so the submitting coroutine never blocks. Every
+    `prune_interval` seconds it forgets full chat buckets and ended flood
+    waits, so its state tracks the chats being edited, not every chat seen.
+    """
+
+    def __init__(self, flood_wait_seconds, chat_rate: float = 20 / 60, chat_burst: float = 3, global_rate: float = 25, global_burst: float = 30, max_tracked: int = 4096, prune_interval: float = 60):
+        self.flood_wait_seconds = flood_wait_seconds
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_tracked = max_tracked
+        self.prune_interval = prune_interval
+        self.sent = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.flood_waits = 0
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets = {}  # chat_id -> TokenBucket
+        self._blocked_until = {}  # chat_id -> monotonic time the flood wait ends
+        self._pending = OrderedDict()  # (chat_id, message_id) -> (text, edit)
+        self._in_flight = set()
+        self._deliveries = set()  # Running _deliver tasks; the loop only keeps weak references
+        self._last_text = OrderedDict()  # (chat_id, message_id) -> text the message shows
+        self._wakeup = None
+        self._task = None
+        self._pruned_at = time.monotonic()
+
+    def submit(self, chat_id, message_id, text: str, edit):
+        """Queues `text` for the message, replacing any text still waiting to be sent."""
+        key = (chat_id, message_id)
+        if key in self._pending:
+            self.coalesced += 1
+        elif self._last_text.get(key) == text and key not in self._in_flight:
+            self.skipped += 1
+            return
+        self._pending[key] = (text, edit)
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def discard(self, chat_id, message_id):
+        """Drops pending text and state for a message that is about to be deleted."""
+        key = (chat_id, message_id)
+        self._pending.pop(key, None)
+        self._last_text.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+            "flood_waits": self.flood_waits
+        }
+
+    def _ensure_worker(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune(self, now: float):
+        """Drops chat buckets that refilled completely and flood waits that ended."""
+        self._pruned_at = now
+        busy = {key[0] for key in self._pending} | {key[0] for key in self._in_flight}
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if chat_id not in busy and bucket.full(now)]:
+            del self._chat_buckets[chat_id]
+        for chat_id in [chat_id for chat_id, until in self._blocked_until.items() if until <= now]:
+            del self._blocked_until[chat_id]
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            if now - self._pruned_at >= self.prune_interval:
+                self._prune(now)
+            wait = None
+            for key in list(self._pending):
+                if key in self._in_flight:
+                    continue
+                chat_id = key[0]
+                chat_bucket = self._chat_bucket(chat_id)
+                chat_delay = max(self._blocked_until.get(chat_id, 0) - now, chat_bucket.delay(now))
+                if chat_delay > 0:
+                    wait = chat_delay if wait is None else min(wait, chat_delay)
+                    continue
+                global_delay = self._global_bucket.delay(now)
+                if global_delay > 0:
+                    wait = global_delay if wait is None else min(wait, global_delay)
+                    break
+                text, edit = self._pending.pop(key)
+                chat_bucket.take(now)
+                self._global_bucket.take(now)
+                self._in_flight.add(key)
+                delivery = asyncio.create_task(self._deliver(key, text, edit))
+                self._deliveries.add(delivery)
+                delivery.add_done_callback(self._deliveries.discard)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, key, text: str, edit):
+        chat_id = key[0]
+        try:
+            await edit(text)
+            self.sent += 1
+            self._remember(key, text)
+        except Exception as e:
+            wait_seconds = self.flood_wait_seconds(e)
+            if wait_seconds is not None:
+                self.flood_waits += 1
+                observe_flood_wait("status_edit", wait_seconds)
+                logger.warning(f"Flood wait of {wait_seconds}s for chat {chat_id}; pausing its status edits")
+                self._blocked_until[chat_id] = time.monotonic() + wait_seconds
+                self._pending.setdefault(key, (text, edit))  # Newer text, if any, still wins
+            elif "not modified" in str(e).lower():
+                self._remember(key, text)
+            else:
+                logger.error(f"Failed to update status message {key[1]} in chat {chat_id}: {e}")
+        finally:
+            self._in_flight.discard(key)
+            self._wakeup.set()
+
+    def _remember(self, key, text: str):
+        self._last_text[key] = text
+        self._last_text.move_to_end(key)
+        while len(self._last_text) > self.max_tracked:
+            self._last_text.popitem(last=False)
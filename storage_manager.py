@@ -0,0 +1,174 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import os
+import shutil
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class StorageFull(Exception):
+    """Raised when a job needs more space than the download directory can ever give it."""
+    pass
+
+
+async def probe_content(url: str, timeout: float = 15):
+    """Returns the Content-Length (0 if unknown) and Content-Type ("" if unknown) a HEAD request reports for `url`."""
+    try:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=timeout) as client:
+            response = await client.head(url)
+            if response.status_code < 400:
+                return int(response.headers.get("content-length", 0) or 0), response.headers.get("content-type", "").lower()
+            logger.debug(f"HEAD {url[:80]} returned {response.status_code}")
+    except (httpx.HTTPError, ValueError) as e:
+        logger.debug(f"HEAD {url[:80]} failed: {e}")
+    return 0, ""
+
+
+async def probe_content_length(url: str, timeout: float = 15) -> int:
+    """Returns the Content-Length a HEAD request reports for `url`, or 0 if unknown."""
+    return (await probe_content(url, timeout))[0]
+
+
+def preallocate(handle, size: int):
+    """Reserves `size` bytes for an open file so a full disk fails now, not halfway through."""
+    if size <= 0:
+        return
+    try:
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(handle.fileno(), 0, size)
+        else:
+            handle.truncate(size)
+    except OSError as e:
+        logger.warning(f"Could not preallocate {size} bytes for {getattr(handle, 'name', handle)}: {e}")
+
+
+class StorageReservation:
+    """Bytes held in a StorageManager for one job; release() hands them back."""
+
+    def __init__(self, manager, size: int):
+        self.manager = manager
+        self.size = size
+        self.released = False
+
+    def resize(self, size: int):
+        """Adjusts the reservation once the real size is known, without waiting."""
+        if not self.released:
+            self.manager._adjust(size - self.size)
+            self.size = size
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.manager._adjust(-self.size)
+
+
+class StorageManager:
+    """
+    Disk-space admission for a download directory.
+
+    Jobs `reserve()` the bytes they expect to write before they start and
+    wait while the reservations would exceed the quota, instead of all
+    failing at once on a full disk.
+    The quota is `quota_bytes`, or by default whatever was free when the
+    manager started minus `min_free_bytes`. Jobs of unknown size reserve
+    `unknown_size`.
+    """
+
+    def __init__(self, directory: str, quota_bytes: int = 0, min_free_bytes: int = 512 * 1024 * 1024, unknown_size: int = 1024 * 1024 * 1024):
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self.min_free_bytes = min_free_bytes
+        self.unknown_size = unknown_size
+        self.auto_quota = not quota_bytes
+        self.quota_bytes = quota_bytes or max(0, shutil.disk_usage(self.directory).free - min_free_bytes)
+        self.reserved_bytes = 0
+        self._waiting = 0
+        self._changed = None
+        self._notifications = set()  # Running _notify tasks; the loop only keeps weak references
+
+    def fits(self, size: int) -> bool:
+        """True if a reservation of `size` would be granted right now."""
+        return not self._waiting and self.reserved_bytes + (size or self.unknown_size) <= self.quota_bytes
+
+    def try_reserve(self, size: int):
+        """Reserves `size` bytes only if that needs no waiting; returns None otherwise."""
+        size = size or self.unknown_size
+        if not self.fits(size):
+            return None
+        self.reserved_bytes += size
+        return StorageReservation(self, size)
+
+    async def reserve(self, size: int) -> StorageReservation:
+        size = size or self.unknown_size
+        if size > self.quota_bytes:
+            raise StorageFull(f"Needs {size} bytes but the download quota is {self.quota_bytes} bytes")
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        async with self._changed:
+            self._waiting += 1
+            try:
+                await self._changed.wait_for(lambda: self.reserved_bytes + size <= self.quota_bytes)
+            finally:
+                self._waiting -= 1
+            self.reserved_bytes += size
+        return StorageReservation(self, size)
+
+    def _adjust(self, delta: int):
+        self.reserved_bytes += delta
+        if delta < 0 and self._changed is not None:
+            notification = asyncio.get_running_loop().create_task(self._notify())
+            self._notifications.add(notification)
+            notification.add_done_callback(self._notifications.discard)
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    def sweep(self, keep=()) -> int:
+        """
+        Deletes files in the download directory that no job owns any more,
+        such as downloads, split parts and .aria2 control files left behind by
+        a crash. Paths in `keep` (and their .aria2 files) survive. Returns the
+        number of bytes freed.
+        """
+        keep = {os.path.abspath(path) for path in keep if path}
+        keep |= {path + ".aria2" for path in keep}
+        freed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if path in keep:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    freed += size
+                except OSError as e:
+                    logger.warning(f"Could not sweep {path}: {e}")
+        if freed:
+            logger.info(f"Swept {freed} bytes of orphaned files from {self.directory}")
+            if self.auto_quota:
+                self.quota_bytes += freed
+        return freed
+
+    def used_bytes(self) -> int:
+        """Bytes allocated on disk by everything in the download directory."""
+        used = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                try:
+                    used += os.stat(os.path.join(root, name)).st_blocks * 512  # Preallocated space counts
+                except OSError:
+                    pass  # Deleted mid-walk
+        return used
+
+    def stats(self) -> dict:
+        return {
+            "reserved": self.reserved_bytes,
+            "quota": self.quota_bytes,
+            "waiting": self._waiting,
+            "free": shutil.disk_usage(self.directory).free
+        }
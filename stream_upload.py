@@ -0,0 +1,213 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import math
+import mimetypes
+import os
+import re
+from urllib.parse import unquote, urlparse
+
+import httpx
+from pyrogram import raw, types, utils
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 512 * 1024  # saveBigFilePart part size
+BIG_FILE_MIN_SIZE = 10 * 1024 * 1024  # Telegram only accepts saveBigFilePart above 10 MB
+
+
+class StreamUploadError(Exception):
+    """Raised when a pipelined download/upload cannot be completed."""
+    pass
+
+
+def _read_at(handle, offset: int, size: int) -> bytes:
+    handle.seek(offset)
+    return handle.read(size)
+
+
+class HTTPXPartSource:
+    """
+    Streams a URL with HTTPX and yields it in PART_SIZE parts. Nothing touches
+    the disk; memory is bounded by the uploader's queue.
+    """
+
+    def __init__(self, url: str, part_size: int = PART_SIZE):
+        self.url = url
+        self.part_size = part_size
+        self.total_size = 0
+        self.file_name = None
+        self.received = 0
+        self._client = None
+        self._response = None
+
+    async def open(self):
+        self._client = httpx.AsyncClient(follow_redirects=True, timeout=httpx.Timeout(60.0, connect=30.0))
+        self._response = await self._client.send(self._client.build_request("GET", self.url), stream=True)
+        self._response.raise_for_status()
+        self.total_size = int(self._response.headers.get("content-length", 0) or 0)
+        disposition = self._response.headers.get("content-disposition", "")
+        match = re.search(r"filename\*?=(?:UTF-8'')?\"?([^\";]+)", disposition, re.IGNORECASE)
+        self.file_name = unquote(match.group(1)) if match else os.path.basename(unquote(urlparse(str(self._response.url)).path))
+
+    async def parts(self):
+        buffer = bytearray()
+        async for chunk in self._response.aiter_bytes(chunk_size=131072):
+            buffer += chunk
+            self.received += len(chunk)
+            while len(buffer) >= self.part_size:
+                yield bytes(buffer[:self.part_size])
+                del buffer[:self.part_size]
+        if buffer:
+            yield bytes(buffer)
+
+    async def close(self):
+        if self._response is not None:
+            await self._response.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class GrowingFilePartSource:
+    """
+    Yields PART_SIZE parts of a file that aria2 is still writing. A part is
+    only read once `contiguous_length()` (the fully written prefix, e.g. from
+    the aria2 piece bitfield) covers it; `failed()` aborts the stream.
+    """
+
+    def __init__(self, path: str, total_size: int, contiguous_length, failed=None, part_size: int = PART_SIZE, poll_interval: float = 0.5):
+        self.path = path
+        self.total_size = total_size
+        self.contiguous_length = contiguous_length
+        self.failed = failed
+        self.part_size = part_size
+        self.poll_interval = poll_interval
+
+    async def parts(self):
+        loop = asyncio.get_running_loop()
+        offset = 0
+        handle = None
+        try:
+            while offset < self.total_size:
+                if self.failed and self.failed():
+                    raise StreamUploadError(f"Download of {self.path} failed while streaming")
+                size = min(self.part_size, self.total_size - offset)
+                if self.contiguous_length() < offset + size or not os.path.exists(self.path):
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                if handle is None:
+                    handle = open(self.path, "rb")
+                data = await loop.run_in_executor(None, _read_at, handle, offset, size)
+                if len(data) != size:
+                    raise StreamUploadError(f"Short read at offset {offset} of {self.path}")
+                offset += size
+                yield data
+        finally:
+            if handle is not None:
+                handle.close()
+
+
+class FilePartSource:
+    """Yields PART_SIZE parts of a finished file, or of the byte range starting at `offset`."""
+
+    def __init__(self, path: str, offset: int = 0, length: int = None, part_size: int = PART_SIZE):
+        self.path = path
+        self.offset = offset
+        self.length = os.path.getsize(path) - offset if length is None else length
+        self.part_size = part_size
+
+    async def parts(self):
+        loop = asyncio.get_running_loop()
+        with open(self.path, "rb") as handle:
+            end = self.offset + self.length
+            position = self.offset
+            while position < end:
+                size = min(self.part_size, end - position)
+                data = await loop.run_in_executor(None, _read_at, handle, position, size)
+                if len(data) != size:
+                    raise StreamUploadError(f"Short read at offset {position} of {self.path}")
+                position += size
+                yield data
+
+
+async def upload_big_file(client, parts, total_size: int, file_name: str, part_size: int = PART_SIZE, workers: int = 4, progress=None):
+    """
+    Uploads an async iterator of parts with upload.saveBigFilePart while the
+    parts are still being produced. Up to `workers` parts are in flight and at
+    most `workers * 2` are buffered, so memory stays bounded. Returns the
+    InputFileBig to attach to a message.
+    """
+    if total_size <= BIG_FILE_MIN_SIZE:
+        raise StreamUploadError(f"{file_name} is too small for saveBigFilePart ({total_size} bytes)")
+    file_id = client.rnd_id()
+    total_parts = math.ceil(total_size / part_size)
+    queue = asyncio.Queue(maxsize=workers * 2)
+    uploaded = 0
+    errors = []
+
+    async def worker():
+        nonlocal uploaded
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if errors:
+                continue  # Keep draining so the producer never blocks
+            part_index, data = item
+            try:
+                await client.invoke(raw.functions.upload.SaveBigFilePart(
+                    file_id=file_id, file_part=part_index, file_total_parts=total_parts, bytes=data
+                ))
+                uploaded += len(data)
+                if progress:
+                    await progress(uploaded, total_size)
+            except Exception as e:
+                errors.append(e)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    part_index = 0
+    try:
+        async for data in parts:
+            if errors:
+                break
+            await queue.put((part_index, data))
+            part_index += 1
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if hasattr(parts, "aclose"):
+            await parts.aclose()
+    if errors:
+        raise StreamUploadError(f"Uploading part of {file_name} failed: {errors[0]}") from errors[0]
+    if part_index != total_parts:
+        raise StreamUploadError(f"Expected {total_parts} parts for {file_name}, got {part_index}")
+    return raw.types.InputFileBig(id=file_id, parts=total_parts, name=file_name)
+
+
+async def send_uploaded_file(client, chat_id, input_file, file_name: str, caption: str = "", as_video: bool = False):
+    """Sends a file uploaded with upload_big_file and returns the parsed Message."""
+    attributes = [raw.types.DocumentAttributeFilename(file_name=file_name)]
+    if as_video:
+        attributes.append(raw.types.DocumentAttributeVideo(duration=0, w=0, h=0, supports_streaming=True))
+    media = raw.types.InputMediaUploadedDocument(
+        file=input_file,
+        mime_type=mimetypes.guess_type(file_name)[0] or "application/octet-stream",
+        attributes=attributes
+    )
+    result = await client.invoke(raw.functions.messages.SendMedia(
+        peer=await client.resolve_peer(chat_id),
+        media=media,
+        random_id=client.rnd_id(),
+        **await utils.parse_text_entities(client, caption, None, None)
+    ))
+    for update in result.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message,
+                {user.id: user for user in result.users},
+                {chat.id: chat for chat in result.chats}
+            )
+    raise StreamUploadError(f"Telegram did not return a message for {file_name}")
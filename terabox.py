@@ -1,19 +1,34 @@
-from aria2p import API as Aria2API, Client as Aria2Client
 import asyncio
+import httpx
 from dotenv import load_dotenv
 from datetime import datetime
 import os
 import logging
-import math
-from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
+from pyrogram import Client, filters, idle
+from pyrogram.types import ChatMemberUpdated, Message, InlineKeyboardButton, InlineKeyboardMarkup
 from pyrogram.enums import ChatMemberStatus
 from pyrogram.errors import FloodWait
 import time
 import urllib.parse
 from urllib.parse import urlparse
-from flask import Flask, render_template
+from flask import Flask, Response, render_template
 from threading import Thread
+from aria2_events import Aria2Notifier
+from aria2_rpc import Aria2RPC, Aria2RPCError, Aria2StatusBoard
+from aria2_tuner import Aria2Tuner
+from file_index import FileIndex
+from job_scheduler import JobScheduler, QueueFull
+from link_batch import LinkBatch, LinkBatchItem, dedupe_links
+from link_cache import extract_share_id
+from link_refresh import LinkExpiryWatch, is_expiry_error, link_expired
+from membership_cache import MembershipCache
+from metrics import observe_aria2_download, observe_resolver, register_pipeline, render as render_metrics, stage_duration, transfer_bytes
+from status_scheduler import StatusScheduler
+from storage_manager import StorageFull, StorageManager, probe_content
+from stream_upload import BIG_FILE_MIN_SIZE, GrowingFilePartSource, HTTPXPartSource, StreamUploadError, send_uploaded_file, upload_big_file
+from terabox_share import TeraboxShareError, TeraboxShareResolver
+from upload_pool import BOT_MAX_FILE_SIZE, PREMIUM_MAX_FILE_SIZE, UploadPool
+from video_splitter import VideoSplitter
 
 load_dotenv('config.env', override=True)
 logging.basicConfig(
@@ -27,12 +42,10 @@ logging.getLogger("pyrogram.session").setLevel(logging.ERROR)
 logging.getLogger("pyrogram.connection").setLevel(logging.ERROR)
 logging.getLogger("pyrogram.dispatcher").setLevel(logging.ERROR)
 
-aria2 = Aria2API(
-    Aria2Client(
-        host="http://localhost",
-        port=6800,
-        secret=""
-    )
+aria2 = Aria2RPC(
+    host="http://localhost",
+    port=6800,
+    secret=""
 )
 options = {
     "max-tries": "50",
@@ -40,10 +53,19 @@ options = {
     "continue": "true",
     "allow-overwrite": "true",
     "min-split-size": "4M",
-    "split": "10"
+    "split": "10",
+    "file-allocation": "falloc"
 }
 
-aria2.set_global_options(options)
+aria2_status = Aria2StatusBoard(aria2)
+aria2_tuner = Aria2Tuner(
+    explore=float(os.environ.get('ARIA2_TUNER_EXPLORE', 0.1)),  # Share of downloads that try a non-best connection count
+    path=os.environ.get('ARIA2_TUNER_FILE', 'aria2_tuning.json') or None
+) if os.environ.get('ARIA2_TUNER_ENABLED', 'true').lower() == 'true' else None
+aria2_notifier = Aria2Notifier("ws://localhost:6800/jsonrpc")
+LINK_REFRESH_MAX_ATTEMPTS = int(os.environ.get('LINK_REFRESH_MAX_ATTEMPTS', 3))  # Re-resolutions of a download whose direct link expired; 0 = fail as before
+LINK_STALL_SECONDS = float(os.environ.get('LINK_STALL_SECONDS', 30))  # Seconds without progress before the link is checked for expiry
+PROGRESS_INTERVAL = 15
 
 API_ID = os.environ.get('TELEGRAM_API', '')
 if len(API_ID) == 0:
@@ -73,18 +95,64 @@ if len(FSUB_ID) == 0:
     exit(1)
 else:
     FSUB_ID = int(FSUB_ID)
+membership_cache = MembershipCache(
+    ttl=float(os.environ.get('FSUB_CACHE_TTL', 600)),  # Seconds a confirmed member skips get_chat_member
+    negative_ttl=float(os.environ.get('FSUB_CACHE_NEGATIVE_TTL', 30))  # Kept short so users who just joined get in
+)
 
 USER_SESSION_STRING = os.environ.get('USER_SESSION_STRING', '')
 if len(USER_SESSION_STRING) == 0:
     logging.info("USER_SESSION_STRING variable is missing! Bot will split Files in 2Gb...")
     USER_SESSION_STRING = None
+USER_SESSION_STRINGS = [session for session in os.environ.get('USER_SESSION_STRINGS', '').split(',') if session.strip()]  # Extra upload accounts
+UPLOAD_BOT_TOKENS = [token for token in os.environ.get('UPLOAD_BOT_TOKENS', '').split(',') if token.strip()]  # Extra upload bots, admins of DUMP_CHAT_ID
+UPLOADS_PER_SESSION = int(os.environ.get('UPLOADS_PER_SESSION', 2))
+
+FILE_INDEX_DB = os.environ.get('FILE_INDEX_DB', 'file_index.db')
+file_index = FileIndex(FILE_INDEX_DB)
+
+ADMIN_USER_IDS = [int(admin_id) for admin_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if admin_id.strip()]
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', 30))
+BATCH_MAX_LINKS = int(os.environ.get('BATCH_MAX_LINKS', 100))  # Links taken from one message or .txt list
+LINK_LIST_MAX_BYTES = int(os.environ.get('LINK_LIST_MAX_BYTES', 1024 * 1024))
+job_scheduler = JobScheduler(
+    {
+        "download": int(os.environ.get('JOB_DOWNLOAD_CONCURRENCY', 4)),
+        "upload": int(os.environ.get('JOB_UPLOAD_CONCURRENCY', 2))
+    },
+    max_queued=JOB_MAX_QUEUED
+)
+
+DOWNLOAD_DIR = os.path.abspath(os.environ.get('DOWNLOAD_DIR', 'downloads'))
+download_storage = StorageManager(
+    DOWNLOAD_DIR,
+    quota_bytes=int(os.environ.get('STORAGE_QUOTA_BYTES', 0)),
+    min_free_bytes=int(os.environ.get('STORAGE_MIN_FREE_BYTES', 512 * 1024 * 1024)),
+    unknown_size=int(os.environ.get('STORAGE_UNKNOWN_SIZE', 1024 * 1024 * 1024))
+)
+options["dir"] = DOWNLOAD_DIR
+register_pipeline(job_scheduler, download_storage)
+
+STREAM_UPLOAD = os.environ.get('STREAM_UPLOAD', 'false').lower() == 'true'
+STREAM_UPLOAD_SOURCE = os.environ.get('STREAM_UPLOAD_SOURCE', 'aria2')  # aria2: overlap with the aria2 download, httpx: no disk use
+STREAM_UPLOAD_WORKERS = int(os.environ.get('STREAM_UPLOAD_WORKERS', 4))
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.webm')
 
-app = Client("jetbot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+TERABOX_COOKIE = os.environ.get('TERABOX_COOKIE', '')  # ndus=... of a Terabox web login; resolves links without the worker hop
+TERABOX_API_BASE = os.environ.get('TERABOX_API_BASE', 'https://www.terabox.com')
+native_resolver = TeraboxShareResolver(TERABOX_COOKIE, TERABOX_API_BASE) if TERABOX_COOKIE else None
+
+app = Client("jetbot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN, workers=JOB_MAX_QUEUED + 8)
+
+upload_pool = UploadPool()
+upload_pool.add("bot", app, BOT_MAX_FILE_SIZE, UPLOADS_PER_SESSION)
+for i, session_string in enumerate(([USER_SESSION_STRING] if USER_SESSION_STRING else []) + USER_SESSION_STRINGS):
+    upload_pool.add(f"user{i}", Client(f"jetu{i}" if i else "jetu", api_id=API_ID, api_hash=API_HASH, session_string=session_string.strip()), PREMIUM_MAX_FILE_SIZE, UPLOADS_PER_SESSION)
+for i, token in enumerate(UPLOAD_BOT_TOKENS):
+    upload_pool.add(f"bot{i + 1}", Client(f"jetupload{i + 1}", api_id=API_ID, api_hash=API_HASH, bot_token=token.strip()), BOT_MAX_FILE_SIZE, UPLOADS_PER_SESSION)
 
-user = None
 SPLIT_SIZE = 2093796556
-if USER_SESSION_STRING:
-    user = Client("jetu", api_id=API_ID, api_hash=API_HASH, session_string=USER_SESSION_STRING)
+if upload_pool.max_file_size > BOT_MAX_FILE_SIZE:
     SPLIT_SIZE = 4241280205
 
 VALID_DOMAINS = [
@@ -95,17 +163,28 @@ VALID_DOMAINS = [
 ]
 last_update_time = 0
 
+MEMBER_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
 async def is_user_member(client, user_id):
-    try:
+    async def fetch():
         member = await client.get_chat_member(FSUB_ID, user_id)
-        if member.status in [ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            return True
-        else:
-            return False
+        return member.status in MEMBER_STATUSES
+
+    try:
+        return await membership_cache.check(user_id, fetch)
     except Exception as e:
         logging.error(f"Error checking membership status for user {user_id}: {e}")
         return False
+
+@app.on_chat_member_updated(filters.chat(FSUB_ID))
+async def handle_fsub_member_update(client: Client, update: ChatMemberUpdated):
+    # Needs the bot to be an admin of FSUB_ID; without these updates entries simply expire
+    member = update.new_chat_member or update.old_chat_member
+    if not member or not member.user:
+        return
+    membership_cache.store(member.user.id, bool(update.new_chat_member) and update.new_chat_member.status in MEMBER_STATUSES)
     
+
 def is_valid_url(url):
     parsed_url = urlparse(url)
     return any(parsed_url.netloc.endswith(domain) for domain in VALID_DOMAINS)
@@ -139,11 +218,257 @@ async def start_command(client: Client, message: Message):
     else:
         await message.reply_text(final_msg, reply_markup=reply_markup)
 
+async def send_from_index(client, message, share_id):
+    entries = file_index.lookup_share(share_id)
+    if not entries:
+        return False
+    try:
+        for entry in entries:
+            await client.copy_message(message.chat.id, entry["chat_id"], entry["message_id"])
+    except Exception as e:
+        logger.warning(f"Indexed copy failed for share {share_id}, uploading again: {e}")
+        file_index.forget(share_id)
+        return False
+    logger.info(f"Served share {share_id} from file index ({len(entries)} message(s))")
+    return True
+
+status_scheduler = StatusScheduler(flood_wait_seconds=lambda e: e.value if isinstance(e, FloodWait) else None)
+
 async def update_status_message(status_message, text):
+    if isinstance(status_message, LinkBatchItem):
+        batch = status_message.batch
+        batch.update(status_message.index, text)
+        status_message, text = batch.message, batch.render()
+    status_scheduler.submit(status_message.chat.id, status_message.id, text, status_message.edit_text)
+
+async def clean_up_messages(message, status_message):
+    """Deletes the status message and the user's link once the file is sent; a batch keeps both."""
+    if isinstance(status_message, LinkBatchItem):
+        await update_status_message(status_message, "✅ sᴇɴᴛ")
+        return
     try:
-        await status_message.edit_text(text)
+        status_scheduler.discard(status_message.chat.id, status_message.id)
+        await status_message.delete()
+        await message.delete()
     except Exception as e:
-        logger.error(f"Failed to update status message: {e}")
+        logger.error(f"Cleanup error: {e}")
+
+async def download_with_aria2(final_url, message, status_message, gid=None, size=0, refresh=None):
+    """
+    Downloads `final_url` with aria2 and returns the finished download, or
+    None after telling the user it failed. `refresh` is an optional
+    coroutine function that resolves the share again; when the direct link
+    expires mid-download its result replaces the link and the data already
+    on disk is kept.
+    """
+    user_id = message.from_user.id
+    tuning = None
+    if gid is None:
+        download_options = {}
+        if aria2_tuner:
+            download_options, tuning = aria2_tuner.choose(final_url, size)
+        gid = await aria2.add_uris([final_url], download_options)
+    queued_at = time.monotonic()
+    started_at = None
+    start_time = datetime.now()
+    expiry_watch = LinkExpiryWatch(LINK_STALL_SECONDS, LINK_REFRESH_MAX_ATTEMPTS if refresh else 0)
+
+    async def fresh_link():
+        try:
+            new_url = await refresh()
+        except Exception as e:
+            logger.warning(f"Could not resolve the link of GID {gid} again: {e}")
+            return None
+        return new_url if new_url and new_url != final_url else None
+
+    async def refresh_download_progress():
+        nonlocal final_url
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            download = aria2_status.status(gid)
+            if download is None:
+                continue
+            progress = download.progress
+
+            elapsed_time = datetime.now() - start_time
+            elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
+
+            status_text = (
+                f"┏ ғɪʟᴇɴᴀᴍᴇ: {download.name}\n"
+                f"┠ [{'★' * int(progress / 10)}{'☆' * (10 - int(progress / 10))}] {progress:.2f}%\n"
+                f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {format_size(download.completed_length)} ᴏғ {format_size(download.total_length)}\n"
+                f"┠ sᴛᴀᴛᴜs: 📥 Downloading\n"
+                f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
+                f"┠ sᴘᴇᴇᴅ: {format_size(download.download_speed)}/s\n"
+                f"┠ ᴇᴛᴀ: {download.eta_string()} | ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
+                f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
+                )
+            await update_status_message(status_message, status_text)
+
+            if not expiry_watch.exhausted and expiry_watch.stalled(download) and await link_expired(final_url):
+                logger.warning(f"Direct link of {download.name} expired at {format_size(download.completed_length)}; resolving it again")
+                new_url = await fresh_link()
+                try:
+                    if new_url:
+                        await aria2.replace_uris(gid, [new_url])
+                        final_url = new_url
+                except Aria2RPCError as e:
+                    logger.warning(f"Could not swap the link of aria2 GID {gid}: {e}")
+                    new_url = None
+                expiry_watch.refreshed("swapped" if new_url else "failed")
+
+    while True:
+        aria2_status.watch(gid)
+        progress_task = asyncio.create_task(refresh_download_progress())
+        try:
+            download_event = await aria2_notifier.wait(gid, check=aria2_status.event_check(gid))
+        finally:
+            progress_task.cancel()
+            started_at = started_at or aria2_status.started_at(gid)
+            aria2_status.unwatch(gid)
+        finished_at = time.monotonic()
+        download = await aria2.tell_status(gid)
+        if download_event != "error" or expiry_watch.exhausted or not download.files or not is_expiry_error(download.error_code, download.error_message):
+            break
+        logger.warning(f"aria2 gave up on {download.name} at {format_size(download.completed_length)}, its link expired ({download.error_message}); resolving it again")
+        new_url = await fresh_link()
+        if new_url is None:
+            expiry_watch.refreshed("failed")
+            break
+        await aria2.remove(gid)  # Keeps the partial file and its .aria2 control file
+        file_path = download.files[0].path
+        gid = await aria2.add_uris([new_url], {"dir": os.path.dirname(file_path), "out": os.path.basename(file_path)})  # continue=true resumes it
+        final_url = new_url
+        expiry_watch.refreshed("readded")
+
+    if download_event != "complete" or not download.is_complete:
+        logger.error(f"Download {download.gid} ended with '{download_event}': {download.error_message}")
+        await update_status_message(status_message, f"❌ Download failed: {download.error_message or download_event}")
+        try:
+            await aria2.remove(gid, force=True, files=True)  # The reservation is released next, so the partial file goes too
+        except Exception as e:
+            logger.warning(f"Could not clean up aria2 download {gid}: {e}")
+        return None
+    observe_aria2_download(queued_at, started_at, finished_at)
+    if aria2_tuner and started_at is not None and not expiry_watch.refreshes:
+        aria2_tuner.record(tuning, download.completed_length, finished_at - started_at)
+    transfer_bytes.labels("in").inc(download.completed_length)
+    return download
+
+async def stream_link(client, message, status_message, final_url, share_id, size=0):
+    """
+    Pipeline mode: uploads the file with saveBigFilePart while it is still
+    downloading, from the growing aria2 file or straight from an HTTPX stream.
+    Returns (True, None) once the link is handled, or (False, gid) when the
+    file must take the normal path (too small for saveBigFilePart or big
+    enough to need splitting); `gid` is the aria2 download to reuse, if any.
+    """
+    user_id = message.from_user.id
+    start_time = datetime.now()
+    source = None
+    gid = None
+    file_path = None
+
+    if STREAM_UPLOAD_SOURCE == "httpx":
+        source = HTTPXPartSource(final_url)
+        await source.open()
+        total_size, file_name = source.total_size, source.file_name
+    else:
+        # Tuned but not fed back: the upload paces this download
+        gid = await aria2.add_uris([final_url], aria2_tuner.choose(final_url, size)[0] if aria2_tuner else {})
+        aria2_status.watch(gid)
+        download = aria2_status.status(gid)
+        while download is None or not download.total_length:
+            if download is not None and download.status in ("error", "removed", "complete"):
+                break
+            await asyncio.sleep(aria2_status.interval)
+            download = aria2_status.status(gid)
+        total_size, file_name = download.total_length, download.name
+        file_path = download.files[0].path if download.files else None
+
+    if not file_name or not (BIG_FILE_MIN_SIZE < total_size <= SPLIT_SIZE) or (source is None and not file_path):
+        if source is not None:
+            await source.close()
+        else:
+            aria2_status.unwatch(gid)
+        return False, gid
+
+    def aria2_contiguous_length():
+        download = aria2_status.status(gid)
+        return download.contiguous_length if download else 0
+
+    def aria2_failed():
+        download = aria2_status.status(gid)
+        return download is not None and download.status in ("error", "removed")
+
+    async def stream_progress(uploaded, total):
+        progress = (uploaded / total) * 100
+        elapsed_time = datetime.now() - start_time
+        elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
+        downloaded = source.received if source is not None else aria2_contiguous_length()
+        status_text = (
+            f"┏ ғɪʟᴇɴᴀᴍᴇ: {file_name}\n"
+            f"┠ [{'★' * int(progress / 10)}{'☆' * (10 - int(progress / 10))}] {progress:.2f}%\n"
+            f"┠ ᴅᴏᴡɴʟᴏᴀᴅᴇᴅ: {format_size(downloaded)} | ᴜᴘʟᴏᴀᴅᴇᴅ: {format_size(uploaded)} ᴏғ {format_size(total)}\n"
+            f"┠ sᴛᴀᴛᴜs: 📥📤 Streaming to Telegram\n"
+            f"┠ sᴘᴇᴇᴅ: {format_size(uploaded / elapsed_time.seconds if elapsed_time.seconds > 0 else 0)}/s\n"
+            f"┠ ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
+            f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
+        )
+        await update_status_message(status_message, status_text)
+
+    caption = (
+        f"✨ {file_name}\n"
+        f"👤 ʟᴇᴇᴄʜᴇᴅ ʙʏ : <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a>\n"
+        f"📥 ᴜsᴇʀ ʟɪɴᴋ: tg://user?id={user_id}\n\n"
+        "[ᴘᴏᴡᴇʀᴇᴅ ʙʏ ᴊᴇᴛ-ᴍɪʀʀᴏʀ ❤️🚀](https://t.me/JetMirror)"
+    )
+    try:
+        if source is not None:
+            parts = source.parts()
+        else:
+            parts = GrowingFilePartSource(file_path, total_size, aria2_contiguous_length, aria2_failed).parts()
+        upload_started = time.monotonic()
+        async with upload_pool.session(total_size) as upload_session:
+            input_file = await upload_big_file(upload_session.client, parts, total_size, file_name, workers=STREAM_UPLOAD_WORKERS, progress=stream_progress)
+            sent = await send_uploaded_file(upload_session.client, DUMP_CHAT_ID, input_file, file_name, caption, as_video=file_name.lower().endswith(VIDEO_EXTENSIONS))
+        stage_duration.labels("upload").observe(time.monotonic() - upload_started)  # Includes the overlapped download
+        transfer_bytes.labels("in").inc(total_size)
+        transfer_bytes.labels("out").inc(total_size)
+        await app.copy_message(message.chat.id, DUMP_CHAT_ID, sent.id)
+        if share_id:
+            media = sent.video or sent.document
+            file_index.record_share(share_id, [{
+                "file_key": file_name,
+                "file_size": total_size,
+                "chat_id": DUMP_CHAT_ID,
+                "message_id": sent.id,
+                "file_id": media.file_id if media else None
+            }])
+    except Exception as e:
+        logger.error(f"Streaming upload of {file_name} failed: {e}", exc_info=not isinstance(e, StreamUploadError))
+        await update_status_message(status_message, f"❌ Upload failed: {e}")
+        return True, None
+    finally:
+        if source is not None:
+            await source.close()
+        else:
+            aria2_status.unwatch(gid)
+            try:
+                await aria2.remove(gid, force=True, files=True)
+            except Exception as e:
+                logger.warning(f"Could not clean up aria2 download {gid}: {e}")
+
+    await clean_up_messages(message, status_message)
+    return True, None
+
+async def require_membership(client: Client, message: Message) -> bool:
+    if await is_user_member(client, message.from_user.id):
+        return True
+    join_button = InlineKeyboardButton("ᴊᴏɪɴ ❤️🚀", url="https://t.me/jetmirror")
+    reply_markup = InlineKeyboardMarkup([[join_button]])
+    await message.reply_text("ʏᴏᴜ ᴍᴜsᴛ ᴊᴏɪɴ ᴍʏ ᴄʜᴀɴɴᴇʟ ᴛᴏ ᴜsᴇ ᴍᴇ.", reply_markup=reply_markup)
+    return False
 
 @app.on_message(filters.text)
 async def handle_message(client: Client, message: Message):
@@ -153,57 +478,232 @@ async def handle_message(client: Client, message: Message):
         return
 
     user_id = message.from_user.id
-    is_member = await is_user_member(client, user_id)
-
-    if not is_member:
-        join_button = InlineKeyboardButton("ᴊᴏɪɴ ❤️🚀", url="https://t.me/jetmirror")
-        reply_markup = InlineKeyboardMarkup([[join_button]])
-        await message.reply_text("ʏᴏᴜ ᴍᴜsᴛ ᴊᴏɪɴ ᴍʏ ᴄʜᴀɴɴᴇʟ ᴛᴏ ᴜsᴇ ᴍᴇ.", reply_markup=reply_markup)
+    if not await require_membership(client, message):
         return
     
-    url = None
-    for word in message.text.split():
-        if is_valid_url(word):
-            url = word
-            break
-
-    if not url:
+    urls = dedupe_links(word for word in message.text.split() if is_valid_url(word))
+    if not urls:
         await message.reply_text("Please provide a valid Terabox link.")
         return
+    if len(urls) > 1:
+        await process_batch(client, message, urls)
+        return
 
-    encoded_url = urllib.parse.quote(url)
-    final_url = f"https://teraboxdl.tellycloudapi.workers.dev/?url={encoded_url}"
+    url = urls[0]
 
-    download = aria2.add_uris([final_url])
-    status_message = await message.reply_text("sᴇɴᴅɪɴɢ ʏᴏᴜ ᴛʜᴇ ᴍᴇᴅɪᴀ...🤤")
+    share_id = extract_share_id(url)
+    if share_id and await send_from_index(client, message, share_id):
+        return
 
-    start_time = datetime.now()
+    try:
+        job_scheduler.admit()
+    except QueueFull as e:
+        logger.warning(f"Rejected link from {user_id}: {e}")
+        await message.reply_text("🚦 ʙᴏᴛ ɪs ʙᴜsʏ ʀɪɢʜᴛ ɴᴏᴡ. ᴘʟᴇᴀsᴇ sᴇɴᴅ ʏᴏᴜʀ ʟɪɴᴋ ᴀɢᴀɪɴ ɪɴ ᴀ ғᴇᴡ ᴍɪɴᴜᴛᴇs.")
+        return
+    try:
+        await process_link(client, message, url, share_id)
+    finally:
+        job_scheduler.finish()
+
+@app.on_message(filters.document)
+async def handle_link_list(client: Client, message: Message):
+    """Takes every Terabox link out of an uploaded .txt document and sends them as one batch."""
+    document = message.document
+    if not message.from_user or not (document.file_name or "").lower().endswith(".txt"):
+        return
+    if not await require_membership(client, message):
+        return
+    if document.file_size > LINK_LIST_MAX_BYTES:
+        await message.reply_text(f"ᴛʜᴀᴛ ʟɪsᴛ ɪs ᴛᴏᴏ ʟᴀʀɢᴇ. sᴇɴᴅ ʟɪsᴛs ᴏғ ᴀᴛ ᴍᴏsᴛ {format_size(LINK_LIST_MAX_BYTES)}.")
+        return
+    try:
+        list_file = await message.download(in_memory=True)
+        list_text = bytes(list_file.getbuffer()).decode("utf-8", errors="ignore")
+    except Exception as e:
+        logger.error(f"Could not read link list {document.file_name}: {e}")
+        await message.reply_text("❌ ᴄᴏᴜʟᴅ ɴᴏᴛ ʀᴇᴀᴅ ᴛʜᴀᴛ ғɪʟᴇ.")
+        return
+    urls = dedupe_links(word for word in list_text.split() if is_valid_url(word))
+    if not urls:
+        await message.reply_text("Please provide a valid Terabox link.")
+        return
+    logger.info(f"Link list {document.file_name} from {message.from_user.id} holds {len(urls)} unique link(s)")
+    await process_batch(client, message, urls)
+
+async def process_batch(client: Client, message: Message, urls: list):
+    """
+    Sends several links as one batch with a single combined status message.
+    Links already in the file index are copied straight away; the others are
+    resolved together, then transferred side by side within the user's
+    download and upload slots.
+    """
+    user_id = message.from_user.id
+    notes = []
+    if len(urls) > BATCH_MAX_LINKS:
+        notes.append(f"Only the first {BATCH_MAX_LINKS} links are taken; {len(urls) - BATCH_MAX_LINKS} were skipped.")
+        urls = urls[:BATCH_MAX_LINKS]
 
-    while not download.is_complete:
-        await asyncio.sleep(15)
-        download.update()
-        progress = download.progress
+    admitted = 0
+    for _ in urls:
+        try:
+            job_scheduler.admit()
+        except QueueFull as e:
+            logger.warning(f"Batch from {user_id} admitted {admitted}/{len(urls)} links: {e}")
+            break
+        admitted += 1
+    if not admitted:
+        await message.reply_text("🚦 ʙᴏᴛ ɪs ʙᴜsʏ ʀɪɢʜᴛ ɴᴏᴡ. ᴘʟᴇᴀsᴇ sᴇɴᴅ ʏᴏᴜʀ ʟɪɴᴋs ᴀɢᴀɪɴ ɪɴ ᴀ ғᴇᴡ ᴍɪɴᴜᴛᴇs.")
+        return
 
-        elapsed_time = datetime.now() - start_time
-        elapsed_minutes, elapsed_seconds = divmod(elapsed_time.seconds, 60)
+    batch = LinkBatch(urls, notes)
+    for i in range(admitted, len(urls)):
+        batch.finish(i, "🚦 Not queued: the bot is busy. Send this link again later.")
+    try:
+        batch.message = await message.reply_text(batch.render())
+        share_ids = [extract_share_id(url) for url in urls[:admitted]]
+        indexed = [bool(share_id and file_index.lookup_share(share_id)) for share_id in share_ids]
 
-        status_text = (
-            f"┏ ғɪʟᴇɴᴀᴍᴇ: {download.name}\n"
-            f"┠ [{'★' * int(progress / 10)}{'☆' * (10 - int(progress / 10))}] {progress:.2f}%\n"
-            f"┠ ᴘʀᴏᴄᴇssᴇᴅ: {format_size(download.completed_length)} ᴏғ {format_size(download.total_length)}\n"
-            f"┠ sᴛᴀᴛᴜs: 📥 Downloading\n"
-            f"┠ ᴇɴɢɪɴᴇ: <b><u>Aria2c v1.37.0</u></b>\n"
-            f"┠ sᴘᴇᴇᴅ: {format_size(download.download_speed)}/s\n"
-            f"┠ ᴇᴛᴀ: {download.eta} | ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
-            f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
-            )
-        while True:
+        async def resolve(i: int):
+            if indexed[i]:
+                return None
             try:
-                await update_status_message(status_message, status_text)
-                break
-            except FloodWait as e:
-                logger.error(f"Flood wait detected! Sleeping for {e.value} seconds")
-                await asyncio.sleep(e.value)
+                resolved = await resolve_link(urls[i])
+            except Exception as e:
+                logger.error(f"Could not resolve batch link {urls[i]}: {e}")
+                return e
+            await update_status_message(batch.item(i), f"🔎 {format_size(resolved[1]) if resolved[1] else 'ʀᴇsᴏʟᴠᴇᴅ'}")
+            return resolved
+
+        async def send(i: int, resolved):
+            try:
+                if isinstance(resolved, Exception):
+                    batch.update(i, f"❌ {resolved}")
+                    return
+                if indexed[i] and await send_from_index(client, message, share_ids[i]):
+                    batch.finish(i, "✅ sᴇɴᴛ ғʀᴏᴍ ᴄᴀᴄʜᴇ")
+                    return
+                await process_link(client, message, urls[i], share_ids[i], status_message=batch.item(i), resolved=resolved)
+            except Exception as e:
+                logger.error(f"Batch link {urls[i]} failed: {e}", exc_info=True)
+                batch.update(i, f"❌ {e}")
+            finally:
+                batch.finish(i)
+                await update_status_message(batch.message, batch.render())
+
+        resolved_links = await asyncio.gather(*(resolve(i) for i in range(admitted)))
+        await asyncio.gather(*(send(i, resolved) for i, resolved in enumerate(resolved_links)))
+    finally:
+        for _ in range(admitted):
+            job_scheduler.finish()
+
+async def resolve_natively(url: str):
+    """
+    Returns the CDN URL, size and name of the share's first file from the
+    Terabox share API, or (None, 0, "") to fall back to the worker. Like the
+    worker, only the first file of a folder is sent.
+    """
+    started = time.monotonic()
+    try:
+        details = await native_resolver.resolve(url, limit=1)
+    except (TeraboxShareError, httpx.HTTPError) as e:
+        logger.warning(f"Native resolver failed for {url}, using the worker: {e}")
+        observe_resolver("terabox_native", time.monotonic() - started, False)
+        return None, 0, ""
+    observe_resolver("terabox_native", time.monotonic() - started, True)
+    if details["is_folder"]:
+        logger.info(f"{url} is a folder; sending its first file")
+    first_file = details["contents"][0]
+    return first_file["url"], first_file["size"], first_file.get("filename") or ""
+
+def will_split(size: int, is_video=None) -> bool:
+    """True when a file of `size` bytes gets cut into parts. Only videos are; `is_video=None` (not known yet) counts as one."""
+    return size > SPLIT_SIZE and is_video is not False
+
+def too_large_to_send(size: int, is_video=None) -> bool:
+    """True when no upload session may send a file of `size` bytes and it will not be split into parts that fit."""
+    return size > upload_pool.max_file_size and not will_split(size, is_video)
+
+async def refuse_too_large(status_message, name: str, size: int):
+    logger.warning(f"Refusing {name}: {size} bytes is over the {upload_pool.max_file_size} byte upload limit and cannot be split")
+    await update_status_message(
+        status_message,
+        f"❌ ᴛʜɪs ғɪʟᴇ ({format_size(size)}) ɪs ʟᴀʀɢᴇʀ ᴛʜᴀɴ ᴛʜᴇ ʙᴏᴛ ᴄᴀɴ sᴇɴᴅ ({format_size(upload_pool.max_file_size)}). "
+        "ᴏɴʟʏ ᴠɪᴅᴇᴏs ᴀʀᴇ sᴘʟɪᴛ ɪɴᴛᴏ ᴘᴀʀᴛs."
+    )
+
+async def resolve_link(url: str):
+    """
+    Returns the URL to download, its expected size (0 if unknown) and whether
+    it is a video (None if that is not known).
+    """
+    encoded_url = urllib.parse.quote(url)
+    resolve_started = time.monotonic()
+    final_url, expected_size, file_name = await resolve_natively(url) if native_resolver else (None, 0, "")
+    is_video = file_name.lower().endswith(VIDEO_EXTENSIONS) if file_name else None
+    if final_url is None:
+        final_url = f"https://teraboxdl.tellycloudapi.workers.dev/?url={encoded_url}"
+        probe_started = time.monotonic()
+        expected_size, content_type = await probe_content(final_url)  # The worker resolves the share and redirects to the CDN
+        observe_resolver("tellycloudapi", time.monotonic() - probe_started, expected_size > 0)
+        if content_type.startswith("video/"):
+            is_video = True
+        elif content_type.split("/")[0] in ("audio", "image", "text") or content_type in ("application/zip", "application/pdf"):
+            is_video = False  # application/octet-stream says nothing; CDNs serve videos with it too
+    stage_duration.labels("resolve").observe(time.monotonic() - resolve_started)
+    return final_url, expected_size, is_video
+
+async def process_link(client: Client, message: Message, url: str, share_id, status_message=None, resolved=None):
+    """Sends one link; a batch passes its item as `status_message` and the link already resolved."""
+    if status_message is None:
+        user_id = message.from_user.id
+        queue_position = job_scheduler.position("download", user_id, user_id in ADMIN_USER_IDS)
+        if queue_position:
+            status_message = await message.reply_text(f"⏳ ǫᴜᴇᴜᴇᴅ ᴀᴛ ᴘᴏsɪᴛɪᴏɴ {queue_position}...")
+        else:
+            status_message = await message.reply_text("sᴇɴᴅɪɴɢ ʏᴏᴜ ᴛʜᴇ ᴍᴇᴅɪᴀ...🤤")
+
+    final_url, expected_size, is_video = resolved or await resolve_link(url)
+    file_size = expected_size
+    if too_large_to_send(file_size, is_video):
+        await refuse_too_large(status_message, url, file_size)
+        return
+    if will_split(expected_size, is_video):
+        expected_size *= 2  # The split parts need a second copy
+    if not download_storage.fits(expected_size):
+        await update_status_message(status_message, f"💾 ᴡᴀɪᴛɪɴɢ ғᴏʀ ᴅɪsᴋ sᴘᴀᴄᴇ ({format_size(expected_size or download_storage.unknown_size)} ɴᴇᴇᴅᴇᴅ)...")
+    try:
+        storage_reservation = await download_storage.reserve(expected_size)
+    except StorageFull as e:
+        logger.error(f"Not enough disk space for {url}: {e}")
+        await update_status_message(status_message, "❌ ᴛʜɪs ғɪʟᴇ ɪs ᴛᴏᴏ ʟᴀʀɢᴇ ғᴏʀ ᴛʜᴇ ʙᴏᴛ's ғʀᴇᴇ ᴅɪsᴋ sᴘᴀᴄᴇ.")
+        return
+    try:
+        await transfer_link(client, message, status_message, final_url, share_id, storage_reservation, file_size, refresh=lambda: refresh_link(url))
+    finally:
+        storage_reservation.release()
+
+async def refresh_link(url: str):
+    """Resolves `url` again after its direct link expired and returns the new link."""
+    return (await resolve_link(url))[0]
+
+async def transfer_link(client: Client, message: Message, status_message, final_url: str, share_id, storage_reservation, expected_size: int = 0, refresh=None):
+    user_id = message.from_user.id
+    is_priority = user_id in ADMIN_USER_IDS
+    gid = None
+    if STREAM_UPLOAD:
+        async with job_scheduler.stage("download", user_id, is_priority):
+            async with job_scheduler.stage("upload", user_id, is_priority):
+                handled, gid = await stream_link(client, message, status_message, final_url, share_id, expected_size)
+        if handled:
+            return
+
+    async with job_scheduler.stage("download", user_id, is_priority):
+        download = await download_with_aria2(final_url, message, status_message, gid=gid, size=expected_size, refresh=refresh)
+    if download is None:
+        return
+
+    start_time = datetime.now()
 
     file_path = download.files[0].path
     caption = (
@@ -213,23 +713,6 @@ async def handle_message(client: Client, message: Message):
         "[ᴘᴏᴡᴇʀᴇᴅ ʙʏ ᴊᴇᴛ-ᴍɪʀʀᴏʀ ❤️🚀](https://t.me/JetMirror)"
     )
 
-    last_update_time = time.time()
-    UPDATE_INTERVAL = 15
-
-    async def update_status(message, text):
-        nonlocal last_update_time
-        current_time = time.time()
-        if current_time - last_update_time >= UPDATE_INTERVAL:
-            try:
-                await message.edit_text(text)
-                last_update_time = current_time
-            except FloodWait as e:
-                logger.warning(f"FloodWait: Sleeping for {e.value}s")
-                await asyncio.sleep(e.value)
-                await update_status(message, text)
-            except Exception as e:
-                logger.error(f"Error updating status: {e}")
-
     async def upload_progress(current, total):
         progress = (current / total) * 100
         elapsed_time = datetime.now() - start_time
@@ -245,147 +728,98 @@ async def handle_message(client: Client, message: Message):
             f"┠ ᴇʟᴀᴘsᴇᴅ: {elapsed_minutes}m {elapsed_seconds}s\n"
             f"┖ ᴜsᴇʀ: <a href='tg://user?id={user_id}'>{message.from_user.first_name}</a> | ɪᴅ: {user_id}\n"
         )
-        await update_status(status_message, status_text)
-
-    async def split_video_with_ffmpeg(input_path, output_prefix, split_size):
-        try:
-            original_ext = os.path.splitext(input_path)[1].lower() or '.mp4'
-            start_time = datetime.now()
-            last_progress_update = time.time()
-            
-            proc = await asyncio.create_subprocess_exec(
-                'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-                '-of', 'default=noprint_wrappers=1:nokey=1', input_path,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, _ = await proc.communicate()
-            total_duration = float(stdout.decode().strip())
-            
-            file_size = os.path.getsize(input_path)
-            parts = math.ceil(file_size / split_size)
-            
-            if parts == 1:
-                return [input_path]
-            
-            duration_per_part = total_duration / parts
-            split_files = []
-            
-            for i in range(parts):
-                current_time = time.time()
-                if current_time - last_progress_update >= UPDATE_INTERVAL:
-                    elapsed = datetime.now() - start_time
-                    status_text = (
-                        f"✂️ Splitting {os.path.basename(input_path)}\n"
-                        f"Part {i+1}/{parts}\n"
-                        f"Elapsed: {elapsed.seconds // 60}m {elapsed.seconds % 60}s"
-                    )
-                    await update_status(status_message, status_text)
-                    last_progress_update = current_time
-                
-                output_path = f"{output_prefix}.{i+1:03d}{original_ext}"
-                cmd = [
-                    'xtra', '-y', '-ss', str(i * duration_per_part),
-                    '-i', input_path, '-t', str(duration_per_part),
-                    '-c', 'copy', '-map', '0',
-                    '-avoid_negative_ts', 'make_zero',
-                    output_path
-                ]
-                
-                proc = await asyncio.create_subprocess_exec(*cmd)
-                await proc.wait()
-                split_files.append(output_path)
-            
-            return split_files
-        except Exception as e:
-            logger.error(f"Split error: {e}")
-            raise
+        await update_status_message(status_message, status_text)
+
+    def index_entry(sent, file_key, file_size):
+        media = sent.video or sent.document
+        return {
+            "file_key": file_key,
+            "file_size": file_size,
+            "chat_id": DUMP_CHAT_ID,
+            "message_id": sent.id,
+            "file_id": media.file_id if media else None
+        }
 
     async def handle_upload():
         file_size = os.path.getsize(file_path)
+        is_video = download.name.lower().endswith(VIDEO_EXTENSIONS)
+        if too_large_to_send(file_size, is_video):
+            os.remove(file_path)
+            await refuse_too_large(status_message, download.name, file_size)
+            return
+        split = will_split(file_size, is_video)
+        storage_reservation.resize(file_size * 2 if split else file_size)
+        indexed = []
         
-        if file_size > SPLIT_SIZE:
-            await update_status(
+        if split:
+            await update_status_message(
                 status_message,
                 f"✂️ Splitting {download.name} ({format_size(file_size)})"
             )
             
-            split_files = await split_video_with_ffmpeg(
-                file_path,
-                os.path.splitext(file_path)[0],
-                SPLIT_SIZE
-            )
-            
-            try:
-                for i, part in enumerate(split_files):
-                    part_caption = f"{caption}\n\nPart {i+1}/{len(split_files)}"
-                    await update_status(
-                        status_message,
-                        f"📤 Uploading part {i+1}/{len(split_files)}\n"
-                        f"{os.path.basename(part)}"
-                    )
-                    
-                    if USER_SESSION_STRING:
-                        sent = await user.send_video(
-                            DUMP_CHAT_ID, part, 
-                            caption=part_caption,
-                            progress=upload_progress
-                        )
-                        await app.copy_message(
-                            message.chat.id, DUMP_CHAT_ID, sent.id
-                        )
-                    else:
-                        sent = await client.send_video(
-                            DUMP_CHAT_ID, part,
-                            caption=part_caption,
-                            progress=upload_progress
-                        )
-                        await client.send_video(
-                            message.chat.id, sent.video.file_id,
-                            caption=part_caption
-                        )
+            splitter = VideoSplitter(file_path, os.path.splitext(file_path)[0], SPLIT_SIZE)
+            part_uploads = []
+
+            async def upload_part(part_number, total_parts, part):
+                part_size = os.path.getsize(part)
+                await update_status_message(
+                    status_message,
+                    f"📤 Uploading part {part_number}/{total_parts}\n"
+                    f"{os.path.basename(part)}"
+                )
+                sent = await upload_pool.send_video(
+                    DUMP_CHAT_ID, part, part_size,
+                    caption=f"{caption}\n\nPart {part_number}/{total_parts}",
+                    progress=upload_progress
+                )
+                if part != file_path:
                     os.remove(part)
+                return sent, part_size
+
+            try:
+                split_started = time.monotonic()
+                total_parts = await splitter.plan()
+                async for part in splitter.parts():  # Parts upload in parallel, across sessions, while ffmpeg cuts the next one
+                    part_uploads.append(asyncio.create_task(upload_part(len(part_uploads) + 1, total_parts, part)))
+                stage_duration.labels("split").observe(time.monotonic() - split_started)
+                for part_number, part_upload in enumerate(part_uploads, start=1):
+                    sent, part_size = await part_upload
+                    transfer_bytes.labels("out").inc(part_size)
+                    await app.copy_message(message.chat.id, DUMP_CHAT_ID, sent.id)
+                    indexed.append(index_entry(sent, f"{download.name}.part{part_number:03d}", part_size))
             finally:
-                for part in split_files:
-                    try: os.remove(part)
-                    except: pass
+                for part_upload in part_uploads:
+                    part_upload.cancel()
+                await splitter.close()
         else:
-            await update_status(
+            await update_status_message(
                 status_message,
                 f"📤 Uploading {download.name}\n"
                 f"Size: {format_size(file_size)}"
             )
             
-            if USER_SESSION_STRING:
-                sent = await user.send_video(
-                    DUMP_CHAT_ID, file_path,
-                    caption=caption,
-                    progress=upload_progress
-                )
-                await app.copy_message(
-                    message.chat.id, DUMP_CHAT_ID, sent.id
-                )
-            else:
-                sent = await client.send_video(
-                    DUMP_CHAT_ID, file_path,
-                    caption=caption,
-                    progress=upload_progress
-                )
-                await client.send_video(
-                    message.chat.id, sent.video.file_id,
-                    caption=caption
-                )
+            sent = await upload_pool.send_video(
+                DUMP_CHAT_ID, file_path, file_size,
+                caption=caption,
+                progress=upload_progress
+            )
+            transfer_bytes.labels("out").inc(file_size)
+            await app.copy_message(
+                message.chat.id, DUMP_CHAT_ID, sent.id
+            )
+            indexed.append(index_entry(sent, download.name, file_size))
+        if share_id and indexed:
+            file_index.record_share(share_id, indexed)
         if os.path.exists(file_path):
             os.remove(file_path)
 
     start_time = datetime.now()
-    await handle_upload()
+    async with job_scheduler.stage("upload", user_id, is_priority):
+        upload_started = time.monotonic()
+        await handle_upload()
+        stage_duration.labels("upload").observe(time.monotonic() - upload_started)
 
-    try:
-        await status_message.delete()
-        await message.delete()
-    except Exception as e:
-        logger.error(f"Cleanup error: {e}")
+    await clean_up_messages(message, status_message)
 
 flask_app = Flask(__name__)
 
@@ -393,28 +827,33 @@ flask_app = Flask(__name__)
 def home():
     return render_template("index.html")
 
+@flask_app.route('/metrics')
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 def run_flask():
     flask_app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
 
 def keep_alive():
     Thread(target=run_flask).start()
 
-async def start_user_client():
-    if user:
-        await user.start()
-        logger.info("User client started.")
-
-def run_user():
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(start_user_client())
+async def main():
+    download_storage.sweep()  # Nothing survives a restart here, so everything left is orphaned
+    await aria2.set_global_options(options)
+    await app.start()
+    logger.info("Bot client started.")
+    await upload_pool.start(skip=(app,))
+    await idle()
+    await upload_pool.stop(skip=(app,))
+    if aria2_tuner:
+        aria2_tuner.save()
+    await app.stop()
+    await aria2_notifier.stop()
+    await aria2.close()
 
 if __name__ == "__main__":
     keep_alive()
 
-    if user:
-        logger.info("Starting user client...")
-        Thread(target=run_user).start()
-
     logger.info("Starting bot client...")
-    app.run()
\ No newline at end of file
+    app.run(main())
\ No newline at end of file
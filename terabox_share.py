@@ -0,0 +1,159 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import re
+
+import httpx
+
+from link_cache import extract_share_id
+
+logger = logging.getLogger(__name__)
+
+TERABOX_APP_ID = "250528"
+JS_TOKEN_PATTERN = re.compile(r'fn%28%22(\w+)%22%29')
+LOGID_PATTERN = re.compile(r'dp-logid=(\w+)')
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:126.0) Gecko/20100101 Firefox/126.0",
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-US,en;q=0.5"
+}
+
+
+class TeraboxShareError(Exception):
+    """Raised when the Terabox share API refuses a link or answers with an unexpected payload."""
+    pass
+
+
+class TeraboxShareResolver:
+    """
+    Resolves share links with Terabox's own web API instead of a third-party
+    worker, logged in through `cookie` (the `ndus=...` cookie of a Terabox
+    web session).
+
+    The flow is the one the share page runs: load the share page for its
+    jsToken and dp-logid, read the share's metadata from /api/shorturlinfo,
+    list the files (walking sub-folders up to `max_depth`) with /share/list,
+    then follow each file's dlink once to get the signed CDN URL, which
+    downloads without the cookie. `resolve()` returns the same details dict
+    as the resolver APIs: title, is_folder, total_size and contents. A
+    `limit` stops the walk and the dlink lookups after that many files.
+    """
+
+    def __init__(self, cookie: str, base_url: str = "https://www.terabox.com", timeout: float = 30, max_depth: int = 3, max_files: int = 1000, link_concurrency: int = 8):
+        self.cookie = cookie
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_depth = max_depth
+        self.max_files = max_files
+        self.link_concurrency = link_concurrency
+
+    def _client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(headers=dict(BROWSER_HEADERS, Cookie=self.cookie), timeout=self.timeout)
+
+    async def _get_json(self, client: httpx.AsyncClient, path: str, params: dict) -> dict:
+        response = await client.get(f"{self.base_url}{path}", params=params)
+        response.raise_for_status()
+        try:
+            payload = response.json()
+        except ValueError as e:
+            raise TeraboxShareError(f"{path} did not return JSON: {response.text[:200]}") from e
+        if not isinstance(payload, dict):
+            raise TeraboxShareError(f"{path} returned {type(payload).__name__}, not an object")
+        if payload.get("errno", 0) != 0:
+            raise TeraboxShareError(f"{path} failed with errno {payload.get('errno')}: {payload.get('errmsg') or payload.get('show_msg') or ''}".strip())
+        return payload
+
+    async def _page_tokens(self, client: httpx.AsyncClient, surl: str):
+        """Loads the share page and returns its (jsToken, dp-logid)."""
+        response = await client.get(f"{self.base_url}/sharing/link", params={"surl": surl}, follow_redirects=True)
+        response.raise_for_status()
+        js_token = JS_TOKEN_PATTERN.search(response.text)
+        if not js_token:
+            raise TeraboxShareError("No jsToken on the share page; the cookie may be missing or expired")
+        logid = LOGID_PATTERN.search(response.text)
+        return js_token.group(1), logid.group(1) if logid else ""
+
+    async def _list(self, client: httpx.AsyncClient, surl: str, js_token: str, logid: str, directory: str = None) -> list:
+        params = {
+            "app_id": TERABOX_APP_ID, "web": "1", "channel": "dubox", "clienttype": "0",
+            "jsToken": js_token, "dp-logid": logid,
+            "page": "1", "num": str(self.max_files), "by": "name", "order": "asc",
+            "shorturl": surl
+        }
+        if directory is None:
+            params["root"] = "1"
+        else:
+            params["dir"] = directory
+        payload = await self._get_json(client, "/share/list", params)
+        return payload.get("list") or []
+
+    async def _walk(self, client: httpx.AsyncClient, surl: str, js_token: str, logid: str, entries: list, limit: int, depth: int = 0, directory: str = None) -> list:
+        """Returns up to `limit` (directory, entry) pairs of files; `directory` is the listing the entry came from, None for the root."""
+        files = []
+        for entry in entries:
+            if len(files) >= limit:
+                break
+            if str(entry.get("isdir", "0")) == "1":
+                if depth >= self.max_depth:
+                    logger.warning(f"Not descending into {entry.get('path')}: deeper than {self.max_depth} levels")
+                    continue
+                children = await self._list(client, surl, js_token, logid, entry.get("path"))
+                files.extend(await self._walk(client, surl, js_token, logid, children, limit - len(files), depth + 1, entry.get("path")))
+            else:
+                files.append((directory, entry))
+        return files[:limit]
+
+    async def _direct_link(self, client: httpx.AsyncClient, dlink: str) -> str:
+        """Follows a dlink one hop to the signed CDN URL; the dlink itself needs the cookie."""
+        response = await client.head(dlink, follow_redirects=False)
+        location = response.headers.get("location")
+        if response.is_redirect and location:
+            return location
+        if response.status_code < 400:
+            raise TeraboxShareError(f"dlink answered {response.status_code} without a redirect; it only downloads with the cookie")
+        raise TeraboxShareError(f"dlink answered {response.status_code}")
+
+    async def resolve(self, input_url: str, limit: int = None) -> dict:
+        """Resolves the first `limit` files of the share (up to `max_files` when None)."""
+        share_id = extract_share_id(input_url)
+        if not share_id:
+            raise TeraboxShareError(f"No share ID in {input_url}")
+        limit = min(limit or self.max_files, self.max_files)
+        async with self._client() as client:
+            js_token, logid = await self._page_tokens(client, share_id)
+            info = await self._get_json(client, "/api/shorturlinfo", {"app_id": TERABOX_APP_ID, "shorturl": f"1{share_id}", "root": "1"})
+            root_entries = info.get("list") or await self._list(client, share_id, js_token, logid)
+            if not root_entries:
+                raise TeraboxShareError("The share is empty")
+            files = await self._walk(client, share_id, js_token, logid, root_entries, limit)
+            listings = {}
+            for directory in dict.fromkeys(directory for directory, entry in files if not entry.get("dlink")):  # shorturlinfo can omit dlinks; share/list always has them
+                listings[directory] = {entry.get("fs_id"): entry for entry in await self._list(client, share_id, js_token, logid, directory)}
+            files = [listings.get(directory, {}).get(entry.get("fs_id"), entry) for directory, entry in files]
+            files = [entry for entry in files if entry.get("dlink")]
+            if not files:
+                raise TeraboxShareError("No downloadable files in the share")
+
+            semaphore = asyncio.Semaphore(self.link_concurrency)
+
+            async def direct_link(entry):
+                async with semaphore:
+                    return await self._direct_link(client, entry["dlink"])
+
+            urls = await asyncio.gather(*(direct_link(entry) for entry in files))
+
+        is_folder = len(files) > 1 or str(root_entries[0].get("isdir", "0")) == "1"
+        contents = [
+            {"url": url, "filename": entry.get("server_filename") or f"file_{i + 1}", "size": int(entry.get("size") or 0)}
+            for i, (entry, url) in enumerate(zip(files, urls))
+        ]
+        title = root_entries[0].get("server_filename") if len(root_entries) == 1 else (info.get("title") or "Terabox_Folder")
+        details = {
+            "contents": contents,
+            "title": title or "Terabox Content",
+            "total_size": sum(item["size"] for item in contents),
+            "is_folder": is_folder
+        }
+        logger.info(f"Resolved share {share_id} natively: {len(contents)} file(s), {details['total_size']} bytes")
+        return details
+
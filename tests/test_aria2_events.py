@@ -0,0 +1,48 @@
+import asyncio
+
+import aria2_events
+from aria2_events import Aria2Notifier, aria2_ws_url
+
+
+def test_ws_url_follows_the_rpc_scheme():
+    assert aria2_ws_url("http://localhost", 6800) == "ws://localhost:6800/jsonrpc"
+    assert aria2_ws_url("https://aria2.example/", 443) == "wss://aria2.example:443/jsonrpc"
+    assert aria2_ws_url("localhost", 6800) == "ws://localhost:6800/jsonrpc"
+
+
+def test_without_websockets_waiters_poll_at_the_fallback_interval(monkeypatch):
+    monkeypatch.setattr(aria2_events, "websockets", None)
+    checks = []
+
+    async def check():
+        checks.append(None)
+        if len(checks) == 1:
+            raise ConnectionError("aria2 restarting")
+        return "complete" if len(checks) == 3 else None
+
+    async def scenario():
+        notifier = Aria2Notifier("ws://127.0.0.1:9/jsonrpc", check_interval=60, fallback_interval=0.01)
+        event = await asyncio.wait_for(notifier.wait("2089b05ecca3d829", check=check), timeout=1)
+        return event, notifier
+
+    event, notifier = asyncio.run(scenario())
+    assert event == "complete"
+    assert len(checks) == 3
+    assert notifier._waiters == {}
+
+
+def test_notifications_wake_waiters_and_early_ones_are_kept(monkeypatch):
+    monkeypatch.setattr(aria2_events, "websockets", None)
+
+    async def scenario():
+        notifier = Aria2Notifier("ws://127.0.0.1:9/jsonrpc", fallback_interval=60)
+        notifier._dispatch("early", "error")  # Arrives before anyone waits for it
+        waiters = [asyncio.create_task(notifier.wait("gid")) for _ in range(2)]
+        await asyncio.sleep(0)
+        notifier._dispatch("gid", "complete")
+        return await notifier.wait("early"), await asyncio.wait_for(asyncio.gather(*waiters), timeout=1), notifier
+
+    early, events, notifier = asyncio.run(scenario())
+    assert early == "error"
+    assert events == ["complete", "complete"]
+    assert notifier._recent_events == {}
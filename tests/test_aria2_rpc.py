@@ -0,0 +1,30 @@
+import asyncio
+import json
+
+import httpx
+
+from aria2_rpc import Aria2RPC
+
+
+def test_multicall_sends_the_secret_only_inside_each_call():
+    sent = []
+
+    def handler(request):
+        payload = json.loads(request.content)
+        sent.append(payload)
+        calls = payload["params"][0]
+        return httpx.Response(200, json={"id": payload["id"], "jsonrpc": "2.0", "result": [[{"gid": call["params"][1]}] for call in calls]})
+
+    async def scenario():
+        rpc = Aria2RPC(secret="s3cret")
+        rpc._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await rpc.tell_statuses(["a1", "b2"])
+        finally:
+            await rpc.close()
+
+    statuses = asyncio.run(scenario())
+    assert sorted(statuses) == ["a1", "b2"]
+    params = sent[0]["params"]
+    assert len(params) == 1 and isinstance(params[0], list)
+    assert all(call["params"][0] == "token:s3cret" for call in params[0])
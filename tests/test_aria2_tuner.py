@@ -0,0 +1,65 @@
+import random
+
+from aria2_tuner import MIB, Aria2Tuner, size_bucket, split_options
+
+URL = "https://d8.freeterabox.com/file/abc?fid=1"
+
+
+def test_sizes_fall_into_buckets():
+    assert size_bucket(0)[0] == "unknown"
+    assert size_bucket(MIB)[0] == "tiny"
+    assert size_bucket(16 * MIB)[0] == "small"
+    assert size_bucket(3000 * MIB)[0] == "large"
+
+
+def test_split_options_give_each_connection_one_segment():
+    assert split_options(8, 800 * MIB) == {"split": "8", "max-connection-per-server": "8", "min-split-size": "100M"}
+    assert split_options(4, 0)["min-split-size"] == "4M"
+    assert split_options(16, MIB)["min-split-size"] == "1M"
+
+
+def test_untried_counts_come_first_then_the_fastest():
+    tuner = Aria2Tuner(explore=0)
+    tried = []
+    for throughput in (20, 50, 10):  # MiB/s reached with each count in turn
+        options, tuning = tuner.choose(URL, 100 * MIB)
+        assert tuning.reason == "untried" and options["split"] == str(tuning.connections)
+        tried.append(tuning.connections)
+        tuner.record(tuning, throughput * MIB, 1)
+    assert tried == [8, 4, 2]  # Nearest to PREFERRED_CONNECTIONS first
+
+    _, tuning = tuner.choose(URL, 100 * MIB)
+    assert (tuning.connections, tuning.reason) == (4, "best")
+    assert tuner.stats() == {"d8.freeterabox.com small": {"connections": 4, "throughput": 50 * MIB}}
+
+    _, other_host = tuner.choose("https://d3.terabox.app/file/x", 100 * MIB)
+    assert other_host.reason == "untried"
+
+
+def test_throughput_is_a_moving_average_and_exploration_picks_any_count(monkeypatch):
+    tuner = Aria2Tuner(explore=0.5, alpha=0.5)
+    for connections in (8, 4, 2):
+        _, tuning = tuner.choose(URL, 100 * MIB)
+        tuner.record(tuning, connections * MIB, 1)
+    _, tuning = tuner.choose(URL, 100 * MIB)
+    tuning.connections = 8
+    tuner.record(tuning, 0, 1)  # Nothing downloaded: ignored
+    tuner.record(tuning, 2 * MIB, 1)
+    assert tuner._throughput[("d8.freeterabox.com", "small")][8] == [5 * MIB, 2]
+
+    monkeypatch.setattr(random, "random", lambda: 0.1)
+    monkeypatch.setattr(random, "choice", lambda candidates: candidates[0])
+    _, tuning = tuner.choose(URL, 100 * MIB)
+    assert (tuning.connections, tuning.reason) == (2, "explore")
+
+
+def test_learned_throughput_survives_a_restart(tmp_path):
+    path = str(tmp_path / "tuning.json")
+    tuner = Aria2Tuner(explore=0, path=path, save_interval=0)
+    for throughput in (20, 50, 10):
+        _, tuning = tuner.choose(URL, 100 * MIB)
+        tuner.record(tuning, throughput * MIB, 1)
+
+    reloaded = Aria2Tuner(explore=0, path=path)
+    _, tuning = reloaded.choose(URL, 100 * MIB)
+    assert (tuning.connections, tuning.reason) == (4, "best")
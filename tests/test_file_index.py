@@ -0,0 +1,11 @@
+from file_index import FileIndex
+
+
+def test_lookup_rejects_an_entry_whose_size_changed(tmp_path):
+    index = FileIndex(str(tmp_path / "index.db"))
+    index.record("abc", "movie.mp4", 1000, -100, 5, "file-id")
+
+    assert index.lookup("abc", "movie.mp4", 1000)["message_id"] == 5
+    assert index.lookup("abc", "movie.mp4")["file_id"] == "file-id"  # Size not known yet
+    assert index.lookup("abc", "movie.mp4", 2000) is None
+    assert index.lookup("abc", "other.mp4", 1000) is None
@@ -0,0 +1,36 @@
+import io
+
+from file_parts import FileRange, build_part_manifest, file_part_name, plan_file_parts
+
+
+def test_parts_cover_the_file_without_gaps():
+    assert plan_file_parts(10, 4) == [(0, 4), (4, 4), (8, 2)]
+    assert plan_file_parts(8, 4) == [(0, 4), (4, 4)]
+    assert plan_file_parts(0, 4) == []
+
+
+def test_file_range_reads_only_its_bytes(tmp_path):
+    path = tmp_path / "movie.mkv"
+    path.write_bytes(bytes(range(100)))
+    parts = [FileRange(str(path), offset, length, file_part_name("movie.mkv", number)) for number, (offset, length) in enumerate(plan_file_parts(100, 40), start=1)]
+    try:
+        assert [part.name for part in parts] == ["movie.mkv.001", "movie.mkv.002", "movie.mkv.003"]
+        assert b"".join(part.read() for part in parts) == bytes(range(100))
+
+        middle = parts[1]
+        assert middle.seek(-5, io.SEEK_END) == 35
+        assert middle.read(100) == bytes(range(75, 80))
+        assert middle.read() == b""
+        assert middle.seek(-1) == 0  # Clamped to the range
+        assert io.BufferedReader(middle).read(3) == bytes([40, 41, 42])
+    finally:
+        for part in parts:
+            part.close()
+    assert all(part.closed for part in parts)
+
+
+def test_manifest_lists_parts_and_escapes_names():
+    manifest = build_part_manifest("a&b.mkv", 100, ["a&b.mkv.001", "a&b.mkv.002"])
+    assert "1. <code>a&amp;b.mkv.001</code>" in manifest
+    assert 'cat "a&amp;b.mkv.001" "a&amp;b.mkv.002" &gt; "a&amp;b.mkv"' in manifest
+    assert 'copy /b "a&amp;b.mkv.001"+"a&amp;b.mkv.002" "a&amp;b.mkv"' in manifest
@@ -0,0 +1,43 @@
+import sqlite3
+
+from job_journal import JobJournal
+
+
+def create_job(journal: JobJournal) -> int:
+    return journal.create(1, 2, "user", "https://terabox.com/s/1abc", "abc", 1, 1, 10)
+
+
+def test_lookahead_states_round_trip_and_their_files_are_kept(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.db"))
+    job_id = create_job(journal)
+    journal.update(job_id, stage="uploading", file_index=0, file_path="/downloads/a.mp4", lookahead_states={
+        1: {"stage": "downloading", "gid": "2089b05ecca3d829", "file_path": "/downloads/b.mp4"},
+        2: {"stage": "uploading", "gid": None, "file_path": "/downloads/c.mp4"}
+    })
+
+    job = journal.get(job_id)
+    assert job["lookahead_states"][1]["gid"] == "2089b05ecca3d829"
+    assert sorted(job["lookahead_states"]) == [1, 2]
+    assert sorted(journal.file_paths()) == ["/downloads/a.mp4", "/downloads/b.mp4", "/downloads/c.mp4"]
+
+    journal.finish(job_id)
+    assert journal.file_paths() == []
+
+
+def test_journal_without_lookahead_column_is_migrated(tmp_path):
+    path = str(tmp_path / "journal.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (job_id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+        " user_name TEXT, url TEXT NOT NULL, share_id TEXT, target_chat_id INTEGER NOT NULL, status_chat_id INTEGER,"
+        " status_message_id INTEGER, title TEXT, is_folder INTEGER NOT NULL DEFAULT 0, contents TEXT,"
+        " file_index INTEGER NOT NULL DEFAULT 0, stage TEXT NOT NULL, gid TEXT, file_path TEXT,"
+        " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO jobs (chat_id, user_id, url, target_chat_id, stage, file_path, created_at, updated_at) VALUES (1, 2, 'u', 1, 'uploading', '/downloads/a.mp4', 0, 0)")
+    conn.commit()
+    conn.close()
+
+    journal = JobJournal(path)
+    assert journal.pending()[0]["lookahead_states"] == {}
+    assert journal.file_paths() == ["/downloads/a.mp4"]
@@ -0,0 +1,96 @@
+import asyncio
+
+from job_scheduler import OrderedPipeline
+from storage_manager import StorageManager
+
+
+def test_lookahead_item_never_holds_space_the_current_item_needs(tmp_path):
+    async def scenario():
+        storage = StorageManager(str(tmp_path), quota_bytes=10)
+        pipeline = OrderedPipeline(0, lookahead=1)
+        order = []
+
+        async def item(index, size, delay):
+            await asyncio.sleep(delay)
+            reservation = await pipeline.reserve(index, storage, size)
+            order.append(("reserved", index))
+            await pipeline.turn(index)
+            await asyncio.sleep(0.01)
+            reservation.release()
+            order.append(("done", index))
+            await pipeline.done(index)
+
+        # The look-ahead item asks first; two items do not fit in the quota together.
+        await asyncio.wait_for(asyncio.gather(item(0, 6, 0.01), item(1, 6, 0)), timeout=2)
+        return order
+
+    assert asyncio.run(scenario()) == [("reserved", 0), ("done", 0), ("reserved", 1), ("done", 1)]
+
+
+def test_lookahead_item_reserves_ahead_when_space_is_free(tmp_path):
+    async def scenario():
+        storage = StorageManager(str(tmp_path), quota_bytes=10)
+        pipeline = OrderedPipeline(0, lookahead=1)
+        first = await pipeline.reserve(0, storage, 4)
+        second = await asyncio.wait_for(pipeline.reserve(1, storage, 4), timeout=1)
+        return first, second, storage.reserved_bytes
+
+    first, second, reserved = asyncio.run(scenario())
+    assert first.size == second.size == 4
+    assert reserved == 8
+
+
+def test_items_deliver_in_folder_order_whatever_order_they_download_in():
+    async def scenario():
+        pipeline = OrderedPipeline(0, lookahead=2)
+        delivered = []
+
+        async def item(index, download_seconds):
+            await asyncio.sleep(download_seconds)
+            await pipeline.turn(index)
+            delivered.append(index)
+            await pipeline.done(index)
+
+        tasks = []
+        for index, download_seconds in enumerate([0.03, 0.01, 0.0, 0.02]):
+            await pipeline.window(index)
+            tasks.append(asyncio.create_task(item(index, download_seconds)))
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=2)
+        return delivered, pipeline.next_turn
+
+    assert asyncio.run(scenario()) == ([0, 1, 2, 3], 4)
+
+
+def test_window_keeps_items_within_the_lookahead():
+    async def scenario():
+        pipeline = OrderedPipeline(5, lookahead=1)
+        await asyncio.wait_for(pipeline.window(6), timeout=1)
+        blocked = asyncio.create_task(pipeline.window(7))
+        await asyncio.sleep(0.01)
+        was_blocked = not blocked.done()
+        await pipeline.done(6)  # A later item finishing first does not move the turn
+        await asyncio.sleep(0.01)
+        still_blocked = not blocked.done()
+        await pipeline.done(5)
+        await asyncio.wait_for(blocked, timeout=1)
+        return was_blocked, still_blocked, pipeline.next_turn
+
+    assert asyncio.run(scenario()) == (True, True, 7)
+
+
+def test_lookahead_downloads_wait_while_too_many_bytes_are_held():
+    async def scenario():
+        pipeline = OrderedPipeline(0, lookahead=3, max_bytes=100)
+        pipeline.hold(1, 60)
+        pipeline.hold(1, 120)  # The size of an item is replaced, not added
+        assert pipeline.held_bytes == 120
+        await asyncio.wait_for(pipeline.download_slot(0), timeout=1)  # The current turn never waits
+        blocked = asyncio.create_task(pipeline.download_slot(2))
+        await asyncio.sleep(0.01)
+        was_blocked = not blocked.done()
+        await pipeline.done(0)
+        await pipeline.done(1)
+        await asyncio.wait_for(blocked, timeout=1)
+        return was_blocked, pipeline.held_bytes
+
+    assert asyncio.run(scenario()) == (True, 0)
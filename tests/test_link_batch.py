@@ -0,0 +1,41 @@
+from link_batch import MAX_MESSAGE_CHARS, LinkBatch, dedupe_links, summarize_status
+
+
+def test_links_to_one_share_count_once_whatever_the_domain():
+    urls = [
+        "https://www.terabox.com/s/1AbCd",
+        "https://1024terabox.com/s/1XyZ",
+        "https://teraboxapp.com/sharing/link?surl=AbCd",
+        "https://example.com/not-a-share",
+        "https://example.com/not-a-share"
+    ]
+    assert dedupe_links(urls) == ["https://www.terabox.com/s/1AbCd", "https://1024terabox.com/s/1XyZ", "https://example.com/not-a-share"]
+
+
+def test_status_text_folds_into_one_plain_line():
+    text = "┏ ғɪʟᴇɴᴀᴍᴇ: <b>a&amp;b.mp4</b><br>┠ [★★☆☆☆☆☆☆☆☆] 20.00%<br>┖ sᴛᴀᴛᴜs: Downloading"
+    assert summarize_status(text) == "ғɪʟᴇɴᴀᴍᴇ: a&b.mp4 · [★★☆☆☆☆☆☆☆☆] 20.00% · sᴛᴀᴛᴜs: Downloading"
+    assert summarize_status("x" * 200, max_chars=10) == "x" * 9 + "…"
+
+
+def test_render_shows_each_link_and_the_progress_header():
+    batch = LinkBatch(["https://www.terabox.com/s/1a", "https://www.terabox.com/s/1b"], notes=["Restarted <now>"])
+    batch.update(0, "📥 <b>50%</b>")
+    batch.finish(1, "✅ sent")
+    assert batch.render().splitlines() == [
+        "📦 <b>Batch of 2 link(s)</b>: 1 finished, 1 in progress",
+        "Restarted &lt;now&gt;",
+        "",
+        "▫️ 1. 📥 50%",
+        "✔️ 2. ✅ sent"
+    ]
+    assert batch.item(1).index == 1
+
+
+def test_render_of_a_huge_batch_fits_in_one_message():
+    batch = LinkBatch([f"https://www.terabox.com/s/1link{i:04d}" for i in range(500)])
+    for i in range(500):
+        batch.update(i, "┏ " + "long status " * 20)
+    rendered = batch.render()
+    assert len(rendered) <= MAX_MESSAGE_CHARS
+    assert rendered.splitlines()[-1].startswith("… and ")
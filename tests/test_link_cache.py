@@ -0,0 +1,62 @@
+import time
+
+from link_cache import LinkCache, extract_share_id
+
+
+class Clock:
+    def __init__(self, monkeypatch):
+        self.now = 1_700_000_000.0
+        monkeypatch.setattr(time, "time", lambda: self.now)
+
+
+def test_share_id_ignores_the_host_and_the_link_form():
+    assert extract_share_id("https://www.terabox.com/s/1AbCd-9") == "AbCd-9"
+    assert extract_share_id("https://1024terabox.com/sharing/link?surl=AbCd-9") == "AbCd-9"
+    assert extract_share_id("https://teraboxapp.com/s/1AbCd-9?from=app") == "AbCd-9"
+    assert extract_share_id("https://www.terabox.com/main") is None
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = Clock(monkeypatch)
+    cache = LinkCache(ttl=100, negative_ttl=10)
+    cache.put("abc", {"title": "movie"})
+    cache.put_negative("dead", "share does not exist")
+
+    clock.now += 9
+    assert cache.get("abc") == ({"title": "movie"}, None)
+    assert cache.get("dead") == (None, "share does not exist")
+
+    clock.now += 2
+    assert cache.get("dead") is None
+    assert cache.get("abc") is not None
+
+    clock.now += 90
+    assert cache.get("abc") is None
+    assert cache.stats() == {"entries": 0, "hits": 2, "negative_hits": 1, "misses": 2, "evictions": 0, "hit_ratio": 0.6}
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = LinkCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (1, None)  # "b" is now the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == (1, None) and cache.get("c") == (3, None)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_live_entries_survive_a_restart(monkeypatch, tmp_path):
+    clock = Clock(monkeypatch)
+    path = str(tmp_path / "links.json")
+    cache = LinkCache(ttl=100, negative_ttl=10, path=path)
+    cache.put("abc", {"title": "movie"})
+    cache.put_negative("dead", "share does not exist")
+    cache.put("gone", {"title": "old"})
+    cache.invalidate("gone")
+
+    clock.now += 50
+    reloaded = LinkCache(ttl=100, negative_ttl=10, path=path)
+    assert reloaded.get("abc") == ({"title": "movie"}, None)
+    assert reloaded.get("dead") is None
+    assert reloaded.get("gone") is None
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+
+import link_refresh
+from link_refresh import LinkExpiryWatch, is_expiry_error, link_expired, match_refreshed_file
+
+
+def test_expiry_errors_are_resource_not_found_or_a_403_or_410():
+    assert is_expiry_error(3, "Resource not found")
+    assert is_expiry_error("22", "The response status is not successful. status=403")
+    assert is_expiry_error("22", "status=410")
+    assert not is_expiry_error("22", "status=503")
+    assert not is_expiry_error("1", None)
+
+
+def test_refreshed_file_is_found_by_name_then_by_position():
+    old = [{"filename": "E01.mp4", "url": "old1"}, {"filename": "E02.mp4", "url": "old2"}]
+    renamed = [{"filename": "a.mp4", "url": "new1"}, {"filename": "b.mp4", "url": "new2"}]
+    assert match_refreshed_file(old, [{"filename": "e02.MP4", "url": "new2"}, {"filename": "x.mp4", "url": "x"}, {"filename": "y", "url": "y"}], 1)["url"] == "new2"
+    assert match_refreshed_file(old, renamed, 1)["url"] == "new2"
+    assert match_refreshed_file(old, renamed[:1], 1) is None
+
+
+def test_link_counts_as_expired_only_when_the_cdn_refuses_it(monkeypatch):
+    statuses = {"https://cdn.test/expired": 403, "https://cdn.test/fine": 206}
+    real_client = httpx.AsyncClient
+
+    def handler(request):
+        if request.url.path == "/down":
+            raise httpx.ConnectError("unreachable")
+        assert request.headers["range"] == "bytes=0-0"
+        return httpx.Response(statuses[str(request.url)])
+
+    monkeypatch.setattr(link_refresh.httpx, "AsyncClient", lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+
+    async def scenario():
+        return [await link_expired(url) for url in ("https://cdn.test/expired", "https://cdn.test/fine", "https://cdn.test/down")]
+
+    assert asyncio.run(scenario()) == [True, False, False]
+
+
+def test_watch_reports_a_stall_once_per_period_and_counts_refreshes(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(link_refresh, "observe_link_refresh", lambda outcome: None)
+    watch = LinkExpiryWatch(stall_seconds=30, max_refreshes=1)
+
+    def snapshot(completed, status="active"):
+        return SimpleNamespace(status=status, completed_length=completed)
+
+    assert not watch.stalled(snapshot(100))
+    clock[0] += 29
+    assert not watch.stalled(snapshot(100))
+    clock[0] += 1
+    assert watch.stalled(snapshot(100))
+    assert not watch.stalled(snapshot(100))  # Counting starts again
+    clock[0] += 60
+    assert not watch.stalled(snapshot(100, "waiting"))  # Only an active download can stall
+
+    watch.refreshed("swapped")
+    assert watch.exhausted
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from membership_cache import MembershipCache
+
+
+def test_concurrent_checks_share_one_fetch_and_members_are_cached():
+    async def scenario():
+        cache = MembershipCache()
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return True
+
+        results = await asyncio.gather(*(cache.check(7, fetch) for _ in range(5)))
+        results.append(await cache.check(7, fetch))
+        return results, len(calls), cache.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == [True] * 6
+    assert calls == 1
+    assert stats == {"entries": 1, "hits": 1, "misses": 1, "coalesced": 4}
+
+
+def test_non_members_are_asked_again_after_the_negative_ttl():
+    async def scenario():
+        cache = MembershipCache(negative_ttl=0)
+        answers = iter([False, True])
+
+        async def fetch():
+            return next(answers)
+
+        return [await cache.check(7, fetch), await cache.check(7, fetch)]
+
+    assert asyncio.run(scenario()) == [False, True]
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    async def scenario():
+        cache = MembershipCache()
+        calls = []
+
+        async def failing():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            raise ConnectionError("Telegram unreachable")
+
+        results = await asyncio.gather(cache.check(7, failing), cache.check(7, failing), return_exceptions=True)
+
+        async def member():
+            return True
+
+        return results, len(calls), await cache.check(7, member)
+
+    results, calls, retried = asyncio.run(scenario())
+    assert [type(result) for result in results] == [ConnectionError, ConnectionError]
+    assert calls == 1
+    assert retried is True
+
+
+def test_update_during_a_fetch_wins_over_its_answer():
+    async def scenario():
+        cache = MembershipCache()
+        started = asyncio.Event()
+
+        async def stale_fetch():
+            started.set()
+            await asyncio.sleep(0.01)
+            return True
+
+        checking = asyncio.create_task(cache.check(7, stale_fetch))
+        await started.wait()
+        cache.store(7, False)  # chat_member update: the user just left
+        fetched = await checking
+
+        async def never():
+            raise AssertionError("the stored answer should be used")
+
+        return fetched, await cache.check(7, never)
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_waiter_fetches_itself_when_the_fetching_caller_is_cancelled():
+    async def scenario():
+        cache = MembershipCache()
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(10)
+
+        async def fast():
+            return True
+
+        first = asyncio.create_task(cache.check(7, slow))
+        await started.wait()
+        second = asyncio.create_task(cache.check(7, fast))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await asyncio.wait_for(second, timeout=1)
+
+    assert asyncio.run(scenario()) is True
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpcore
+import httpx
+import pytest
+
+from resolver_client import ResolverClient, _as_httpx_error
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{httpd.server_address[1]}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_requests_share_one_connection_and_one_dns_lookup(server):
+    async def scenario():
+        resolver = ResolverClient(http2=False)
+        try:
+            for _ in range(3):
+                response = await resolver.client.get(server)
+                assert response.text == "ok"
+            return resolver.stats()
+        finally:
+            await resolver.close()
+
+    stats = asyncio.run(scenario())
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["open"] == 1 and stats["idle"] == 1
+    assert stats["dns"]["misses"] == 1
+
+
+def test_connection_errors_surface_as_httpx_errors():
+    async def scenario():
+        resolver = ResolverClient(http2=False, timeout=5)
+        try:
+            await resolver.client.get("http://127.0.0.1:9/")
+        finally:
+            await resolver.close()
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(scenario())
+
+
+def test_concurrent_requests_share_one_dns_lookup(server):
+    async def scenario():
+        resolver = ResolverClient(http2=False)
+        try:
+            responses = await asyncio.gather(*(resolver.client.get(server) for _ in range(4)))
+            return [response.status_code for response in responses], resolver.stats()
+        finally:
+            await resolver.close()
+
+    statuses, stats = asyncio.run(scenario())
+    assert statuses == [200] * 4
+    assert stats["dns"]["misses"] == 1
+
+
+def test_a_client_closed_elsewhere_is_replaced_with_a_fresh_pool(server):
+    async def scenario():
+        resolver = ResolverClient(http2=False)
+        try:
+            await resolver.client.get(server)
+            first_pool = resolver._pool
+            await resolver.client.aclose()
+            await resolver.client.get(server)
+            return first_pool, resolver._pool
+        finally:
+            await resolver.close()
+
+    first_pool, second_pool = asyncio.run(scenario())
+    assert first_pool is not second_pool
+    assert first_pool.connections == []
+
+
+def test_httpcore_errors_map_to_the_httpx_types():
+    assert isinstance(_as_httpx_error(httpcore.ReadTimeout("slow")), httpx.ReadTimeout)
+    assert isinstance(_as_httpx_error(httpcore.RemoteProtocolError("bad")), httpx.RemoteProtocolError)
+    error = ValueError("not a transport error")
+    assert _as_httpx_error(error) is error
+
+
+def test_proxy_from_the_environment_bypasses_the_pool(monkeypatch, server):
+    monkeypatch.setenv("HTTPS_PROXY", "http://127.0.0.1:9")
+    monkeypatch.setenv("NO_PROXY", "localhost")
+
+    async def scenario():
+        resolver = ResolverClient(http2=False)
+        try:
+            response = await resolver.client.get(server)
+            return response.status_code, resolver.stats()
+        finally:
+            await resolver.close()
+
+    status_code, stats = asyncio.run(scenario())
+    assert status_code == 200
+    assert stats["open"] == 0 and stats["dns"]["misses"] == 0
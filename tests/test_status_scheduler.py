@@ -0,0 +1,87 @@
+import asyncio
+
+from status_scheduler import StatusScheduler, TokenBucket
+
+
+class FloodWait(Exception):
+    def __init__(self, value):
+        super().__init__(f"flood wait {value}")
+        self.value = value
+
+
+def flood_wait_seconds(error):
+    return error.value if isinstance(error, FloodWait) else None
+
+
+def test_token_bucket_spends_its_burst_then_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.take(now)
+    assert bucket.delay(now) == 0.5
+    assert not bucket.full(now + 0.5)
+    assert bucket.delay(now + 0.5) == 0
+    assert bucket.full(now + 5)
+    assert bucket.tokens == 2
+
+
+def test_only_the_latest_text_of_a_message_is_sent():
+    async def scenario():
+        scheduler = StatusScheduler(flood_wait_seconds, chat_rate=1000, chat_burst=1)
+        shown = []
+
+        async def edit(text):
+            shown.append(text)
+
+        for i in range(5):
+            scheduler.submit(1, 10, f"text {i}", edit)
+        await asyncio.sleep(0.05)
+        scheduler.submit(1, 10, "text 4", edit)  # Already shown
+        await asyncio.sleep(0.05)
+        return shown, scheduler.stats()
+
+    shown, stats = asyncio.run(scenario())
+    assert shown == ["text 4"]
+    assert stats["coalesced"] == 4 and stats["skipped"] == 1 and stats["sent"] == 1
+
+
+def test_flood_wait_keeps_the_text_pending_and_pauses_the_chat():
+    async def scenario():
+        scheduler = StatusScheduler(flood_wait_seconds, chat_rate=1000, chat_burst=5)
+        attempts = []
+
+        async def edit(text):
+            attempts.append(text)
+            if len(attempts) == 1:
+                raise FloodWait(0.1)
+
+        scheduler.submit(1, 10, "progress", edit)
+        await asyncio.sleep(0.05)
+        assert attempts == ["progress"] and scheduler.stats()["pending"] == 1
+        await asyncio.sleep(0.15)
+        return attempts, scheduler.stats()
+
+    attempts, stats = asyncio.run(scenario())
+    assert attempts == ["progress", "progress"]
+    assert stats["flood_waits"] == 1 and stats["sent"] == 1
+
+
+def test_idle_chats_and_ended_flood_waits_are_forgotten():
+    async def scenario():
+        scheduler = StatusScheduler(flood_wait_seconds, chat_rate=1000, chat_burst=1, global_rate=1000, global_burst=100, prune_interval=0)
+
+        async def edit(text):
+            pass
+
+        for chat_id in range(50):
+            scheduler.submit(chat_id, 1, "done", edit)
+        scheduler._blocked_until[99] = 0
+        await asyncio.sleep(0.05)
+        scheduler.submit(1000, 1, "done", edit)  # Wakes the worker after every bucket refilled
+        await asyncio.sleep(0.05)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert set(scheduler._chat_buckets) <= {1000}
+    assert scheduler._blocked_until == {}
+    assert scheduler._deliveries == set()
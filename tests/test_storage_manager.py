@@ -0,0 +1,31 @@
+import asyncio
+
+import pytest
+
+from storage_manager import StorageFull, StorageManager
+
+
+def test_release_and_shrinking_wake_waiting_reservations(tmp_path):
+    async def scenario():
+        storage = StorageManager(str(tmp_path), quota_bytes=10)
+        first = await storage.reserve(8)
+        waiter = asyncio.create_task(storage.reserve(5))
+        await asyncio.sleep(0.01)
+        assert not waiter.done() and not storage.fits(1)
+        first.resize(4)
+        second = await asyncio.wait_for(waiter, timeout=1)
+        first.release()
+        first.release()
+        await asyncio.sleep(0)
+        return storage, second
+
+    storage, second = asyncio.run(scenario())
+    assert second.size == 5
+    assert storage.reserved_bytes == 5
+    assert storage._notifications == set()
+
+
+def test_reservation_larger_than_the_quota_fails_at_once(tmp_path):
+    storage = StorageManager(str(tmp_path), quota_bytes=10)
+    with pytest.raises(StorageFull):
+        asyncio.run(storage.reserve(11))
@@ -0,0 +1,132 @@
+import asyncio
+
+import httpx
+import pytest
+
+from terabox_share import TeraboxShareError, TeraboxShareResolver
+
+BASE_URL = "https://www.terabox.test"
+COOKIE = "ndus=test"
+JS_TOKEN = "A3B1C2D4E5F60718293A4B5C6D7E8F90"
+SHARE_PAGE = (
+    "<html><head><script>var templateData = {\"bdstoken\":\"\",\"jsToken\":"
+    f"decodeURIComponent(%22function%20fn%28a%29%7Bwindow.jsToken%20%3D%20a%7D%3Bfn%28%22{JS_TOKEN}%22%29%22)}};"
+    "</script><link rel=\"preload\" href=\"/api/report?dp-logid=MjAyNDEwMTcxMjAw&amp;clienttype=0\"></head></html>"
+)
+
+
+def file_entry(fs_id: int, path: str, size: int, dlink: bool = True) -> dict:
+    entry = {"category": "1", "fs_id": str(fs_id), "isdir": "0", "path": path, "server_filename": path.rsplit("/", 1)[-1], "size": str(size)}
+    if dlink:
+        entry["dlink"] = f"{BASE_URL}/file/{fs_id}?sign=test"
+    return entry
+
+
+def folder_entry(fs_id: int, path: str) -> dict:
+    return {"category": "6", "fs_id": str(fs_id), "isdir": "1", "path": path, "server_filename": path.rsplit("/", 1)[-1], "size": "0"}
+
+
+class ShareAPI:
+    """Replays the share page, /api/shorturlinfo, /share/list and dlink answers recorded from www.terabox.com."""
+
+    def __init__(self, root: list, directories: dict = None, page: str = SHARE_PAGE, errno: int = 0, dlink_status: int = 302, first_listing_without_dlinks: bool = False):
+        self.root = root
+        self.directories = directories or {}
+        self.page = page
+        self.errno = errno
+        self.dlink_status = dlink_status
+        self.first_listing_without_dlinks = first_listing_without_dlinks
+        self.listed = set()
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        assert request.headers["cookie"] == COOKIE
+        path, params = request.url.path, request.url.params
+        if path == "/sharing/link":
+            return httpx.Response(200, text=self.page)
+        if path == "/api/shorturlinfo":
+            if self.errno:
+                return httpx.Response(200, json={"errno": self.errno, "request_id": 1, "show_msg": "share does not exist"})
+            return httpx.Response(200, json={"errno": 0, "title": "/share", "list": [dict(entry, dlink=None) for entry in self.root]})
+        if path == "/share/list":
+            assert params["jsToken"] == JS_TOKEN
+            directory = params.get("dir")
+            listing = self.root if params.get("root") == "1" else self.directories[directory]
+            if self.first_listing_without_dlinks and directory not in self.listed:
+                listing = [dict(entry, dlink=None) for entry in listing]
+            self.listed.add(directory)
+            return httpx.Response(200, json={"errno": 0, "list": listing})
+        if path.startswith("/file/"):
+            if self.dlink_status == 302:
+                return httpx.Response(302, headers={"Location": f"https://cdn.test/{path.rsplit('/', 1)[-1]}?signed=1"})
+            return httpx.Response(self.dlink_status)
+        return httpx.Response(404)
+
+    def count(self, path: str) -> int:
+        return sum(1 for request in self.requests if request.url.path.startswith(path))
+
+
+def resolve(api: ShareAPI, limit: int = None) -> dict:
+    resolver = TeraboxShareResolver(COOKIE, BASE_URL)
+    resolver._client = lambda: httpx.AsyncClient(headers={"Cookie": COOKIE}, transport=httpx.MockTransport(api))
+    return asyncio.run(resolver.resolve("https://terabox.com/s/1abcDEF", limit=limit))
+
+
+def test_single_file_takes_its_dlink_from_the_root_listing():
+    api = ShareAPI([file_entry(11, "/movie.mp4", 1000)])
+    details = resolve(api)
+    assert details == {
+        "contents": [{"url": "https://cdn.test/11?signed=1", "filename": "movie.mp4", "size": 1000}],
+        "title": "movie.mp4",
+        "total_size": 1000,
+        "is_folder": False
+    }
+
+
+def test_nested_folder_is_walked_and_limit_stops_the_dlink_lookups():
+    api = ShareAPI(
+        [folder_entry(1, "/show")],
+        {
+            "/show": [file_entry(11, "/show/e01.mp4", 100), folder_entry(2, "/show/extras")],
+            "/show/extras": [file_entry(21, "/show/extras/a.mp4", 20), file_entry(22, "/show/extras/b.mp4", 30)]
+        }
+    )
+    details = resolve(api)
+    assert details["is_folder"]
+    assert [item["filename"] for item in details["contents"]] == ["e01.mp4", "a.mp4", "b.mp4"]
+    assert details["total_size"] == 150
+
+    api.requests.clear()
+    details = resolve(api, limit=1)
+    assert [item["url"] for item in details["contents"]] == ["https://cdn.test/11?signed=1"]
+    assert details["is_folder"]
+    assert api.count("/file/") == 1
+    assert api.count("/share/list") == 1  # /show/extras is never listed
+
+
+def test_missing_dlinks_are_looked_up_in_their_own_directory():
+    api = ShareAPI(
+        [folder_entry(1, "/show")],
+        {"/show": [file_entry(11, "/show/e01.mp4", 100), file_entry(12, "/show/e02.mp4", 200)]},
+        first_listing_without_dlinks=True
+    )
+    details = resolve(api)
+    assert [item["url"] for item in details["contents"]] == ["https://cdn.test/11?signed=1", "https://cdn.test/12?signed=1"]
+    assert [request.url.params.get("dir") for request in api.requests if request.url.path == "/share/list"] == ["/show", "/show"]
+
+
+def test_missing_js_token_is_an_error():
+    with pytest.raises(TeraboxShareError, match="jsToken"):
+        resolve(ShareAPI([file_entry(11, "/movie.mp4", 1000)], page="<html><script>var templateData = {};</script></html>"))
+
+
+def test_nonzero_errno_is_an_error():
+    with pytest.raises(TeraboxShareError, match="errno -9"):
+        resolve(ShareAPI([file_entry(11, "/movie.mp4", 1000)], errno=-9))
+
+
+def test_dlink_answering_200_is_an_error():
+    # The dlink only downloads with the cookie, which aria2 does not have.
+    with pytest.raises(TeraboxShareError, match="without a redirect"):
+        resolve(ShareAPI([file_entry(11, "/movie.mp4", 1000)], dlink_status=200))
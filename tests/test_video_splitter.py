@@ -0,0 +1,57 @@
+import asyncio
+import os
+import stat
+
+from video_splitter import Keyframe, VideoSplitter, plan_cut_times
+
+
+def fake_ffmpeg(tmp_path) -> str:
+    """Writes one part, lists it on stdout like the segment muxer, then hangs like a long split."""
+    script = tmp_path / "ffmpeg"
+    script.write_text(
+        "#!/bin/sh\n"
+        f"printf 'x' > '{tmp_path}/video.001.mp4'\n"
+        "echo video.001.mp4\n"
+        "echo 'still splitting' >&2\n"
+        "exec sleep 30\n"
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(script)
+
+
+def test_aborted_split_stops_ffmpeg_and_leaves_no_pending_task(tmp_path):
+    source = tmp_path / "video.mp4"
+    source.write_bytes(bytes(100))
+
+    async def scenario():
+        splitter = VideoSplitter(str(source), str(tmp_path / "video"), split_size=50, ffmpeg=fake_ffmpeg(tmp_path), margin=0)
+        splitter.cut_times = [1.0, 2.0]
+        parts = splitter.parts()
+        first_part = await parts.__anext__()
+        await parts.aclose()  # The consumer gives up after the first part
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task() and not task.done()]
+        await splitter.close()
+        return first_part, splitter._proc.returncode, pending
+
+    first_part, returncode, pending = asyncio.run(scenario())
+    assert os.path.basename(first_part) == "video.001.mp4"
+    assert returncode is not None
+    assert pending == []
+    assert not os.path.exists(first_part)
+
+
+def test_each_part_ends_at_the_last_keyframe_that_fits():
+    keyframes = [Keyframe(10.0 + i, 40 * i) for i in range(6)]  # Times are relative to the first keyframe
+    assert plan_cut_times(keyframes, file_size=220, split_size=100, margin=0) == [2.0, 4.0]
+    assert plan_cut_times(keyframes, file_size=220, split_size=120, margin=20) == [2.0, 4.0]
+    assert plan_cut_times(keyframes[:3], file_size=90, split_size=100, margin=0) == []
+
+
+def test_tail_over_the_budget_gets_its_own_part():
+    keyframes = [Keyframe(0.0, 0), Keyframe(5.0, 50)]
+    assert plan_cut_times(keyframes, file_size=180, split_size=100, margin=0) == [5.0]
+
+
+def test_keyframe_gap_larger_than_a_part_still_cuts_there():
+    keyframes = [Keyframe(0.0, 0), Keyframe(7.5, 150)]
+    assert plan_cut_times(keyframes, file_size=200, split_size=100, margin=0) == [7.5]
@@ -0,0 +1,134 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from pyrogram.errors import FloodWait
+
+from metrics import observe_flood_wait
+
+logger = logging.getLogger(__name__)
+
+BOT_MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024
+PREMIUM_MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024
+
+
+class UploadSession:
+    """One MTProto client in an UploadPool and its load and flood-wait state."""
+
+    def __init__(self, name: str, client, max_file_size: int, max_active: int):
+        self.name = name
+        self.client = client
+        self.max_file_size = max_file_size
+        self.max_active = max_active
+        self.active = 0
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.flood_waits = 0
+        self.blocked_until = 0.0
+
+    def available(self, now: float) -> bool:
+        return self.active < self.max_active and self.blocked_until <= now
+
+
+class UploadPool:
+    """
+    Spreads uploads over several user sessions and bot tokens.
+
+    Each upload goes to the least-loaded session that may send a file of its
+    size and is not serving a flood wait. A FloodWait blocks only that
+    session, and the upload moves to another one. Uploads land in a dump
+    chat, so whichever session sent a file, the main bot delivers it to the
+    user with copy_message.
+    """
+
+    def __init__(self):
+        self.sessions = []
+        self._changed = None
+
+    def add(self, name: str, client, max_file_size: int = BOT_MAX_FILE_SIZE, max_active: int = 2):
+        self.sessions.append(UploadSession(name, client, max_file_size, max_active))
+
+    @property
+    def max_file_size(self) -> int:
+        return max((session.max_file_size for session in self.sessions), default=0)
+
+    async def start(self, skip=()):
+        """Starts every client except those in `skip` (e.g. the main bot, started elsewhere)."""
+        for session in self.sessions:
+            if session.client in skip:
+                continue
+            await session.client.start()
+            logger.info(f"Upload session {session.name} started")
+
+    async def stop(self, skip=()):
+        for session in self.sessions:
+            if session.client in skip:
+                continue
+            try:
+                await session.client.stop()
+            except Exception as e:
+                logger.warning(f"Could not stop upload session {session.name}: {e}")
+
+    def _pick(self, size: int, now: float):
+        candidates = [s for s in self.sessions if s.max_file_size >= size and s.available(now)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda s: (s.active / s.max_active, s.uploaded_bytes))
+
+    @asynccontextmanager
+    async def session(self, size: int = 0):
+        """Holds the least-loaded session able to send `size` bytes, waiting if all are busy."""
+        if size > self.max_file_size:
+            raise ValueError(f"No upload session can send {size} bytes (largest allowed is {self.max_file_size})")
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        async with self._changed:
+            while True:
+                now = time.monotonic()
+                chosen = self._pick(size, now)
+                if chosen is not None:
+                    break
+                blocked = [s.blocked_until - now for s in self.sessions if s.max_file_size >= size and s.blocked_until > now]
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=min(blocked) if blocked else None)
+                except asyncio.TimeoutError:
+                    pass
+            chosen.active += 1
+        try:
+            yield chosen
+        finally:
+            chosen.active -= 1
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def send_video(self, chat_id, path: str, size: int, **kwargs):
+        """Uploads `path` through the pool, moving to another session on a FloodWait."""
+        while True:
+            async with self.session(size) as upload_session:
+                try:
+                    sent = await upload_session.client.send_video(chat_id, path, **kwargs)
+                except FloodWait as e:
+                    upload_session.flood_waits += 1
+                    upload_session.blocked_until = time.monotonic() + e.value
+                    observe_flood_wait("upload", e.value)
+                    logger.warning(f"Upload session {upload_session.name} hit a {e.value}s flood wait; retrying on another session")
+                    continue
+                upload_session.uploads += 1
+                upload_session.uploaded_bytes += size
+                return sent
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [
+            {
+                "name": session.name,
+                "active": session.active,
+                "uploads": session.uploads,
+                "uploaded_bytes": session.uploaded_bytes,
+                "flood_waits": session.flood_waits,
+                "blocked_for": max(0.0, session.blocked_until - now)
+            }
+            for session in self.sessions
+        ]
@@ -0,0 +1,166 @@
+# pylint: disable=logging-fstring-interpolation, disable=broad-except, disable=invalid-name
+import asyncio
+import logging
+import os
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Keyframe = namedtuple("Keyframe", ["time", "pos"])
+
+
+class SplitError(Exception):
+    """Raised when a video cannot be probed or split within the size limit."""
+    pass
+
+
+async def probe_keyframes(input_path: str, ffprobe: str = "ffprobe") -> list:
+    """
+    Lists the keyframes of the first video stream (or, for audio-only files,
+    the first audio stream) as (time in seconds, byte position) pairs.
+    Only the container is demuxed; nothing is decoded.
+    """
+    for stream in ("v:0", "a:0"):
+        proc = await asyncio.create_subprocess_exec(
+            ffprobe, "-v", "error", "-select_streams", stream,
+            "-show_entries", "packet=pts_time,pos,flags", "-of", "csv=p=0", input_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode != 0:
+            raise SplitError(f"ffprobe failed on {input_path}: {stderr.decode(errors='replace')[-300:]}")
+        keyframes = []
+        for line in stdout.decode(errors="replace").splitlines():
+            fields = line.strip().split(",")
+            if len(fields) < 3 or "K" not in fields[2]:
+                continue
+            try:
+                keyframes.append(Keyframe(float(fields[0]), int(fields[1])))
+            except ValueError:
+                continue  # N/A timestamps or positions
+        if keyframes:
+            return sorted(keyframes, key=lambda keyframe: keyframe.pos)
+    raise SplitError(f"No keyframes found in {input_path}")
+
+
+def plan_cut_times(keyframes: list, file_size: int, split_size: int, margin: int) -> list:
+    """
+    Picks cut points so that each part stays under `split_size - margin`
+    bytes: every part ends at the last keyframe that still fits. Returns the
+    cut times in seconds, relative to the first keyframe.
+    """
+    budget = split_size - margin
+    first_time = keyframes[0].time
+    cut_times = []
+    part_start = 0
+    candidate = None
+    for keyframe in keyframes[1:]:
+        while keyframe.pos - part_start > budget:
+            if candidate is None:
+                logger.warning(f"Keyframe gap before {keyframe.time:.2f}s is larger than {budget} bytes; that part will be oversized")
+                candidate = keyframe
+            cut_times.append(candidate.time - first_time)
+            part_start = candidate.pos
+            candidate = None
+        if keyframe.pos > part_start:
+            candidate = keyframe
+    if file_size - part_start > budget and candidate is not None and candidate.pos > part_start:
+        cut_times.append(candidate.time - first_time)
+    return cut_times
+
+
+class VideoSplitter:
+    """
+    Splits a video into parts under a byte limit with a single ffmpeg pass.
+
+    `plan()` reads the keyframe index and chooses cut points from the real
+    byte positions, so variable-bitrate files do not produce oversized parts.
+    `parts()` then runs the segment muxer once and yields every part as
+    soon as ffmpeg closes it, so uploads can start while it keeps splitting.
+    `close()` stops ffmpeg and deletes parts that were not consumed.
+    """
+
+    def __init__(self, input_path: str, output_prefix: str, split_size: int, ffmpeg: str = "xtra", ffprobe: str = "ffprobe", margin: int = None):
+        self.input_path = input_path
+        self.output_prefix = output_prefix
+        self.split_size = split_size
+        self.ffmpeg = ffmpeg
+        self.ffprobe = ffprobe
+        self.margin = margin if margin is not None else max(split_size // 50, 16 * 1024 * 1024)  # Container overhead per part
+        self.extension = os.path.splitext(input_path)[1].lower() or ".mp4"
+        self.cut_times = None
+        self._proc = None
+
+    @property
+    def total_parts(self) -> int:
+        return len(self.cut_times) + 1 if self.cut_times is not None else 0
+
+    def part_path(self, number: int) -> str:
+        return f"{self.output_prefix}.{number:03d}{self.extension}"
+
+    async def plan(self) -> int:
+        """Chooses the cut points and returns the number of parts."""
+        file_size = os.path.getsize(self.input_path)
+        if file_size <= self.split_size:
+            self.cut_times = []
+            return 1
+        keyframes = await probe_keyframes(self.input_path, self.ffprobe)
+        self.cut_times = plan_cut_times(keyframes, file_size, self.split_size, self.margin)
+        logger.info(f"Splitting {self.input_path} ({file_size} bytes) into {self.total_parts} parts at {self.cut_times}")
+        return self.total_parts
+
+    async def parts(self):
+        if self.cut_times is None:
+            await self.plan()
+        if not self.cut_times:
+            yield self.input_path
+            return
+        cmd = [
+            self.ffmpeg, "-y", "-v", "error", "-i", self.input_path,
+            "-c", "copy", "-map", "0",
+            "-f", "segment",
+            "-segment_times", ",".join(f"{max(t - 0.001, 0):.3f}" for t in self.cut_times),  # Land on the keyframe itself
+            "-segment_start_number", "1",
+            "-segment_list", "pipe:1", "-segment_list_type", "flat",
+            "-reset_timestamps", "1",
+            "-avoid_negative_ts", "make_zero",
+            f"{self.output_prefix.replace('%', '%%')}.%03d{self.extension}"
+        ]
+        self._proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stderr_task = asyncio.create_task(self._proc.stderr.read())
+        output_dir = os.path.dirname(self.output_prefix)
+        try:
+            while True:
+                line = await self._proc.stdout.readline()
+                if not line:
+                    break
+                part_path = os.path.join(output_dir, line.decode(errors="replace").strip())
+                part_size = os.path.getsize(part_path)
+                if part_size > self.split_size:
+                    raise SplitError(f"{os.path.basename(part_path)} is {part_size} bytes, over the {self.split_size} byte limit")
+                yield part_path
+            returncode = await self._proc.wait()
+            stderr = await stderr_task
+        finally:
+            if not stderr_task.done():  # Aborted mid-split; close() stops ffmpeg
+                stderr_task.cancel()
+                try:
+                    await stderr_task
+                except asyncio.CancelledError:
+                    pass
+        if returncode != 0:
+            raise SplitError(f"ffmpeg exited with {returncode}: {stderr.decode(errors='replace')[-300:]}")
+
+    async def close(self):
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+            await self._proc.wait()
+        if self.cut_times:
+            for number in range(1, self.total_parts + 1):
+                part_path = self.part_path(number)
+                if os.path.exists(part_path):
+                    try:
+                        os.remove(part_path)
+                    except OSError as e:
+                        logger.warning(f"Could not delete split part {part_path}: {e}")